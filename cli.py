@@ -16,6 +16,7 @@ from jinja2 import Environment, PackageLoader
 import tqdm
 
 from qanta import qlogging
+from qanta.config import conf
 from qanta.guesser.abstract import AbstractGuesser
 from qanta.guesser.elasticsearch import elasticsearch_cli
 from qanta.util.environment import ENVIRONMENT
@@ -50,8 +51,13 @@ main.add_command(ingestion_cli, name="map")
 @click.option("--host", default="0.0.0.0")
 @click.option("--port", default=5000)
 @click.option("--debug", default=False)
+@click.option(
+    "--micro-batching/--no-micro-batching",
+    default=None,
+    help="Batch concurrent requests, defaults to guess_batching.enabled in the config",
+)
 @click.argument("guessers", nargs=-1)
-def guesser_api(host, port, debug, guessers):
+def guesser_api(host, port, debug, micro_batching, guessers):
     if debug:
         log.warning(
             "WARNING: debug mode can expose environment variables (AWS keys), NEVER use when API is exposed to  web"
@@ -61,7 +67,9 @@ def guesser_api(host, port, debug, guessers):
         if confirmation != "yes":
             raise ValueError("Most confirm enabling debug mode")
 
-    AbstractGuesser.multi_guesser_web_api(guessers, host=host, port=port, debug=debug)
+    AbstractGuesser.multi_guesser_web_api(
+        guessers, host=host, port=port, debug=debug, micro_batching=micro_batching
+    )
 
 
 def run_guesser(n_times, workers, guesser_qualified_class):
@@ -146,8 +154,16 @@ def generate_guesser_slurm(slurm_config_file, task, output_dir):
     enabled_guessers = list(AbstractGuesser.list_enabled_guessers())
 
     for i, gs in enumerate(enabled_guessers):
-        if gs.guesser_class == "ElasticSearchGuesser":
-            raise ValueError("ElasticSearchGuesser is not compatible with slurm")
+        if (
+            gs.guesser_class == "ElasticSearchGuesser"
+            and conf["guessers"][f"{gs.guesser_module}.{gs.guesser_class}"][
+                gs.config_num
+            ]["backend"]
+            != "bm25"
+        ):
+            raise ValueError(
+                "ElasticSearchGuesser is only compatible with slurm using the bm25 backend"
+            )
         elif gs.guesser_class in slurm_config:
             guesser_slurm_config = slurm_config[gs.guesser_class]
         else:
@@ -14,10 +14,12 @@ from pedroai.plot import theme_pedroai
 from rich.console import Console
 from rich.progress import track
 
+from qanta.datasets.protobowl import load_protobowl
 from qanta.datasets.quiz_bowl import QuizBowlDataset
 from qanta.guesser.abstract import AbstractGuesser
 from qanta.reporting.curve_score import CurveScore
 from qanta.util.constants import QANTA_MAPPED_DATASET_PATH
+from qanta.util.dataset_io import dataset_path, iter_questions, read_dataset
 
 console = Console()
 app = typer.Typer()
@@ -27,9 +29,9 @@ app = typer.Typer()
 def export(output_file: str, fold: str = "buzztest"):
     fold = "buzztest"
     guesses_dir = AbstractGuesser.output_path("qanta.guesser.rnn", "RnnGuesser", 0, "")
-    guesses_dir = AbstractGuesser.guess_path(guesses_dir, fold, "char")
-    with open(guesses_dir, "rb") as f:
-        guesses = pickle.load(f)
+    guesses = AbstractGuesser.load_guesses(
+        guesses_dir, output_type="char", folds=[fold]
+    )
     guesses = guesses.groupby("qanta_id")
 
     questions = QuizBowlDataset(buzzer_train=True).questions_by_fold()
@@ -110,10 +112,11 @@ TEMPLATE = r"""
 @app.command()
 def latex(qid: int, buzz_file: str, output_file: str):
     questions = {
-        q["qanta_id"]: q for q in read_json(QANTA_MAPPED_DATASET_PATH)["questions"]
+        q["qanta_id"]: q
+        for q in iter_questions(dataset_path(QANTA_MAPPED_DATASET_PATH))
     }
     buzzes = read_json(buzz_file)
-    proto_df = pd.read_hdf("data/external/datasets/protobowl/protobowl-042818.log.h5")
+    proto_df = load_protobowl()
 
     computer_buzzes = buzzes[str(qid)]
     proto_id = questions[qid]["proto_id"]
@@ -190,8 +193,8 @@ def latex(qid: int, buzz_file: str, output_file: str):
 
 @app.command()
 def plot_empirical_buzz():
-    proto_df = pd.read_hdf("data/external/datasets/protobowl/protobowl-042818.log.h5")
-    dataset = read_json(QANTA_MAPPED_DATASET_PATH)
+    proto_df = load_protobowl()
+    dataset = read_dataset(dataset_path(QANTA_MAPPED_DATASET_PATH))
     questions = {q["qanta_id"]: q for q in dataset["questions"]}
     folds = {
         q["proto_id"]: q["fold"]
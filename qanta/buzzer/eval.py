@@ -124,9 +124,9 @@ def protobowl(model, fold=BUZZER_DEV_FOLD):
 
     """eval"""
     guesses_dir = AbstractGuesser.output_path("qanta.guesser.rnn", "RnnGuesser", 0, "")
-    guesses_dir = AbstractGuesser.guess_path(guesses_dir, fold, "char")
-    with open(guesses_dir, "rb") as f:
-        guesses = pickle.load(f)
+    guesses = AbstractGuesser.load_guesses(
+        guesses_dir, output_type="char", folds=[fold]
+    )
     guesses = guesses.groupby("qanta_id")
 
     questions = QuizBowlDataset(buzzer_train=True).questions_by_fold()
@@ -155,9 +155,9 @@ def ew(model, fold=BUZZER_DEV_FOLD):
     buzzes = get_buzzes(model, fold)
 
     guesses_dir = AbstractGuesser.output_path("qanta.guesser.rnn", "RnnGuesser", 0, "")
-    guesses_dir = AbstractGuesser.guess_path(guesses_dir, fold, "char")
-    with open(guesses_dir, "rb") as f:
-        guesses = pickle.load(f)
+    guesses = AbstractGuesser.load_guesses(
+        guesses_dir, output_type="char", folds=[fold]
+    )
     guesses = guesses.groupby("qanta_id")
 
     answers = dict()
@@ -104,9 +104,9 @@ def protobowl(fold=BUZZER_DEV_FOLD):
 
 def stack(model_dir, model_name, fold=BUZZER_DEV_FOLD):
     guesses_dir = AbstractGuesser.output_path("qanta.guesser.rnn", "RnnGuesser", 0, "")
-    guesses_dir = AbstractGuesser.guess_path(guesses_dir, fold, "char")
-    with open(guesses_dir, "rb") as f:
-        guesses = pickle.load(f)
+    guesses = AbstractGuesser.load_guesses(
+        guesses_dir, output_type="char", folds=[fold]
+    )
     guesses = guesses.groupby("qanta_id")
 
     buzzes_dir = os.path.join(model_dir, "{}_buzzes.pkl".format(fold))
@@ -170,9 +170,7 @@ def read_data(
     g_dir = AbstractGuesser.output_path(
         guesser_module, guesser_class, guesser_config_num, ""
     )
-    g_path = AbstractGuesser.guess_path(g_dir, fold, output_type)
-    with open(g_path, "rb") as f:
-        df = pickle.load(f)
+    df = AbstractGuesser.load_guesses(g_dir, output_type=output_type, folds=[fold])
     df_groups = df.groupby("qanta_id")
 
     questions = QuizBowlDataset(buzzer_train=True).questions_by_fold()
@@ -1,16 +1,11 @@
+from typing import List, Tuple, Dict, Iterator, Optional
 import os
-import sys
 import json
-import codecs
 import pickle
 import pathlib
-import itertools
 import numpy as np
 import pandas as pd
-from collections import defaultdict
-from functools import partial
 from multiprocessing import Pool
-from datetime import datetime
 import matplotlib
 
 matplotlib.use("Agg")
@@ -26,42 +21,155 @@ from plotnine import (
 )
 
 
-def process_log_line(x):
-    """Process a single line of the log"""
-    obj = x["object"]
-    date = datetime.strptime(x["date"][:-6], "%a %b %d %Y %H:%M:%S %Z%z")
-    relative_position = obj["time_elapsed"] / obj["time_remaining"]
-    return (
-        [
-            date,
-            obj["guess"],
-            obj["qid"],
-            obj["time_elapsed"],
-            obj["time_remaining"],
-            relative_position,
-            obj["ruling"],
-            obj["user"]["id"],
-        ],
-        obj["qid"],
-        obj["question_text"],
-    )
+PROTOBOWL_COLUMNS = [
+    "date",
+    "guess",
+    "qid",
+    "time_elapsed",
+    "time_remaining",
+    "relative_position",
+    "result",
+    "uid",
+    "user_n_records",
+]
+# Columns read from the log, the others are computed from them
+LOG_FIELDS = ["date", "guess", "qid", "time_elapsed", "time_remaining", "result", "uid"]
+# Bytes of the log parsed by each task of the process pool
+SHARD_BYTES = 64 * 1024 * 1024
+# Dates are javascript Date strings, "GMT" is a literal since pandas cannot parse %Z with %z
+DATE_FORMAT = "%a %b %d %Y %H:%M:%S GMT%z"
+
+
+def shard_ranges(path: str, shard_bytes=SHARD_BYTES) -> List[Tuple[int, int]]:
+    size = os.path.getsize(path)
+    return [
+        (start, min(start + shard_bytes, size)) for start in range(0, size, shard_bytes)
+    ]
+
+
+def follows_record_end(f, position: int, chunk_size=4096) -> bool:
+    """
+    Whether the line at position starts a record, that is it is the first line of the log or the
+    last non blank line before it ends with "}}". Moves the file position.
+    """
+    window_start = position
+    while window_start > 0:
+        window_start = max(0, window_start - chunk_size)
+        f.seek(window_start)
+        preceding = f.read(position - window_start).rstrip()
+        # Two characters are needed to tell whether the line ends with "}}"
+        if len(preceding) >= 2 or (window_start == 0 and len(preceding) > 0):
+            return preceding.endswith(b"}}")
+    return True
 
 
-# remove duplicate records
-def remove_duplicate(df_grouped, uid):
-    """For each user, only take the first record for each question"""
-    group = df_grouped.get_group(uid)
-    user_questions = set()
-    index = group.date.sort_values()
-    rows = []
-    for _, row in group.loc[index.index].iterrows():
-        if row.qid in user_questions:
+def read_records(f, start: int, end: int) -> Iterator[str]:
+    """
+    Records of the log whose first line starts in the byte range [start, end). Records usually
+    take one line, those split across lines are joined until the line that ends with "}}", which
+    may be past the end of the range. Lines before the first record starting in the range are
+    continuations of a record of the previous range and are skipped.
+    """
+    if start > 0:
+        # Move to the first line starting at or after start, a line starting exactly at start
+        # belongs to this range
+        f.seek(start - 1)
+        f.readline()
+    line_start = f.tell()
+    in_record = not follows_record_end(f, line_start)
+    f.seek(line_start)
+    tail = b""
+    while f.tell() < end:
+        line = f.readline()
+        if len(line) == 0:
+            break
+        line = line.strip()
+        if len(line) == 0:
+            continue
+        if in_record:
+            tail = (tail + line)[-2:]
+            in_record = tail != b"}}"
             continue
-        user_questions.add(row.qid)
-        rows.append(row)
-    for j, row in enumerate(rows):
-        rows[j].user_n_records = len(rows)
-    return rows
+        while not line.endswith(b"}}"):
+            next_line = f.readline()
+            if len(next_line) == 0:
+                break
+            line += next_line.strip()
+        yield line
+
+
+def parse_shard(
+    path: str, start: int, end: int
+) -> Tuple[Dict[str, list], Dict[str, str]]:
+    """
+    Extract the fields of the buzz records in a byte range of the log, records that are not valid
+    json are skipped
+
+    :return: the values of each field, and the text of each question in the range
+    """
+    columns = {name: [] for name in LOG_FIELDS}
+    questions = {}
+    with open(path, "rb") as f:
+        for line in read_records(f, start, end):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            obj = record["object"]
+            columns["date"].append(record["date"])
+            columns["guess"].append(obj["guess"])
+            columns["qid"].append(obj["qid"])
+            columns["time_elapsed"].append(obj["time_elapsed"])
+            columns["time_remaining"].append(obj["time_remaining"])
+            columns["result"].append(obj["ruling"])
+            columns["uid"].append(obj["user"]["id"])
+            if obj["qid"] not in questions:
+                questions[obj["qid"]] = obj["question_text"]
+    return columns, questions
+
+
+def parse_protobowl_log(
+    path: str, n_procs: Optional[int] = None
+) -> Tuple[pd.DataFrame, Dict[str, str]]:
+    """
+    Parse the protobowl log in byte range shards with a process pool
+
+    :return: a dataframe of all buzz records, without user_n_records, and the text of each
+        question
+    """
+    shards = shard_ranges(path)
+    with Pool(n_procs) as pool:
+        shard_results = pool.starmap(
+            parse_shard, [(path, start, end) for start, end in shards]
+        )
+
+    columns = {
+        name: [v for shard_columns, _ in shard_results for v in shard_columns[name]]
+        for name in LOG_FIELDS
+    }
+    questions = {}
+    for _, shard_questions in shard_results:
+        for qid, text in shard_questions.items():
+            if qid not in questions:
+                questions[qid] = text
+
+    df = pd.DataFrame(columns)
+    # Dates look like "Fri Apr 27 2018 12:34:56 GMT-0400 (EDT)", the time zone name is dropped
+    df["date"] = pd.to_datetime(df["date"].str[:-6], format=DATE_FORMAT, utc=True)
+    df["relative_position"] = df["time_elapsed"] / df["time_remaining"]
+    return df, questions
+
+
+def remove_duplicates(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    For each user, only take the first record for each question, and count the questions of each
+    user in user_n_records. Records are sorted by user then date.
+    """
+    df = df.sort_values(["uid", "date"], kind="mergesort").drop_duplicates(
+        ["uid", "qid"], keep="first"
+    )
+    df = df.assign(user_n_records=df.groupby("uid")["qid"].transform("size"))
+    return df[PROTOBOWL_COLUMNS].reset_index(drop=True)
 
 
 def load_protobowl(
@@ -74,6 +182,9 @@ def load_protobowl(
     Remove duplicates: for each user, only keep the first record for each
     question.
 
+    The deduplicated records of all users are cached as parquet next to the
+    log, so that later loads only read the cache and filter users.
+
     Args
         protobowl_dir: json log
         min_user_questions: minimum number of questions answered
@@ -81,92 +192,32 @@ def load_protobowl(
         df: dataframe of buzzing records
         questions: protobowl questions
     """
-    df_dir = protobowl_dir + ".h5"
+    df_dir = protobowl_dir + ".parquet"
     question_dir = protobowl_dir + ".questions.pkl"
 
-    if os.path.exists(df_dir) and os.path.exists(df_dir):
-        with pd.HDFStore(df_dir) as store:
-            df = store["data"]
+    if os.path.exists(df_dir) and os.path.exists(question_dir):
+        df = pd.read_parquet(df_dir)
+        # Rulings are true, false, or a string such as "prompt", stored as json in parquet
+        df["result"] = df["result"].map(
+            {r: json.loads(r) for r in df["result"].unique()}
+        )
         with open(question_dir, "rb") as f:
             questions = pickle.load(f)
-        if get_questions:
-            return df, questions
-        else:
-            return df
-
-    # parse protobowl json log
-    data = []
-    count = 0
-    user_questions = defaultdict(set)
-    questions = dict()
-    with codecs.open(protobowl_dir, "r", "utf-8") as f:
-        line = f.readline()
-        while line is not None:
-            line = line.strip()
-            if len(line) < 1:
-                break
-            while not line.endswith("}}"):
-                _line = f.readline()
-                if _line is None:
-                    break
-                line += _line.strip()
-            try:
-                line = json.loads(line)
-            except ValueError:
-                line = f.readline()
-                if line is None:
-                    break
-                continue
-            count += 1
-            if count % 10000 == 0:
-                sys.stderr.write("\rdone: {}/5130000".format(count))
-            x, qid, question_text = process_log_line(line)
-            if qid not in questions:
-                questions[qid] = question_text
-            user_questions[x[-1]].add(qid)  # x[-1] is uid
-            data.append(x)
-            line = f.readline()
-
-    # filter users without enough questions
-    filtered_data = []
-    for x in data:
-        uid = x[-1]
-        if len(user_questions[uid]) >= min_user_questions:
-            x.append(len(user_questions[uid]))
-            filtered_data.append(x)
-
-    df = pd.DataFrame(
-        filtered_data,
-        columns=[
-            "date",
-            "guess",
-            "qid",
-            "time_elapsed",
-            "time_remaining",
-            "relative_position",
-            "result",
-            "uid",
-            "user_n_records",
-        ],
-    )
-
-    df_grouped = df.groupby("uid")
-    uids = list(df_grouped.groups.keys())
-    pool = Pool(8)
-    _remove_duplicate = partial(remove_duplicate, df_grouped)
-    user_rows = pool.map(_remove_duplicate, uids)
-    df = pd.DataFrame(list(itertools.chain(*user_rows)), columns=df.columns)
-    df_grouped = df.groupby("uid")
+    else:
+        df, questions = parse_protobowl_log(protobowl_dir)
+        df = remove_duplicates(df)
+        cached_df = df.assign(
+            result=df["result"].map({r: json.dumps(r) for r in df["result"].unique()})
+        )
+        cached_df.to_parquet(df_dir)
+        with open(question_dir, "wb") as f:
+            pickle.dump(questions, f)
 
-    print("{} users".format(len(df_grouped)))
+    df = df[df.user_n_records >= min_user_questions].reset_index(drop=True)
+    print("{} users".format(df.uid.nunique()))
     print("{} records".format(len(df)))
-    print("{} questions".format(len(set(df.qid))))
+    print("{} questions".format(df.qid.nunique()))
 
-    # save
-    with pd.HDFStore(df_dir) as store:
-        store["data"] = df
-    with open(question_dir, "wb") as f:
-        pickle.dump(questions, f)
     if get_questions:
         return df, questions
     else:
@@ -0,0 +1,144 @@
+from typing import List, Optional, Iterable
+import os
+import json
+import sqlite3
+from contextlib import closing
+
+from qanta import qlogging
+from qanta.util.dataset_io import open_dataset
+
+
+log = qlogging.get(__name__)
+
+# Bump when the layout of the cache changes so that existing caches are recompiled
+CACHE_FORMAT = 1
+
+
+class QuestionCache:
+    def __init__(self, dataset_path: str, cache_path: Optional[str] = None):
+        """
+        Compiled SQLite copy of a qanta dataset json or jsonl file. Each question is stored as its json
+        together with its position in the dataset, qanta_id, fold, and page, the last three being
+        indexed. Reading a fold is then an indexed query that only parses the questions in that
+        fold instead of the whole dataset.
+
+        The cache is compiled the first time it is opened and recompiled whenever the dataset file
+        changes, staleness is detected from the size and modification time of the dataset file.
+
+        :param dataset_path: path to the dataset file, see qanta.util.dataset_io
+        :param cache_path: where to store the compiled cache, by default next to the dataset
+        """
+        self.dataset_path = dataset_path
+        if cache_path is None:
+            cache_path = dataset_path + ".sqlite3"
+        self.cache_path = cache_path
+        if not self._is_fresh():
+            self.compile()
+        with closing(self._connect()) as conn:
+            self.version = self._meta(conn)["version"]
+
+    def _source_stat(self):
+        stat = os.stat(self.dataset_path)
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    def _connect(self):
+        # Connections are opened per read so that the cache is safe to use after forking
+        return sqlite3.connect(f"file:{self.cache_path}?mode=ro", uri=True)
+
+    @staticmethod
+    def _meta(conn):
+        return json.loads(conn.execute("SELECT meta FROM meta").fetchone()[0])
+
+    def _is_fresh(self) -> bool:
+        if not os.path.exists(self.cache_path):
+            return False
+        try:
+            with closing(self._connect()) as conn:
+                meta = self._meta(conn)
+        except sqlite3.Error:
+            return False
+        return meta["format"] == CACHE_FORMAT and meta["source"] == self._source_stat()
+
+    def compile(self) -> None:
+        log.info(f"Compiling {self.dataset_path} into {self.cache_path}")
+        source_stat = self._source_stat()
+
+        # Build in a temporary file and move it in place so concurrent readers never see a
+        # partially written cache
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        conn = sqlite3.connect(tmp_path)
+        conn.execute("CREATE TABLE meta (meta TEXT NOT NULL)")
+        conn.execute(
+            """
+            CREATE TABLE questions (
+              position INT PRIMARY KEY NOT NULL, qanta_id INT NOT NULL,
+              fold TEXT NOT NULL, page TEXT, question TEXT NOT NULL
+            )
+        """
+        )
+        with open_dataset(self.dataset_path) as (header, questions):
+            conn.executemany(
+                "INSERT INTO questions VALUES (?, ?, ?, ?, ?)",
+                (
+                    (i, q["qanta_id"], q["fold"], q["page"], json.dumps(q))
+                    for i, q in enumerate(questions)
+                ),
+            )
+        conn.execute("CREATE INDEX questions_fold ON questions (fold, page)")
+        conn.execute("CREATE INDEX questions_page ON questions (page)")
+        conn.execute("CREATE INDEX questions_qanta_id ON questions (qanta_id)")
+        conn.execute(
+            "INSERT INTO meta VALUES (?)",
+            (
+                json.dumps(
+                    {
+                        "format": CACHE_FORMAT,
+                        "source": source_stat,
+                        "version": header["version"],
+                    }
+                ),
+            ),
+        )
+        conn.commit()
+        conn.close()
+        os.replace(tmp_path, self.cache_path)
+
+    def _query(self, where: str, params) -> List[dict]:
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                f"SELECT question FROM questions {where} ORDER BY position", params
+            ).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def questions(
+        self, folds: Optional[Iterable[str]] = None, mapped_only=False
+    ) -> List[dict]:
+        """
+        :param folds: if given, only return questions in these folds
+        :param mapped_only: if True, only return questions that have a page
+        :return: questions as dictionaries in dataset order
+        """
+        conditions = []
+        params = []
+        if folds is not None:
+            folds = list(folds)
+            conditions.append(f"fold IN ({', '.join('?' for _ in folds)})")
+            params.extend(folds)
+        if mapped_only:
+            conditions.append("page IS NOT NULL")
+        if len(conditions) == 0:
+            return self._query("", params)
+        else:
+            return self._query("WHERE " + " AND ".join(conditions), params)
+
+    def page_questions(self, page: str) -> List[dict]:
+        return self._query("WHERE page = ?", (page,))
+
+    def question(self, qanta_id: int) -> Optional[dict]:
+        questions = self._query("WHERE qanta_id = ?", (qanta_id,))
+        if len(questions) == 0:
+            return None
+        else:
+            return questions[0]
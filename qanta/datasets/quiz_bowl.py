@@ -1,9 +1,12 @@
-from typing import List, Dict, Iterable, Optional, Tuple, NamedTuple
+from typing import List, Dict, Iterable, Optional, Tuple, NamedTuple, Mapping
+from functools import lru_cache
 import os
 import json
 
 from qanta import qlogging
 from qanta.datasets.abstract import AbstractDataset, TrainingData
+from qanta.datasets.question_cache import QuestionCache
+from qanta.util.dataset_io import dataset_path as configured_dataset_path, read_dataset
 from qanta.util.constants import (
     QANTA_MAPPED_DATASET_PATH,
     QANTA_EXPO_DATASET_PATH,
@@ -77,68 +80,164 @@ class Question(NamedTuple):
 
         :param char_skip: Number of characters to skip each time
         """
-        char_indices = list(range(char_skip, len(self.text) + char_skip, char_skip))
+        char_indices = self.run_indices(char_skip)
         return [self.text[:i] for i in char_indices], char_indices
 
+    def run_indices(self, char_skip: int) -> List[int]:
+        """
+        Returns only the character indices that Question.runs would use, without building the text of
+        each run
+
+        :param char_skip: Number of characters to skip each time
+        """
+        return list(range(char_skip, len(self.text) + char_skip, char_skip))
+
 
 class QantaDatabase:
     def __init__(
-        self, dataset_path=QANTA_MAPPED_DATASET_PATH, expo_path=QANTA_EXPO_DATASET_PATH
+        self, dataset_path: Optional[str] = None, expo_path=QANTA_EXPO_DATASET_PATH
     ):
-        with open(dataset_path) as f:
-            self.dataset = json.load(f)
-
-        self.version = self.dataset["version"]
-        self.raw_questions = self.dataset["questions"]
-        self.all_questions = [Question(**q) for q in self.raw_questions]
-        self.mapped_questions = [q for q in self.all_questions if q.page is not None]
-
-        self.train_questions = [
-            q for q in self.mapped_questions if q.fold in TRAIN_FOLDS
-        ]
-        self.guess_train_questions = [
-            q for q in self.train_questions if q.fold == GUESSER_TRAIN_FOLD
-        ]
-        self.buzz_train_questions = [
-            q for q in self.train_questions if q.fold == BUZZER_TRAIN_FOLD
-        ]
-
-        self.dev_questions = [q for q in self.mapped_questions if q.fold in DEV_FOLDS]
-        self.guess_dev_questions = [
-            q for q in self.dev_questions if q.fold == GUESSER_DEV_FOLD
-        ]
-        self.buzz_dev_questions = [
-            q for q in self.dev_questions if q.fold == BUZZER_DEV_FOLD
-        ]
-
-        self.buzz_test_questions = [
-            q for q in self.mapped_questions if q.fold == BUZZER_TEST_FOLD
-        ]
-        self.guess_test_questions = [
-            q for q in self.mapped_questions if q.fold == GUESSER_TEST_FOLD
-        ]
-
-        if os.path.exists(expo_path):
-            with open(expo_path) as f:
-                self.expo_dataset = json.load(f)
-                self.expo_questions = [
-                    Question(**q) for q in self.expo_dataset["questions"]
+        """
+        Questions are read from a QuestionCache compiled from the dataset json or jsonl, each group
+        of questions below is only read the first time it is accessed. Use qanta_database to share
+        one instance within a process.
+
+        :param dataset_path: by default the mapped dataset in the configured dataset_format
+        """
+        if dataset_path is None:
+            dataset_path = configured_dataset_path(QANTA_MAPPED_DATASET_PATH)
+        self.dataset_path = dataset_path
+        self.expo_path = expo_path
+        self.cache = QuestionCache(dataset_path)
+        self.version = self.cache.version
+        self._questions = {}
+
+    def _load(self, key, folds=None, mapped_only=True) -> List[Question]:
+        if key not in self._questions:
+            self._questions[key] = [
+                Question(**q)
+                for q in self.cache.questions(folds=folds, mapped_only=mapped_only)
+            ]
+        return self._questions[key]
+
+    @property
+    def dataset(self):
+        return read_dataset(self.dataset_path)
+
+    @property
+    def raw_questions(self):
+        return self.cache.questions()
+
+    @property
+    def all_questions(self):
+        return self._load("all", mapped_only=False)
+
+    @property
+    def mapped_questions(self):
+        return self._load("mapped")
+
+    @property
+    def train_questions(self):
+        return self._load("train", folds=TRAIN_FOLDS)
+
+    @property
+    def guess_train_questions(self):
+        return self._load(GUESSER_TRAIN_FOLD, folds=[GUESSER_TRAIN_FOLD])
+
+    @property
+    def buzz_train_questions(self):
+        return self._load(BUZZER_TRAIN_FOLD, folds=[BUZZER_TRAIN_FOLD])
+
+    @property
+    def dev_questions(self):
+        return self._load("dev", folds=DEV_FOLDS)
+
+    @property
+    def guess_dev_questions(self):
+        return self._load(GUESSER_DEV_FOLD, folds=[GUESSER_DEV_FOLD])
+
+    @property
+    def buzz_dev_questions(self):
+        return self._load(BUZZER_DEV_FOLD, folds=[BUZZER_DEV_FOLD])
+
+    @property
+    def buzz_test_questions(self):
+        return self._load(BUZZER_TEST_FOLD, folds=[BUZZER_TEST_FOLD])
+
+    @property
+    def guess_test_questions(self):
+        return self._load(GUESSER_TEST_FOLD, folds=[GUESSER_TEST_FOLD])
+
+    @property
+    def expo_dataset(self):
+        if os.path.exists(self.expo_path):
+            return read_dataset(self.expo_path)
+        else:
+            return None
+
+    @property
+    def expo_questions(self):
+        if EXPO_FOLD not in self._questions:
+            expo_dataset = self.expo_dataset
+            if expo_dataset is None:
+                self._questions[EXPO_FOLD] = []
+            else:
+                self._questions[EXPO_FOLD] = [
+                    Question(**q) for q in expo_dataset["questions"]
                 ]
+        return self._questions[EXPO_FOLD]
+
+    def question(self, qanta_id: int) -> Optional[Question]:
+        q = self.cache.question(qanta_id)
+        if q is None:
+            return None
         else:
-            self.expo_dataset = None
-            self.expo_questions = []
-
-    def by_fold(self):
-        return {
-            GUESSER_TRAIN_FOLD: self.guess_train_questions,
-            GUESSER_DEV_FOLD: self.guess_dev_questions,
-            BUZZER_TRAIN_FOLD: self.buzz_train_questions,
-            BUZZER_DEV_FOLD: self.buzz_dev_questions,
-            BUZZER_TEST_FOLD: self.buzz_test_questions,
-            GUESSER_TEST_FOLD: self.guess_test_questions,
-            EXPO_FOLD: self.expo_questions,
+            return Question(**q)
+
+    def page_questions(self, page: str) -> List[Question]:
+        return [Question(**q) for q in self.cache.page_questions(page)]
+
+    def by_fold(self) -> Mapping[str, List[Question]]:
+        return FoldQuestions(self)
+
+
+class FoldQuestions(Mapping):
+    """
+    Read only mapping from fold to the questions in that fold which only loads a fold when it is
+    looked up
+    """
+
+    def __init__(self, db: QantaDatabase):
+        self.db = db
+        self.fold_attributes = {
+            GUESSER_TRAIN_FOLD: "guess_train_questions",
+            GUESSER_DEV_FOLD: "guess_dev_questions",
+            BUZZER_TRAIN_FOLD: "buzz_train_questions",
+            BUZZER_DEV_FOLD: "buzz_dev_questions",
+            BUZZER_TEST_FOLD: "buzz_test_questions",
+            GUESSER_TEST_FOLD: "guess_test_questions",
+            EXPO_FOLD: "expo_questions",
         }
 
+    def __getitem__(self, fold: str) -> List[Question]:
+        return getattr(self.db, self.fold_attributes[fold])
+
+    def __iter__(self):
+        return iter(self.fold_attributes)
+
+    def __len__(self):
+        return len(self.fold_attributes)
+
+
+@lru_cache(maxsize=None)
+def qanta_database(
+    dataset_path: Optional[str] = None, expo_path=QANTA_EXPO_DATASET_PATH
+) -> QantaDatabase:
+    """
+    Process wide QantaDatabase so that questions are read at most once per process
+    """
+    return QantaDatabase(dataset_path=dataset_path, expo_path=expo_path)
+
 
 class QuizBowlDataset(AbstractDataset):
     def __init__(self, *, guesser_train=False, buzzer_train=False) -> None:
@@ -156,7 +255,7 @@ class QuizBowlDataset(AbstractDataset):
                 "Using QuizBowlDataset with guesser and buzzer training data, make sure you know what you are doing!"
             )
 
-        self.db = QantaDatabase()
+        self.db = qanta_database()
         self.guesser_train = guesser_train
         self.buzzer_train = buzzer_train
 
@@ -175,16 +274,8 @@ class QuizBowlDataset(AbstractDataset):
 
         return training_examples, training_pages, None
 
-    def questions_by_fold(self) -> Dict[str, List[Question]]:
-        return {
-            GUESSER_TRAIN_FOLD: self.db.guess_train_questions,
-            GUESSER_DEV_FOLD: self.db.guess_dev_questions,
-            BUZZER_TRAIN_FOLD: self.db.buzz_train_questions,
-            BUZZER_DEV_FOLD: self.db.buzz_dev_questions,
-            BUZZER_TEST_FOLD: self.db.buzz_test_questions,
-            GUESSER_TEST_FOLD: self.db.guess_test_questions,
-            EXPO_FOLD: self.db.expo_questions,
-        }
+    def questions_by_fold(self) -> Mapping[str, List[Question]]:
+        return self.db.by_fold()
 
     def questions_in_folds(self, folds: Iterable[str]) -> List[Question]:
         by_fold = self.questions_by_fold()
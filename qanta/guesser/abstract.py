@@ -11,13 +11,22 @@ import matplotlib
 with warnings.catch_warnings():
     warnings.simplefilter("ignore")
     matplotlib.use("Agg")
+import numpy as np
 import pandas as pd
 
 from qanta.datasets.abstract import TrainingData, QuestionText, Page
-from qanta.datasets.quiz_bowl import QuizBowlDataset, QantaDatabase
+from qanta.datasets.quiz_bowl import QuizBowlDataset, Question, qanta_database
 from qanta.config import conf
 from qanta.util import constants as c
 from qanta.util.io import safe_path
+from qanta.guesser.guess_cache import create_guess_cache
+from qanta.guesser.serving import (
+    create_micro_batcher,
+    load_serving_guesser,
+    FanOut,
+    merge_guesses,
+)
+from qanta.guesser.guess_store import write_guesses, read_guesses, ChunkedGuessWriter
 from qanta import qlogging
 
 
@@ -43,8 +52,88 @@ GuesserSpec = NamedTuple(
 
 Guess = namedtuple("Guess", "fold guess guesser qnum score sentence token")
 
+GuessArrays = NamedTuple(
+    "GuessArrays",
+    [("pages", List[Page]), ("indices", np.ndarray), ("scores", np.ndarray)],
+)
+"""
+Guesses for many questions as arrays rather than lists of tuples. indices is an int32
+[n_questions, max_n_guesses] matrix of positions in pages ordered from best to worst guess and
+padded with -1 when a question has fewer guesses, scores is the float32 matrix of matching scores.
+"""
+
+
+def run_prefixes(
+    questions: List[QuestionText], char_indices: List[List[int]]
+) -> List[QuestionText]:
+    run_texts = []
+    for text, indices in zip(questions, char_indices):
+        run_texts.extend(text[:char_ix] for char_ix in indices)
+    return run_texts
+
+
+def guesses_to_arrays(guesses: List[List[Tuple[Page, float]]]) -> GuessArrays:
+    page_ids = {}
+    width = max((len(g) for g in guesses), default=0)
+    indices = np.full((len(guesses), width), -1, dtype=np.int32)
+    scores = np.zeros((len(guesses), width), dtype=np.float32)
+    for i, question_guesses in enumerate(guesses):
+        for j, (page, score) in enumerate(question_guesses):
+            indices[i, j] = page_ids.setdefault(page, len(page_ids))
+            scores[i, j] = score
+    return GuessArrays(list(page_ids), indices, scores)
+
+
+def arrays_to_guesses(arrays: GuessArrays) -> List[List[Tuple[Page, float]]]:
+    pages = arrays.pages
+    return [
+        [(pages[p], s) for p, s in zip(row_indices, row_scores) if p >= 0]
+        for row_indices, row_scores in zip(
+            arrays.indices.tolist(), arrays.scores.tolist()
+        )
+    ]
+
+
+def guess_dataframe(
+    arrays: GuessArrays,
+    qanta_ids: np.ndarray,
+    proto_ids: np.ndarray,
+    char_indices: np.ndarray,
+    fold_codes: np.ndarray,
+    folds: List[str],
+    guesser_name: str,
+) -> pd.DataFrame:
+    """
+    Assemble the guess dataframe, one row per (run, guess), from per run arrays without iterating
+    over rows. Page, fold, and guesser columns are categorical.
+    """
+    valid = arrays.indices >= 0
+    n_guesses = valid.sum(axis=1)
+    n_rows = int(n_guesses.sum())
+    guesses = pd.Categorical.from_codes(arrays.indices[valid], categories=arrays.pages)
+    return pd.DataFrame(
+        {
+            "qanta_id": np.repeat(qanta_ids.astype(np.int32), n_guesses),
+            "proto_id": np.repeat(proto_ids, n_guesses),
+            "char_index": np.repeat(char_indices.astype(np.int32), n_guesses),
+            "guess": guesses.remove_unused_categories(),
+            "score": arrays.scores[valid],
+            "fold": pd.Categorical.from_codes(
+                np.repeat(fold_codes, n_guesses), categories=folds
+            ),
+            "guesser": pd.Categorical.from_codes(
+                np.zeros(n_rows, dtype=np.int8), categories=[guesser_name]
+            ),
+        }
+    )
+
 
 class AbstractGuesser(metaclass=ABCMeta):
+    # Whether guess spends most of its time in code that releases the GIL, such as numpy, torch, or
+    # waiting on another process. Web apis call such guessers from threads, others are loaded in
+    # their own process.
+    releases_gil = False
+
     def __init__(self, config_num: Optional[int]):
         """
         Abstract class representing a guesser. All abstract methods must be implemented. Class
@@ -102,6 +191,87 @@ class AbstractGuesser(metaclass=ABCMeta):
         """
         pass
 
+    def guess_runs(
+        self,
+        questions: List[QuestionText],
+        char_indices: List[List[int]],
+        max_n_guesses: Optional[int],
+    ) -> List[List[List[Tuple[Page, float]]]]:
+        """
+        Given a list of questions and for each question a list of increasing character indices,
+        return guesses for every prefix question[:char_ix]. Guesses follow the same conventions as
+        AbstractGuesser.guess.
+
+        The default implementation materializes every prefix and calls AbstractGuesser.guess once on
+        all of them. Guessers whose representation of a prefix can be updated as more of the
+        question is read should override this so that overlapping prefixes are not re-processed
+        from scratch.
+
+        :param questions: Full text of the questions to guess on
+        :param char_indices: For each question, the character indices of the runs to guess on
+        :param max_n_guesses: Number of guesses to produce per run, if None then return all
+        of them if possible
+        :return: For each question, the list of top guesses per run
+        """
+        run_texts = run_prefixes(questions, char_indices)
+        guesses_per_run = self.guess(run_texts, max_n_guesses)
+        if len(guesses_per_run) != len(run_texts):
+            raise ValueError(
+                "Guesser has wrong number of answers: len(guesses_per_run)={} len(run_texts)={}".format(
+                    len(guesses_per_run), len(run_texts)
+                )
+            )
+
+        guesses_per_question = []
+        start = 0
+        for indices in char_indices:
+            guesses_per_question.append(guesses_per_run[start : start + len(indices)])
+            start += len(indices)
+        return guesses_per_question
+
+    def guess_arrays(
+        self, questions: List[QuestionText], max_n_guesses: Optional[int]
+    ) -> GuessArrays:
+        """
+        Same as AbstractGuesser.guess, but returns the guesses as GuessArrays. The default
+        implementation converts the output of AbstractGuesser.guess, guessers that compute a score
+        matrix over their answer vocabulary should override this to return it without building
+        tuples per guess.
+
+        :param questions: Questions to guess on
+        :param max_n_guesses: Number of guesses to produce per question, if None then return all
+        of them if possible
+        :return: top guesses of every question
+        """
+        return guesses_to_arrays(self.guess(questions, max_n_guesses))
+
+    def guess_runs_arrays(
+        self,
+        questions: List[QuestionText],
+        char_indices: List[List[int]],
+        max_n_guesses: Optional[int],
+        qanta_ids: Optional[List[int]] = None,
+    ) -> GuessArrays:
+        """
+        Same as AbstractGuesser.guess_runs, but returns the guesses of all runs of all questions
+        flattened into a single GuessArrays. Guessers overriding guess_runs keep using it, otherwise
+        every prefix is passed to AbstractGuesser.guess_arrays.
+
+        :param qanta_ids: qanta_id of each question if known, guessers may use it to cache work
+            done per question across calls
+        """
+        if type(self).guess_runs is not AbstractGuesser.guess_runs:
+            guesses_per_question = self.guess_runs(
+                questions, char_indices, max_n_guesses
+            )
+            return guesses_to_arrays(
+                [run_guesses for q in guesses_per_question for run_guesses in q]
+            )
+        else:
+            return self.guess_arrays(
+                run_prefixes(questions, char_indices), max_n_guesses
+            )
+
     @classmethod
     @abstractmethod
     def targets(cls) -> List[str]:
@@ -185,83 +355,202 @@ class AbstractGuesser(metaclass=ABCMeta):
         dataset = self.qb_dataset()
         questions_by_fold = dataset.questions_by_fold()
 
-        q_folds = []
-        q_qnums = []
-        q_char_indices = []
-        q_proto_ids = []
-        question_texts = []
+        questions = []
+        q_fold_codes = []
+        for fold_code, fold in enumerate(folds):
+            questions.extend(questions_by_fold[fold])
+            q_fold_codes.extend(fold_code for _ in questions_by_fold[fold])
+
+        if full_question:
+            output_type = "full"
+        elif first_sentence:
+            output_type = "first"
+        else:
+            output_type = "char"
+        return self._guess_questions(
+            questions,
+            q_fold_codes,
+            folds,
+            max_n_guesses,
+            [output_type],
+            char_skip=char_skip,
+        )[output_type]
+
+    def generate_guesses_chunked(
+        self,
+        max_n_guesses: int,
+        fold: str,
+        directory: str,
+        output_types: List[str],
+        char_skip=25,
+        chunk_size=1000,
+    ) -> None:
+        """
+        Generates guesses for all questions in fold like AbstractGuesser.generate_guesses, but
+        guesses on chunk_size questions at a time and writes each chunk to the guess files for
+        output_types in directory before moving on. Peak memory is bounded by the chunk size
+        rather than the fold size, and if a previous call with the same arguments was killed
+        generation resumes after the last chunk it wrote.
+
+        All output types are computed from a single pass over each chunk, see
+        AbstractGuesser._guess_questions.
 
-        for fold in folds:
-            questions = questions_by_fold[fold]
-            for q in questions:
-                if full_question:
-                    question_texts.append(q.text)
-                    q_folds.append(fold)
-                    q_qnums.append(q.qanta_id)
-                    q_char_indices.append(len(q.text))
-                    q_proto_ids.append(q.proto_id)
-                elif first_sentence:
-                    question_texts.append(q.first_sentence)
-                    q_folds.append(fold)
-                    q_qnums.append(q.qanta_id)
-                    q_char_indices.append(q.tokenizations[0][1])
-                    q_proto_ids.append(q.proto_id)
-                else:
-                    for text_run, char_ix in zip(*q.runs(char_skip)):
-                        question_texts.append(text_run)
-                        q_folds.append(fold)
-                        q_qnums.append(q.qanta_id)
-                        q_char_indices.append(char_ix)
-                        q_proto_ids.append(q.proto_id)
-
-        guesses_per_question = self.guess(question_texts, max_n_guesses)
-
-        if len(guesses_per_question) != len(question_texts):
+        :param max_n_guesses: generate at most this many guesses per question, sentence, and token
+        :param fold: which fold to generate guesses for
+        :param directory: guesser directory to write guesses to
+        :param output_types: Any of: char, full, first
+        :param char_skip: generate guesses every char_skip characters for char guesses
+        :param chunk_size: number of questions to guess on at a time
+        """
+        for output_type in output_types:
+            if output_type not in {"char", "full", "first"}:
+                raise ValueError(f"Invalid output_type: {output_type}")
+        if len(output_types) == 0:
+            return
+
+        questions = sorted(
+            self.qb_dataset().questions_by_fold()[fold], key=lambda q: q.qanta_id
+        )
+        writers = {
+            output_type: ChunkedGuessWriter(
+                AbstractGuesser.guess_path(directory, fold, output_type),
+                {
+                    "guesser": self.display_name(),
+                    "max_n_guesses": max_n_guesses,
+                    "char_skip": char_skip,
+                    "chunk_size": chunk_size,
+                    "n_questions": len(questions),
+                },
+            )
+            for output_type in output_types
+        }
+        # Writers may be one chunk apart if the previous run was killed between writing them
+        first_chunk = min(w.n_completed for w in writers.values())
+        if first_chunk > 0:
+            log.info(f"Resuming guesses for {fold} fold after {first_chunk} chunks")
+
+        for start in range(first_chunk * chunk_size, len(questions), chunk_size):
+            chunk = start // chunk_size
+            chunk_output_types = [
+                output_type
+                for output_type, writer in writers.items()
+                if writer.n_completed == chunk
+            ]
+            chunk_questions = questions[start : start + chunk_size]
+            log.info(
+                f"Guessing on questions {start} to {start + len(chunk_questions)} of {len(questions)}"
+            )
+            guess_dfs = self._guess_questions(
+                chunk_questions,
+                [0] * len(chunk_questions),
+                [fold],
+                max_n_guesses,
+                chunk_output_types,
+                char_skip=char_skip,
+            )
+            for output_type in chunk_output_types:
+                writers[output_type].write_chunk(guess_dfs[output_type])
+
+        for writer in writers.values():
+            writer.finish()
+
+    def _guess_questions(
+        self,
+        questions: List[Question],
+        q_fold_codes: List[int],
+        folds: List[str],
+        max_n_guesses: int,
+        output_types: List[str],
+        char_skip=25,
+    ) -> Dict[str, pd.DataFrame]:
+        """
+        Guess on questions and return a guess dataframe per output type. Char runs, the full
+        question, and the first sentence are all prefixes of the question text, so each distinct
+        prefix is guessed on once and shared by every output type that needs it. The full question
+        is the same text as the last char run, the first sentence is usually close to a char run.
+        """
+        # Character indices recorded in the dataframe of each output type, per question
+        output_char_indices = {}
+        for output_type in output_types:
+            if output_type == "char":
+                output_char_indices[output_type] = [
+                    q.run_indices(char_skip) for q in questions
+                ]
+            elif output_type == "full":
+                output_char_indices[output_type] = [[len(q.text)] for q in questions]
+            else:
+                output_char_indices[output_type] = [
+                    [q.tokenizations[0][1]] for q in questions
+                ]
+
+        # Prefixes past the end of the text are the full text, so clamp before deduplicating
+        prefix_indices = []
+        for i, q in enumerate(questions):
+            q_indices = set()
+            for char_indices in output_char_indices.values():
+                q_indices.update(
+                    min(char_ix, len(q.text)) for char_ix in char_indices[i]
+                )
+            prefix_indices.append(sorted(q_indices))
+
+        n_prefixes = sum(len(indices) for indices in prefix_indices)
+        log.info(
+            f"Guessing on {n_prefixes} distinct prefixes of {len(questions)} questions"
+        )
+        guess_arrays = self.guess_runs_arrays(
+            [q.text for q in questions],
+            prefix_indices,
+            max_n_guesses,
+            qanta_ids=[q.qanta_id for q in questions],
+        )
+        if len(guess_arrays.indices) != n_prefixes:
             raise ValueError(
-                "Guesser has wrong number of answers: len(guesses_per_question)={} len(question_texts)={}".format(
-                    len(guesses_per_question), len(question_texts)
+                "Guesser has wrong number of answers: len(guess_arrays.indices)={} n_prefixes={}".format(
+                    len(guess_arrays.indices), n_prefixes
                 )
             )
 
-        log.info("Creating guess dataframe from guesses...")
-        df_qnums = []
-        df_proto_id = []
-        df_char_indices = []
-        df_guesses = []
-        df_scores = []
-        df_folds = []
-        df_guessers = []
-        guesser_name = self.display_name()
-
-        for i in range(len(question_texts)):
-            guesses_with_scores = guesses_per_question[i]
-            fold = q_folds[i]
-            qnum = q_qnums[i]
-            proto_id = q_proto_ids[i]
-            char_ix = q_char_indices[i]
-            for guess, score in guesses_with_scores:
-                df_qnums.append(qnum)
-                df_proto_id.append(proto_id)
-                df_char_indices.append(char_ix)
-                df_guesses.append(guess)
-                df_scores.append(score)
-                df_folds.append(fold)
-                df_guessers.append(guesser_name)
-
-        return pd.DataFrame(
-            {
-                "qanta_id": df_qnums,
-                "proto_id": df_proto_id,
-                "char_index": df_char_indices,
-                "guess": df_guesses,
-                "score": df_scores,
-                "fold": df_folds,
-                "guesser": df_guessers,
-            }
-        )
+        prefix_starts = np.cumsum([0] + [len(indices) for indices in prefix_indices])
+        guess_dfs = {}
+        for output_type, char_indices_per_question in output_char_indices.items():
+            rows = []
+            for i, q in enumerate(questions):
+                positions = {char_ix: p for p, char_ix in enumerate(prefix_indices[i])}
+                rows.extend(
+                    prefix_starts[i] + positions[min(char_ix, len(q.text))]
+                    for char_ix in char_indices_per_question[i]
+                )
+            runs_per_question = np.array(
+                [len(indices) for indices in char_indices_per_question], dtype=np.int64
+            )
+            log.info(f"Creating {output_type} guess dataframe from guesses...")
+            guess_dfs[output_type] = guess_dataframe(
+                GuessArrays(
+                    guess_arrays.pages,
+                    guess_arrays.indices[rows],
+                    guess_arrays.scores[rows],
+                ),
+                np.repeat([q.qanta_id for q in questions], runs_per_question),
+                np.repeat(
+                    np.array([q.proto_id for q in questions], dtype=object),
+                    runs_per_question,
+                ),
+                np.array(
+                    [ix for indices in char_indices_per_question for ix in indices],
+                    dtype=np.int32,
+                ),
+                np.repeat(np.array(q_fold_codes, dtype=np.int32), runs_per_question),
+                folds,
+                self.display_name(),
+            )
+        return guess_dfs
 
     @staticmethod
     def guess_path(directory: str, fold: str, output_type: str) -> str:
+        return os.path.join(directory, f"guesses_{output_type}_{fold}.parquet")
+
+    @staticmethod
+    def legacy_guess_path(directory: str, fold: str, output_type: str) -> str:
         return os.path.join(directory, f"guesses_{output_type}_{fold}.pickle")
 
     @staticmethod
@@ -272,30 +561,70 @@ class AbstractGuesser(metaclass=ABCMeta):
             log.info("Saving fold {}".format(fold))
             fold_df = guess_df[guess_df.fold == fold]
             output_path = AbstractGuesser.guess_path(directory, fold, output_type)
-            fold_df.to_pickle(output_path)
+            write_guesses(fold_df, output_path)
 
     @staticmethod
     def load_guesses(
-        directory: str, output_type="char", folds=c.GUESSER_GENERATION_FOLDS
+        directory: str,
+        output_type="char",
+        folds=c.GUESSER_GENERATION_FOLDS,
+        qanta_ids: Optional[List[int]] = None,
+        min_char_index: Optional[int] = None,
+        max_char_index: Optional[int] = None,
+        columns: Optional[List[str]] = None,
+        categorical: bool = False,
     ) -> pd.DataFrame:
         """
-        Loads all the guesses pertaining to a guesser inferred from directory
+        Loads all the guesses pertaining to a guesser inferred from directory. Filters skip the
+        parquet row groups that cannot match, see read_guesses.
         :param directory: where to load guesses from
         :param output_type: One of: char, full, first
         :param folds: folds to load, by default all of them
+        :param qanta_ids: if given, only load guesses for these questions
+        :param min_char_index: if given, only load guesses at or after this character index
+        :param max_char_index: if given, only load guesses at or before this character index
+        :param columns: if given, only load these columns
+        :param categorical: if true guess, fold, and guesser are categorical columns
         :return: guesses across all folds for given directory
         """
         assert len(folds) > 0
-        guess_df = None
+        paths = []
+        legacy_dfs = []
         for fold in folds:
             input_path = AbstractGuesser.guess_path(directory, fold, output_type)
-            if guess_df is None:
-                guess_df = pd.read_pickle(input_path)
+            legacy_path = AbstractGuesser.legacy_guess_path(
+                directory, fold, output_type
+            )
+            if not os.path.exists(input_path) and os.path.exists(legacy_path):
+                legacy_df = pd.read_pickle(legacy_path)
+                if qanta_ids is not None:
+                    legacy_df = legacy_df[legacy_df.qanta_id.isin(qanta_ids)]
+                if min_char_index is not None:
+                    legacy_df = legacy_df[legacy_df.char_index >= min_char_index]
+                if max_char_index is not None:
+                    legacy_df = legacy_df[legacy_df.char_index <= max_char_index]
+                if columns is not None:
+                    legacy_df = legacy_df[columns]
+                legacy_dfs.append(legacy_df)
             else:
-                new_guesses_df = pd.read_pickle(input_path)
-                guess_df = pd.concat([guess_df, new_guesses_df])
-
-        return guess_df
+                paths.append(input_path)
+
+        guess_dfs = legacy_dfs
+        if len(paths) > 0:
+            guess_dfs.append(
+                read_guesses(
+                    paths,
+                    qanta_ids=qanta_ids,
+                    min_char_index=min_char_index,
+                    max_char_index=max_char_index,
+                    columns=columns,
+                    categorical=categorical,
+                )
+            )
+        if len(guess_dfs) == 1:
+            return guess_dfs[0]
+        else:
+            return pd.concat(guess_dfs)
 
     @staticmethod
     def load_all_guesses(directory_prefix="") -> pd.DataFrame:
@@ -303,7 +632,7 @@ class AbstractGuesser(metaclass=ABCMeta):
         Loads all guesses from all guessers and folds
         :return:
         """
-        guess_df = None
+        guess_dfs = []
         guessers = conf["guessers"]
         for guesser_key, g in guessers.items():
             g = guessers[guesser_key]
@@ -311,13 +640,12 @@ class AbstractGuesser(metaclass=ABCMeta):
                 input_path = os.path.join(
                     directory_prefix, c.GUESSER_TARGET_PREFIX, g["class"]
                 )
-                if guess_df is None:
-                    guess_df = AbstractGuesser.load_guesses(input_path)
-                else:
-                    new_guess_df = AbstractGuesser.load_guesses(input_path)
-                    guess_df = pd.concat([guess_df, new_guess_df])
+                guess_dfs.append(AbstractGuesser.load_guesses(input_path))
 
-        return guess_df
+        if len(guess_dfs) == 0:
+            return None
+        else:
+            return pd.concat(guess_dfs)
 
     @staticmethod
     def load_guess_score_map(guess_df: pd.DataFrame) -> defaultdict:
@@ -333,7 +661,7 @@ class AbstractGuesser(metaclass=ABCMeta):
         with open(os.path.join(directory, f"guesser_params.pickle"), "rb") as f:
             params = pickle.load(f)
 
-        qdb = QantaDatabase()
+        qdb = qanta_database()
         guesser_train = qdb.guess_train_questions
         questions_by_fold = qdb.by_fold()
         guesser_report_questions = questions_by_fold[fold]
@@ -470,19 +798,35 @@ class AbstractGuesser(metaclass=ABCMeta):
         from flask import Flask, jsonify, request
 
         app = Flask(__name__)
+        cache = create_guess_cache(self)
 
         @app.route("/api/answer_question", methods=["POST"])
         def answer_question():
             text = request.form["text"]
-            guess, score = self.guess([text], 1)[0][0]
+            guess, score = cache.guess([text], 1)[0][0]
             return jsonify({"guess": guess, "score": float(score)})
 
+        @app.route("/api/guess_cache", methods=["GET"])
+        def guess_cache_metrics():
+            return jsonify(cache.metrics())
+
         app.run(host=host, port=port, debug=debug)
 
     @staticmethod
     def multi_guesser_web_api(
-        guesser_names: List[str], host="0.0.0.0", port=5000, debug=False
+        guesser_names: List[str],
+        host="0.0.0.0",
+        port=5000,
+        debug=False,
+        micro_batching: Optional[bool] = None,
     ):
+        """
+        Serve the named guessers at /api/guesser, and all of them at once at /api/guessers.
+        Guessers that do not release the GIL are loaded in their own process so that the fan out
+        runs them in parallel. With micro_batching, by default guess_batching.enabled in the
+        config, concurrent requests to the same guesser are queued and answered by a single
+        batched call to guess, see MicroBatcher.
+        """
         from flask import Flask, jsonify, request
 
         app = Flask(__name__)
@@ -504,9 +848,33 @@ class AbstractGuesser(metaclass=ABCMeta):
                 log.info(
                     f'Loading "{name}" corresponding to "{g_qualified_name}" located at "{guesser_path}"'
                 )
-                guessers[name] = g_class.load(guesser_path)
+                guessers[name] = load_serving_guesser(g_class, guesser_path)
             else:
                 log.info(f'Guesser with name="{name}" not found')
+        caches = {
+            name: create_guess_cache(g, name=name) for name, g in guessers.items()
+        }
+        if micro_batching is None:
+            micro_batching = conf["guess_batching"]["enabled"]
+        if micro_batching:
+            batchers = {
+                name: create_micro_batcher(cache.guess, name)
+                for name, cache in caches.items()
+            }
+        else:
+            batchers = {}
+
+        def guess_fn(name: str):
+            if micro_batching:
+                return batchers[name].guess_one
+            else:
+                return lambda text, max_n_guesses: caches[name].guess(
+                    [text], max_n_guesses
+                )[0]
+
+        guess_fns = {name: guess_fn(name) for name in guessers}
+        fanout_conf = conf["guess_fanout"]
+        fanout = FanOut(guess_fns, max_concurrent=fanout_conf["max_concurrent"])
 
         @app.route("/api/guesser", methods=["POST"])
         def guess():
@@ -530,7 +898,41 @@ class AbstractGuesser(metaclass=ABCMeta):
                 response.status_code = 400
                 return response
             text = request.form["text"]
-            guess, score = guessers[g_name].guess([text], 1)[0][0]
+            guess, score = guess_fns[g_name](text, 1)[0]
             return jsonify({"guess": guess, "score": float(score)})
 
+        @app.route("/api/guessers", methods=["POST"])
+        def guess_all():
+            if "text" not in request.form:
+                response = jsonify({"errors": 'Missing expected field "text"'})
+                response.status_code = 400
+                return response
+
+            max_n_guesses = int(
+                request.form.get("max_n_guesses", fanout_conf["max_n_guesses"])
+            )
+            timeout = float(request.form.get("timeout", fanout_conf["timeout"]))
+            guesses, errors = fanout.guess(request.form["text"], max_n_guesses, timeout)
+            return jsonify(
+                {
+                    "guesses": {
+                        name: [
+                            {"guess": guess, "score": float(score)}
+                            for guess, score in g_guesses
+                        ]
+                        for name, g_guesses in guesses.items()
+                    },
+                    "merged": merge_guesses(guesses, max_n_guesses),
+                    "errors": errors,
+                }
+            )
+
+        @app.route("/api/guess_cache", methods=["GET"])
+        def guess_cache_metrics():
+            return jsonify({name: cache.metrics() for name, cache in caches.items()})
+
+        @app.route("/api/guess_batching", methods=["GET"])
+        def guess_batching_metrics():
+            return jsonify({name: b.metrics() for name, b in batchers.items()})
+
         app.run(host=host, port=port, debug=debug)
@@ -0,0 +1,337 @@
+from typing import List, Optional, Dict, Tuple
+import os
+import re
+import pickle
+
+import numpy as np
+from scipy import sparse
+import tqdm
+from nltk.tokenize import word_tokenize
+
+from qanta.wikipedia.cached_wikipedia import Wikipedia
+from qanta.util.topk import top_k
+from qanta import qlogging
+
+
+log = qlogging.get(__name__)
+
+BM25_PARAMS = "bm25_params.pickle"
+FIELDS = ("wiki_content", "qb_content")
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+# Upper bound on the number of dense query x document scores materialized at once
+MAX_BLOCK_SCORES = 2 ** 24
+
+
+def analyze(text: str) -> List[str]:
+    """
+    Approximation of the elasticsearch standard analyzer: unicode word tokens, lowercased
+    """
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class Bm25Index:
+    def __init__(self, name="qb", bm25_b=None, bm25_k1=None):
+        """
+        In-process replacement for ElasticSearchIndex. Documents have a wiki_content and a
+        qb_content field, each field is stored as a term x document CSR matrix whose rows are the
+        postings of a term and whose values are the precomputed BM25 weight of the term in the
+        document. Scoring a batch of queries is then a sparse matrix product per field, combined
+        the way a multi_match best_fields query does: the maximum over fields of the boosted field
+        score.
+
+        Document lengths are exact here while Lucene stores them lossily, so scores are close to
+        but not bit-identical with the elasticsearch backend.
+        """
+        self.name = name
+        if bm25_b is None:
+            bm25_b = 0.75
+        if bm25_k1 is None:
+            bm25_k1 = 1.2
+        self.bm25_b = bm25_b
+        self.bm25_k1 = bm25_k1
+        self.vocab = None  # type: Optional[Dict[str, int]]
+        self.pages = None  # type: Optional[List[str]]
+        self.page_offsets = None  # type: Optional[np.ndarray]
+        self.postings = None  # type: Optional[Dict[str, sparse.csr_matrix]]
+
+    @property
+    def n_docs(self):
+        return self.postings[FIELDS[0]].shape[1]
+
+    def delete(self):
+        self.vocab = None
+        self.pages = None
+        self.page_offsets = None
+        self.postings = None
+
+    def exists(self):
+        return self.postings is not None
+
+    def build_large_docs(
+        self, documents: Dict[str, str], use_wiki=True, use_qb=True, rebuild_index=False
+    ):
+        if rebuild_index or bool(int(os.getenv("QB_REBUILD_INDEX", 0))):
+            log.info(f"Deleting index: {self.name}")
+            self.delete()
+
+        if self.exists():
+            log.info(f"Index {self.name} exists")
+        else:
+            log.info(f"Index {self.name} does not exist")
+            wiki_lookup = Wikipedia()
+            log.info(
+                "Indexing questions and corresponding wikipedia pages as large docs..."
+            )
+            docs = []
+            for page in tqdm.tqdm(documents):
+                if use_wiki and page in wiki_lookup:
+                    wiki_content = wiki_lookup[page].text
+                else:
+                    wiki_content = ""
+
+                if use_qb:
+                    qb_content = documents[page]
+                else:
+                    qb_content = ""
+
+                docs.append((page, wiki_content, qb_content))
+            self._build(docs)
+
+    def build_many_docs(
+        self, pages, documents, use_wiki=True, use_qb=True, rebuild_index=False
+    ):
+        if rebuild_index or bool(int(os.getenv("QB_REBUILD_INDEX", 0))):
+            log.info(f"Deleting index: {self.name}")
+            self.delete()
+
+        if self.exists():
+            log.info(f"Index {self.name} exists")
+        else:
+            log.info(f"Index {self.name} does not exist")
+            log.info("Indexing questions and corresponding pages as many docs...")
+            docs = []
+            if use_qb:
+                log.info("Indexing questions...")
+                for page, doc in tqdm.tqdm(documents):
+                    docs.append((page, "", doc))
+
+            if use_wiki:
+                log.info("Indexing wikipedia...")
+                wiki_lookup = Wikipedia()
+                for page in tqdm.tqdm(pages):
+                    if page in wiki_lookup:
+                        content = word_tokenize(wiki_lookup[page].text)
+                        for i in range(0, len(content), 200):
+                            chunked_content = content[i : i + 200]
+                            if len(chunked_content) > 0:
+                                docs.append((page, " ".join(chunked_content), ""))
+            self._build(docs)
+
+    def _build(self, docs: List[Tuple[str, str, str]]):
+        """
+        :param docs: list of (page, wiki_content, qb_content) documents, several documents may share
+            a page
+        """
+        # Documents of the same page are stored contiguously so that page scores are a reduceat
+        docs = sorted(docs, key=lambda d: d[0])
+        self.pages = []
+        page_offsets = []
+        for i, (page, _, _) in enumerate(docs):
+            if len(self.pages) == 0 or self.pages[-1] != page:
+                self.pages.append(page)
+                page_offsets.append(i)
+        self.page_offsets = np.array(page_offsets, dtype=np.int64)
+
+        self.vocab = {}
+        self.postings = {}
+        for field_idx, field in enumerate(FIELDS):
+            log.info(f"Computing BM25 postings for {field}")
+            rows = []
+            cols = []
+            term_freqs = []
+            doc_lengths = np.zeros(len(docs), dtype=np.float64)
+            for doc_id, doc in enumerate(docs):
+                tokens = analyze(doc[1 + field_idx])
+                doc_lengths[doc_id] = len(tokens)
+                counts = {}
+                for t in tokens:
+                    term_id = self.vocab.setdefault(t, len(self.vocab))
+                    counts[term_id] = counts.get(term_id, 0) + 1
+                for term_id, tf in counts.items():
+                    rows.append(term_id)
+                    cols.append(doc_id)
+                    term_freqs.append(tf)
+            self.postings[field] = self._bm25_weights(
+                np.array(rows, dtype=np.int64),
+                np.array(cols, dtype=np.int64),
+                np.array(term_freqs, dtype=np.float64),
+                doc_lengths,
+            )
+
+        # Terms first seen in a later field need empty rows in the earlier fields
+        for field in FIELDS:
+            postings = self.postings[field]
+            if postings.shape[0] < len(self.vocab):
+                postings.resize((len(self.vocab), len(docs)))
+
+        log.info(
+            f"Built BM25 index {self.name} with {len(docs)} documents, {len(self.pages)} pages and {len(self.vocab)} terms"
+        )
+
+    def _bm25_weights(self, rows, cols, term_freqs, doc_lengths) -> sparse.csr_matrix:
+        n_terms = len(self.vocab)
+        n_docs = len(doc_lengths)
+        doc_count = np.count_nonzero(doc_lengths)
+        if doc_count == 0:
+            return sparse.csr_matrix((n_terms, n_docs), dtype=np.float32)
+        avg_doc_length = doc_lengths.sum() / doc_count
+        doc_freqs = np.bincount(rows, minlength=n_terms)
+        idf = np.log(1 + (doc_count - doc_freqs + 0.5) / (doc_freqs + 0.5))
+        length_norm = self.bm25_k1 * (
+            1 - self.bm25_b + self.bm25_b * doc_lengths / avg_doc_length
+        )
+        weights = (
+            idf[rows]
+            * term_freqs
+            * (self.bm25_k1 + 1)
+            / (term_freqs + length_norm[cols])
+        )
+        return sparse.csr_matrix(
+            (weights.astype(np.float32), (rows, cols)), shape=(n_terms, n_docs)
+        )
+
+    def _query_matrix(self, texts: List[str]) -> sparse.csr_matrix:
+        indptr = [0]
+        indices = []
+        for text in texts:
+            for t in analyze(text):
+                term_id = self.vocab.get(t)
+                if term_id is not None:
+                    indices.append(term_id)
+            indptr.append(len(indices))
+        # Repeated query terms are separate clauses in elasticsearch, duplicate entries are summed
+        return sparse.csr_matrix(
+            (np.ones(len(indices), dtype=np.float32), indices, indptr),
+            shape=(len(texts), len(self.vocab)),
+        )
+
+    def search_many(
+        self,
+        texts: List[str],
+        max_n_guesses: Optional[int],
+        normalize_score_by_length=False,
+        wiki_boost=1,
+        qb_boost=1,
+    ) -> List[List[Tuple[str, float]]]:
+        if not self.exists():
+            raise ValueError(
+                "The index does not exist, you must create it before searching"
+            )
+
+        boosts = {"wiki_content": wiki_boost, "qb_content": qb_boost}
+        many_docs = len(self.pages) != self.n_docs
+        block_size = max(1, MAX_BLOCK_SCORES // self.n_docs)
+        guesses = []
+        for start in range(0, len(texts), block_size):
+            block_texts = texts[start : start + block_size]
+            queries = self._query_matrix(block_texts)
+            block_scores = None
+            for field in FIELDS:
+                field_scores = queries.dot(self.postings[field]).toarray()
+                field_scores *= boosts[field]
+                if block_scores is None:
+                    block_scores = field_scores
+                else:
+                    np.maximum(block_scores, field_scores, out=block_scores)
+
+            if many_docs:
+                block_scores = np.maximum.reduceat(
+                    block_scores, self.page_offsets, axis=1
+                )
+
+            block_indices, block_top_scores = top_k(block_scores, max_n_guesses)
+            for text, indices, top_scores in zip(
+                block_texts, block_indices, block_top_scores
+            ):
+                if normalize_score_by_length:
+                    query_length = len(text.split())
+                else:
+                    query_length = 1
+                guesses.append(
+                    [
+                        (self.pages[idx], float(score) / query_length)
+                        for idx, score in zip(indices, top_scores)
+                        if score > 0
+                    ]
+                )
+
+        return guesses
+
+    def search(
+        self,
+        text: str,
+        max_n_guesses: int,
+        normalize_score_by_length=False,
+        wiki_boost=1,
+        qb_boost=1,
+    ):
+        return self.search_many(
+            [text],
+            max_n_guesses,
+            normalize_score_by_length=normalize_score_by_length,
+            wiki_boost=wiki_boost,
+            qb_boost=qb_boost,
+        )[0]
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        for field in FIELDS:
+            postings = self.postings[field]
+            np.save(os.path.join(directory, f"{field}.data.npy"), postings.data)
+            np.save(os.path.join(directory, f"{field}.indices.npy"), postings.indices)
+            np.save(os.path.join(directory, f"{field}.indptr.npy"), postings.indptr)
+        np.save(os.path.join(directory, "page_offsets.npy"), self.page_offsets)
+        with open(os.path.join(directory, BM25_PARAMS), "wb") as f:
+            pickle.dump(
+                {
+                    "name": self.name,
+                    "bm25_b": self.bm25_b,
+                    "bm25_k1": self.bm25_k1,
+                    "vocab": self.vocab,
+                    "pages": self.pages,
+                    "n_docs": self.n_docs,
+                },
+                f,
+            )
+
+    @classmethod
+    def load(cls, directory: str, mmap=True):
+        """
+        Load an index written by Bm25Index.save. With mmap=True the postings arrays are memory
+        mapped so loading is constant time and the pages are shared between processes.
+        """
+        mmap_mode = "r" if mmap else None
+        with open(os.path.join(directory, BM25_PARAMS), "rb") as f:
+            params = pickle.load(f)
+        index = Bm25Index(
+            name=params["name"], bm25_b=params["bm25_b"], bm25_k1=params["bm25_k1"]
+        )
+        index.vocab = params["vocab"]
+        index.pages = params["pages"]
+        index.page_offsets = np.load(
+            os.path.join(directory, "page_offsets.npy"), mmap_mode=mmap_mode
+        )
+        shape = (len(index.vocab), params["n_docs"])
+        index.postings = {}
+        for field in FIELDS:
+            arrays = [
+                np.load(
+                    os.path.join(directory, f"{field}.{a}.npy"), mmap_mode=mmap_mode
+                )
+                for a in ("data", "indices", "indptr")
+            ]
+            index.postings[field] = sparse.csr_matrix(
+                tuple(arrays), shape=shape, copy=False
+            )
+        return index
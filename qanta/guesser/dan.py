@@ -3,14 +3,13 @@ import os
 import shutil
 import time
 import cloudpickle
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple
 
 import numpy as np
 
 import torch
 import torch.nn as nn
 from torch.autograd import Variable
-from torch.nn import functional as F
 from torch.optim import Adam, lr_scheduler
 
 from torchtext.data.field import Field
@@ -19,10 +18,17 @@ from torchtext.data.iterator import Iterator
 from qanta import qlogging
 from qanta.util.io import shell, get_tmp_filename
 from qanta.torch.dataset import QuizBowl
+from qanta.torch.tokenization import QbTokenizer
 from qanta.config import conf
-from qanta.guesser.abstract import AbstractGuesser
+from qanta.guesser.abstract import AbstractGuesser, GuessArrays, arrays_to_guesses
 from qanta.datasets.abstract import QuestionText
 from qanta.torch import (
+    token_budget_batches,
+    unbatch,
+    top_k_logits,
+    inference_device,
+    torchtext_device,
+    prepare_inference_model,
     BaseLogger,
     TerminateOnNaN,
     EarlyStopping,
@@ -279,9 +285,42 @@ class DanModel(nn.Module):
             return self.classifier(encoded)
 
 
+class DanInference(nn.Module):
+    def __init__(self, model: DanModel, fields: List[str]):
+        """
+        Inference view of a DanModel which takes tensors as positional arguments so that it can be
+        traced with torch.jit.trace
+
+        :param model: trained model
+        :param fields: names of the model inputs, in the order they are passed to forward
+        """
+        super(DanInference, self).__init__()
+        self.model = model
+        self.fields = fields
+
+    def forward(self, *inputs):
+        """
+        :param inputs: for each field, the [batch_size, seq_len] word indices then the lengths
+        :return: [batch_size, n_classes] answer logits
+        """
+        input_dict = {}
+        lengths_dict = {}
+        for i, field in enumerate(self.fields):
+            input_dict[field] = inputs[2 * i]
+            lengths_dict[field] = inputs[2 * i + 1]
+        return self.model(input_dict, lengths_dict, None)
+
+
 class DanGuesser(AbstractGuesser):
+    releases_gil = True
+
     def __init__(self, config_num):
         super(DanGuesser, self).__init__(config_num)
+        self.device = "auto"
+        self.n_inference_threads = None
+        self.quantize = False
+        self.torchscript = False
+        self.max_batch_tokens = 30000
         if self.config_num is not None:
             guesser_conf = conf["guessers"]["qanta.guesser.dan.DanGuesser"][
                 self.config_num
@@ -308,6 +347,12 @@ class DanGuesser(AbstractGuesser):
 
             self.random_seed = guesser_conf["random_seed"]
 
+            self.device = guesser_conf["device"]
+            self.n_inference_threads = guesser_conf["n_inference_threads"]
+            self.quantize = guesser_conf["quantize"]
+            self.torchscript = guesser_conf["torchscript"]
+            self.max_batch_tokens = guesser_conf["max_batch_tokens"]
+
         self.page_field: Optional[Field] = None
         self.qanta_id_field: Optional[Field] = None
         self.text_field: Optional[Field] = None
@@ -319,6 +364,7 @@ class DanGuesser(AbstractGuesser):
         self.model_file = None
 
         self.model = None
+        self.inference_model = None
         self.optimizer = None
         self.criterion = None
         self.scheduler = None
@@ -351,8 +397,8 @@ class DanGuesser(AbstractGuesser):
             bigram_max_vocab_size=self.bigram_max_vocab_size,
             trigram_max_vocab_size=self.trigram_max_vocab_size,
         )
-        log.info(f"N Train={len(train_iter.dataset.examples)}")
-        log.info(f"N Test={len(val_iter.dataset.examples)}")
+        log.info(f"N Train={len(train_iter.dataset)}")
+        log.info(f"N Test={len(val_iter.dataset)}")
         fields: Dict[str, Field] = train_iter.dataset.fields
         self.page_field = fields["page"]
         self.n_classes = len(self.ans_to_i)
@@ -485,53 +531,142 @@ class DanGuesser(AbstractGuesser):
     def guess(self, questions: List[QuestionText], max_n_guesses: Optional[int]):
         if len(questions) == 0:
             return []
-        batch_size = 500
-        if len(questions) < batch_size:
-            return self._guess_batch(questions, max_n_guesses)
-        else:
-            all_guesses = []
-            for i in range(0, len(questions), batch_size):
-                batch_questions = questions[i : i + batch_size]
-                guesses = self._guess_batch(batch_questions, max_n_guesses)
-                all_guesses.extend(guesses)
-            return all_guesses
-
-    def _guess_batch(self, questions: List[QuestionText], max_n_guesses: Optional[int]):
+        return arrays_to_guesses(self.guess_arrays(questions, max_n_guesses))
+
+    def guess_arrays(
+        self, questions: List[QuestionText], max_n_guesses: Optional[int]
+    ) -> GuessArrays:
         if len(questions) == 0:
-            return []
-        input_dict = {}
-        lengths_dict = {}
-        if self.text_field is not None:
-            examples = [self.text_field.preprocess(q) for q in questions]
-            text, lengths = self.text_field.process(examples, None, False)
-            input_dict["text"] = text
-            lengths_dict["text"] = lengths
-        if self.unigram_field is not None:
-            examples = [self.unigram_field.preprocess(q) for q in questions]
-            text, lengths = self.unigram_field.process(examples, None, False)
-            input_dict["unigram"] = text
-            lengths_dict["unigram"] = lengths
-        if self.bigram_field is not None:
-            examples = [self.bigram_field.preprocess(q) for q in questions]
-            text, lengths = self.bigram_field.process(examples, None, False)
-            input_dict["bigram"] = text
-            lengths_dict["bigram"] = lengths
-        if self.trigram_field is not None:
-            examples = [self.trigram_field.preprocess(q) for q in questions]
-            text, lengths = self.trigram_field.process(examples, None, False)
-            input_dict["trigram"] = text
-            lengths_dict["trigram"] = lengths
-        qanta_ids = self.qanta_id_field.process([0 for _ in questions]).cuda()
-        guesses = []
-        out = self.model(input_dict, lengths_dict, qanta_ids)
-        probs = F.softmax(out).data.cpu().numpy()
-        n_examples = probs.shape[0]
-        preds = np.argsort(-probs, axis=1)
-        for i in range(n_examples):
-            guesses.append([])
-            for p in preds[i][:max_n_guesses]:
-                guesses[-1].append((self.i_to_ans[p], probs[i][p]))
-        return guesses
+            return GuessArrays(
+                self.i_to_ans,
+                np.zeros((0, 0), dtype=np.int32),
+                np.zeros((0, 0), dtype=np.float32),
+            )
+        return self._guess_field_examples(self._preprocess(questions), max_n_guesses)
+
+    def guess_runs_arrays(
+        self,
+        questions: List[QuestionText],
+        char_indices: List[List[int]],
+        max_n_guesses: Optional[int],
+        qanta_ids: Optional[List[int]] = None,
+    ) -> GuessArrays:
+        """
+        Tokenize each question once, read from the token cache when qanta_ids are given, and
+        take the tokens of each run as a slice of the question's tokens instead of running nltk on
+        every prefix
+        """
+        fields = self._inference_fields()
+        if not all(isinstance(field.tokenize, QbTokenizer) for _, field in fields):
+            # Fields pickled before QbTokenizer existed tokenize with an opaque function
+            return super().guess_runs_arrays(
+                questions, char_indices, max_n_guesses, qanta_ids=qanta_ids
+            )
+        if sum(len(indices) for indices in char_indices) == 0:
+            return self.guess_arrays([], max_n_guesses)
+
+        field_examples = []
+        for _, field in fields:
+            run_tokens = field.tokenize.run_tokens(
+                questions, char_indices, qanta_ids=qanta_ids
+            )
+            field_examples.append([field.preprocess(tokens) for tokens in run_tokens])
+        return self._guess_field_examples(field_examples, max_n_guesses)
+
+    def _guess_field_examples(
+        self, field_examples, max_n_guesses: Optional[int]
+    ) -> GuessArrays:
+        lengths = np.max(
+            [[len(e) for e in examples] for examples in field_examples], axis=0
+        )
+        batches = token_budget_batches(lengths, self.max_batch_tokens)
+        batch_indices = []
+        batch_scores = []
+        for batch in batches:
+            indices, scores = self._guess_batch(
+                [[examples[i] for i in batch] for examples in field_examples],
+                max_n_guesses,
+            )
+            batch_indices.append(indices)
+            batch_scores.append(scores)
+        return GuessArrays(
+            self.i_to_ans,
+            unbatch(batches, batch_indices),
+            unbatch(batches, batch_scores),
+        )
+
+    def _guess_batch(self, field_examples, max_n_guesses: Optional[int]):
+        """
+        :param field_examples: for each inference field, the preprocessed questions
+        :return: [n_questions, max_n_guesses] int32 answer indices and float32 probabilities,
+            sorted from most to least probable
+        """
+        if self.inference_model is None:
+            self._prepare_inference()
+        with torch.no_grad():
+            logits = self.inference_model(*self._process(field_examples))
+            return top_k_logits(logits, max_n_guesses)
+
+    def _inference_fields(self) -> List[Tuple[str, Field]]:
+        fields = [
+            ("text", self.text_field),
+            ("unigram", self.unigram_field),
+            ("bigram", self.bigram_field),
+            ("trigram", self.trigram_field),
+        ]
+        return [(name, field) for name, field in fields if field is not None]
+
+    def _preprocess(self, questions: List[QuestionText]):
+        return [
+            [field.preprocess(q) for q in questions]
+            for _, field in self._inference_fields()
+        ]
+
+    def _process(self, field_examples):
+        device = torchtext_device(inference_device(self.device))
+        inputs = []
+        for (_, field), examples in zip(self._inference_fields(), field_examples):
+            text, lengths = field.process(examples, device, False)
+            inputs.extend([text, lengths])
+        return inputs
+
+    def _inference_inputs(self, questions: List[QuestionText]):
+        return self._process(self._preprocess(questions))
+
+    def _prepare_inference(self):
+        """
+        Build DanGuesser.inference_model from the trained model according to the device,
+        n_inference_threads, quantize, and torchscript settings
+        """
+        model = prepare_inference_model(
+            self.model,
+            inference_device(self.device),
+            n_threads=self.n_inference_threads,
+            quantize=self.quantize,
+        )
+        self.inference_model = DanInference(
+            model, [name for name, _ in self._inference_fields()]
+        )
+        if self.torchscript:
+            self.inference_model = self._trace(self.inference_model)
+
+    def _trace(self, inference_model: DanInference) -> torch.jit.ScriptModule:
+        example_inputs = self._inference_inputs(["name this torchscript example"])
+        with torch.no_grad():
+            return torch.jit.trace(inference_model, tuple(example_inputs))
+
+    def export_torchscript(self, path: str):
+        """
+        Save the inference graph, including quantized layers if quantize is set, as a TorchScript
+        module that can be loaded with torch.jit.load without qanta or torchtext
+        """
+        if self.inference_model is None:
+            self._prepare_inference()
+        if isinstance(self.inference_model, torch.jit.ScriptModule):
+            traced = self.inference_model
+        else:
+            traced = self._trace(self.inference_model)
+        traced.save(path)
 
     def save(self, directory: str):
         shutil.copyfile(self.model_file, os.path.join(directory, "dan.pt"))
@@ -618,14 +753,9 @@ class DanGuesser(AbstractGuesser):
             pooling=guesser.pooling,
         )
         guesser.model.load_state_dict(
-            torch.load(
-                os.path.join(directory, "dan.pt"),
-                map_location=lambda storage, loc: storage,
-            )
+            torch.load(os.path.join(directory, "dan.pt"), map_location="cpu")
         )
-        guesser.model.eval()
-        if CUDA:
-            guesser.model = guesser.model.cuda()
+        guesser._prepare_inference()
         return guesser
 
     @classmethod
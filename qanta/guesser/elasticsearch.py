@@ -1,13 +1,17 @@
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Iterable
 import subprocess
 import os
+import time
 import pickle
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 
 import click
-from elasticsearch_dsl import Document, Text, Keyword, Search, Index
+from elasticsearch_dsl import Document, Text, Keyword, Search, MultiSearch, Index
 from elasticsearch_dsl.connections import connections
 import elasticsearch
+from elasticsearch.helpers import parallel_bulk
 import tqdm
 from nltk.tokenize import word_tokenize
 from jinja2 import Environment, PackageLoader
@@ -15,7 +19,8 @@ from jinja2 import Environment, PackageLoader
 from qanta.wikipedia.cached_wikipedia import Wikipedia
 from qanta.datasets.abstract import QuestionText
 from qanta.guesser.abstract import AbstractGuesser
-from qanta.spark import create_spark_context
+from qanta.guesser.bm25 import Bm25Index
+from qanta.guesser.guess_cache import create_guess_cache
 from qanta.config import conf
 from qanta.util.io import get_tmp_dir, safe_path
 from qanta import qlogging
@@ -23,7 +28,10 @@ from qanta import qlogging
 
 log = qlogging.get(__name__)
 ES_PARAMS = "es_params.pickle"
-connections.create_connection(hosts=["localhost"])
+BM25_DIR = "bm25"
+# Each thread issuing searches needs its own pooled connection to avoid reconnecting
+ES_CONNECTION_POOL_SIZE = 32
+connections.create_connection(hosts=["localhost"], maxsize=ES_CONNECTION_POOL_SIZE)
 
 
 def create_es_config(output_path, host="localhost", port=9200, tmp_dir=None):
@@ -70,8 +78,18 @@ def create_doctype(index_name, similarity):
 
 
 class ElasticSearchIndex:
-    def __init__(self, name="qb", similarity="default", bm25_b=None, bm25_k1=None):
+    def __init__(
+        self,
+        name="qb",
+        similarity="default",
+        bm25_b=None,
+        bm25_k1=None,
+        bulk_chunk_size=500,
+        bulk_workers=4,
+    ):
         self.name = name
+        self.bulk_chunk_size = bulk_chunk_size
+        self.bulk_workers = bulk_workers
         self.ix = Index(self.name)
         self.answer_doc = create_doctype(self.name, similarity)
         if bm25_b is None:
@@ -103,6 +121,46 @@ class ElasticSearchIndex:
         self.ix.open()
         self.answer_doc.init(index=self.name)
 
+    def bulk_index(self, answers: Iterable[Document]):
+        """
+        Index documents through the _bulk API with bulk_workers threads each sending requests of
+        bulk_chunk_size documents. Refreshing and replication are disabled while loading and
+        restored afterwards.
+
+        :param answers: documents to index, consumed lazily
+        """
+        index_settings = self.ix.get_settings()[self.name]["settings"]["index"]
+        refresh_interval = index_settings.get("refresh_interval")
+        n_replicas = index_settings.get("number_of_replicas")
+        self.ix.put_settings(
+            body={"index": {"refresh_interval": "-1", "number_of_replicas": 0}}
+        )
+        n_docs = 0
+        start_time = time.time()
+        try:
+            actions = (a.to_dict(include_meta=True) for a in answers)
+            for _ in parallel_bulk(
+                connections.get_connection(),
+                actions,
+                thread_count=self.bulk_workers,
+                chunk_size=self.bulk_chunk_size,
+            ):
+                n_docs += 1
+        finally:
+            self.ix.put_settings(
+                body={
+                    "index": {
+                        "refresh_interval": refresh_interval,
+                        "number_of_replicas": n_replicas,
+                    }
+                }
+            )
+            self.ix.refresh()
+        elapsed = time.time() - start_time
+        log.info(
+            f"Indexed {n_docs} documents in {elapsed:.1f}s ({n_docs / max(elapsed, 1e-6):.1f} docs/sec)"
+        )
+
     def build_large_docs(
         self, documents: Dict[str, str], use_wiki=True, use_qb=True, rebuild_index=False
     ):
@@ -119,21 +177,24 @@ class ElasticSearchIndex:
             log.info(
                 "Indexing questions and corresponding wikipedia pages as large docs..."
             )
-            for page in tqdm.tqdm(documents):
-                if use_wiki and page in wiki_lookup:
-                    wiki_content = wiki_lookup[page].text
-                else:
-                    wiki_content = ""
 
-                if use_qb:
-                    qb_content = documents[page]
-                else:
-                    qb_content = ""
+            def answers():
+                for page in tqdm.tqdm(documents):
+                    if use_wiki and page in wiki_lookup:
+                        wiki_content = wiki_lookup[page].text
+                    else:
+                        wiki_content = ""
 
-                answer = self.answer_doc(
-                    page=page, wiki_content=wiki_content, qb_content=qb_content
-                )
-                answer.save(index=self.name)
+                    if use_qb:
+                        qb_content = documents[page]
+                    else:
+                        qb_content = ""
+
+                    yield self.answer_doc(
+                        page=page, wiki_content=wiki_content, qb_content=qb_content
+                    )
+
+            self.bulk_index(answers())
 
     def build_many_docs(
         self, pages, documents, use_wiki=True, use_qb=True, rebuild_index=False
@@ -150,35 +211,30 @@ class ElasticSearchIndex:
             log.info("Indexing questions and corresponding pages as many docs...")
             if use_qb:
                 log.info("Indexing questions...")
-                for page, doc in tqdm.tqdm(documents):
-                    self.answer_doc(page=page, qb_content=doc).save()
+                self.bulk_index(
+                    self.answer_doc(page=page, qb_content=doc)
+                    for page, doc in tqdm.tqdm(documents)
+                )
 
             if use_wiki:
                 log.info("Indexing wikipedia...")
                 wiki_lookup = Wikipedia()
-                for page in tqdm.tqdm(pages):
-                    if page in wiki_lookup:
-                        content = word_tokenize(wiki_lookup[page].text)
-                        for i in range(0, len(content), 200):
-                            chunked_content = content[i : i + 200]
-                            if len(chunked_content) > 0:
-                                self.answer_doc(
-                                    page=page, wiki_content=" ".join(chunked_content)
-                                ).save()
-
-    def search(
-        self,
-        text: str,
-        max_n_guesses: int,
-        normalize_score_by_length=False,
-        wiki_boost=1,
-        qb_boost=1,
-    ):
-        if not self.exists():
-            raise ValueError(
-                "The index does not exist, you must create it before searching"
-            )
 
+                def wiki_answers():
+                    for page in tqdm.tqdm(pages):
+                        if page in wiki_lookup:
+                            content = word_tokenize(wiki_lookup[page].text)
+                            for i in range(0, len(content), 200):
+                                chunked_content = content[i : i + 200]
+                                if len(chunked_content) > 0:
+                                    yield self.answer_doc(
+                                        page=page,
+                                        wiki_content=" ".join(chunked_content),
+                                    )
+
+                self.bulk_index(wiki_answers())
+
+    def _search_request(self, text: str, max_n_guesses: int, wiki_boost, qb_boost):
         if wiki_boost != 1:
             wiki_field = "wiki_content^{}".format(wiki_boost)
         else:
@@ -189,10 +245,16 @@ class ElasticSearchIndex:
         else:
             qb_field = "qb_content"
 
-        s = Search(index=self.name)[0:max_n_guesses].query(
-            "multi_match", query=text, fields=[wiki_field, qb_field]
+        # With many docs per page several hits share a page, collapsing keeps the best hit of
+        # each page so that max_n_guesses distinct pages are returned
+        return (
+            Search(index=self.name)[0:max_n_guesses]
+            .query("multi_match", query=text, fields=[wiki_field, qb_field])
+            .extra(collapse={"field": "page.raw"})
         )
-        results = s.execute()
+
+    @staticmethod
+    def _parse_results(text: str, results, normalize_score_by_length):
         guess_set = set()
         guesses = []
         if normalize_score_by_length:
@@ -204,11 +266,74 @@ class ElasticSearchIndex:
             if r.page in guess_set:
                 continue
             else:
+                guess_set.add(r.page)
                 guesses.append((r.page, r.meta.score / query_length))
         return guesses
 
+    def search(
+        self,
+        text: str,
+        max_n_guesses: int,
+        normalize_score_by_length=False,
+        wiki_boost=1,
+        qb_boost=1,
+    ):
+        if not self.exists():
+            raise ValueError(
+                "The index does not exist, you must create it before searching"
+            )
+
+        s = self._search_request(text, max_n_guesses, wiki_boost, qb_boost)
+        return self._parse_results(text, s.execute(), normalize_score_by_length)
+
+    def search_many(
+        self,
+        texts: List[str],
+        max_n_guesses: int,
+        normalize_score_by_length=False,
+        wiki_boost=1,
+        qb_boost=1,
+        batch_size=100,
+        n_workers=4,
+    ):
+        """
+        Search for many texts by grouping them into _msearch requests of batch_size queries which
+        n_workers threads send concurrently. At most 2 * n_workers requests are in flight so
+        results are consumed as fast as they are produced, and they are returned in input order.
+        """
+        if not self.exists():
+            raise ValueError(
+                "The index does not exist, you must create it before searching"
+            )
+
+        def msearch(batch_texts):
+            ms = MultiSearch(index=self.name)
+            for text in batch_texts:
+                ms = ms.add(
+                    self._search_request(text, max_n_guesses, wiki_boost, qb_boost)
+                )
+            return [
+                self._parse_results(text, results, normalize_score_by_length)
+                for text, results in zip(batch_texts, ms.execute())
+            ]
+
+        guesses = []
+        in_flight = deque()
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            for start in range(0, len(texts), batch_size):
+                if len(in_flight) >= 2 * n_workers:
+                    guesses.extend(in_flight.popleft().result())
+                in_flight.append(
+                    executor.submit(msearch, texts[start : start + batch_size])
+                )
+            while len(in_flight) > 0:
+                guesses.extend(in_flight.popleft().result())
+        return guesses
+
 
 class ElasticSearchGuesser(AbstractGuesser):
+    releases_gil = True
+
     def __init__(self, config_num):
         super().__init__(config_num)
         guesser_conf = conf["guessers"][
@@ -221,6 +346,10 @@ class ElasticSearchGuesser(AbstractGuesser):
         self.normalize_score_by_length = guesser_conf["normalize_score_by_length"]
         self.qb_boost = guesser_conf["qb_boost"]
         self.wiki_boost = guesser_conf["wiki_boost"]
+        self.backend = guesser_conf["backend"]
+        self.bulk_chunk_size = guesser_conf["bulk_chunk_size"]
+        self.bulk_workers = guesser_conf["bulk_workers"]
+        self.msearch_batch_size = guesser_conf["msearch_batch_size"]
         similarity = guesser_conf["similarity"]
         self.similarity_name = similarity["name"]
         if self.similarity_name == "BM25":
@@ -229,12 +358,28 @@ class ElasticSearchGuesser(AbstractGuesser):
         else:
             self.similarity_k1 = None
             self.similarity_b = None
-        self.index = ElasticSearchIndex(
-            name=f"qb_{self.config_num}",
-            similarity=self.similarity_name,
-            bm25_b=self.similarity_b,
-            bm25_k1=self.similarity_k1,
-        )
+        self.index = self.create_index()
+
+    def create_index(self):
+        if self.backend == "elasticsearch":
+            return ElasticSearchIndex(
+                name=f"qb_{self.config_num}",
+                similarity=self.similarity_name,
+                bm25_b=self.similarity_b,
+                bm25_k1=self.similarity_k1,
+                bulk_chunk_size=self.bulk_chunk_size,
+                bulk_workers=self.bulk_workers,
+            )
+        elif self.backend == "bm25":
+            return Bm25Index(
+                name=f"qb_{self.config_num}",
+                bm25_b=self.similarity_b,
+                bm25_k1=self.similarity_k1,
+            )
+        else:
+            raise ValueError(
+                f"Unsupported backend {self.backend}, only elasticsearch and bm25 are supported"
+            )
 
     def parameters(self):
         return conf["guessers"]["qanta.guesser.elasticsearch.ElasticSearchGuesser"][
@@ -272,27 +417,19 @@ class ElasticSearchGuesser(AbstractGuesser):
             )
 
     def guess(self, questions: List[QuestionText], max_n_guesses: Optional[int]):
-        def es_search(query):
-            return self.index.search(
-                query,
-                max_n_guesses,
-                normalize_score_by_length=self.normalize_score_by_length,
-                wiki_boost=self.wiki_boost,
-                qb_boost=self.qb_boost,
-            )
-
-        if len(questions) > 1:
-            sc = create_spark_context(
-                configs=[
-                    ("spark.executor.cores", self.n_cores),
-                    ("spark.executor.memory", "20g"),
-                ]
-            )
-            return sc.parallelize(questions, 16 * self.n_cores).map(es_search).collect()
-        elif len(questions) == 1:
-            return [es_search(questions[0])]
+        # Only elasticsearch sends queries in _msearch batches from several threads
+        if self.backend == "bm25":
+            batching = {}
         else:
-            return []
+            batching = {"batch_size": self.msearch_batch_size, "n_workers": self.n_cores}
+        return self.index.search_many(
+            questions,
+            max_n_guesses,
+            normalize_score_by_length=self.normalize_score_by_length,
+            wiki_boost=self.wiki_boost,
+            qb_boost=self.qb_boost,
+            **batching,
+        )
 
     @classmethod
     def targets(cls):
@@ -313,10 +450,17 @@ class ElasticSearchGuesser(AbstractGuesser):
         guesser.similarity_name = params["similarity_name"]
         guesser.similarity_b = params["similarity_b"]
         guesser.similarity_k1 = params["similarity_k1"]
+        guesser.backend = params.get("backend", "elasticsearch")
+        if guesser.backend == "bm25":
+            guesser.index = Bm25Index.load(os.path.join(directory, BM25_DIR))
+        else:
+            guesser.index = guesser.create_index()
 
         return guesser
 
     def save(self, directory: str):
+        if self.backend == "bm25":
+            self.index.save(os.path.join(directory, BM25_DIR))
         with open(os.path.join(directory, ES_PARAMS), "wb") as f:
             pickle.dump(
                 {
@@ -331,6 +475,7 @@ class ElasticSearchGuesser(AbstractGuesser):
                     "similarity_name": self.similarity_name,
                     "similarity_k1": self.similarity_k1,
                     "similarity_b": self.similarity_b,
+                    "backend": self.backend,
                 },
                 f,
             )
@@ -339,15 +484,27 @@ class ElasticSearchGuesser(AbstractGuesser):
         from flask import Flask, jsonify, request
 
         app = Flask(__name__)
+        cache = create_guess_cache(self)
+
+        def highlights_unsupported():
+            # Highlights come from elasticsearch, the bm25 index does not keep document text
+            return (
+                jsonify(
+                    {"error": "Highlights require the elasticsearch backend, not bm25"}
+                ),
+                501,
+            )
 
         @app.route("/api/answer_question", methods=["POST"])
         def answer_question():
             text = request.form["text"]
-            guess, score = self.guess([text], 1)[0][0]
+            guess, score = cache.guess([text], 1)[0][0]
             return jsonify({"guess": guess, "score": float(score)})
 
         @app.route("/api/get_highlights", methods=["POST"])
         def get_highlights():
+            if self.backend == "bm25":
+                return highlights_unsupported()
             wiki_field = "wiki_content"
             qb_field = "qb_content"
             text = request.form["text"]
@@ -381,6 +538,8 @@ class ElasticSearchGuesser(AbstractGuesser):
 
         @app.route("/api/interface_get_highlights", methods=["POST"])
         def interface_get_highlights():
+            if self.backend == "bm25":
+                return highlights_unsupported()
             wiki_field = "wiki_content"
             qb_field = "qb_content"
             text = request.form["text"]
@@ -446,7 +605,7 @@ class ElasticSearchGuesser(AbstractGuesser):
             text = request.form["text"]
             answer = request.form["answer"]
             answer = answer.replace(" ", "_").lower()
-            guesses = self.guess([text], 20)[0]
+            guesses = cache.guess([text], 20)[0]
 
             score_fn = []
             sum_normalize = 0.0
@@ -483,6 +642,10 @@ class ElasticSearchGuesser(AbstractGuesser):
             guess = [g.replace("_", " ") for g in guess]
             return jsonify({"guess": guess, "score": score, "num": num})
 
+        @app.route("/api/guess_cache", methods=["GET"])
+        def guess_cache_metrics():
+            return jsonify(cache.metrics())
+
         app.run(host=host, port=port, debug=debug)
 
 
@@ -8,17 +8,17 @@ import numpy as np
 import cloudpickle
 import torch
 import torch.nn as nn
-from torch.nn import functional as F
 from torch.autograd import Variable
 from torch.optim import Adam, lr_scheduler
 from allennlp.modules.elmo import Elmo, batch_to_ids
 
 from qanta.datasets.abstract import QuestionText, Page, TrainingData
-from qanta.guesser.abstract import AbstractGuesser
+from qanta.guesser.abstract import AbstractGuesser, GuessArrays, arrays_to_guesses
 from qanta.preprocess import preprocess_dataset, tokenize_question
 from qanta.util.io import get_tmp_filename, shell
 from qanta.config import conf
 from qanta.torch import (
+    top_k_logits,
     BaseLogger,
     TerminateOnNaN,
     EarlyStopping,
@@ -97,6 +97,8 @@ def batchify(x_data, y_data, batch_size=128, shuffle=False):
 
 
 class ElmoGuesser(AbstractGuesser):
+    releases_gil = True
+
     def __init__(self, config_num):
         super(ElmoGuesser, self).__init__(config_num)
         if config_num is not None:
@@ -208,22 +210,32 @@ class ElmoGuesser(AbstractGuesser):
     def guess(
         self, questions: List[QuestionText], max_n_guesses: Optional[int]
     ) -> List[List[Tuple[Page, float]]]:
+        return arrays_to_guesses(self.guess_arrays(questions, max_n_guesses))
+
+    def guess_arrays(
+        self, questions: List[QuestionText], max_n_guesses: Optional[int]
+    ) -> GuessArrays:
         y_data = np.zeros((len(questions)))
         x_data = [tokenize_question(q) for q in questions]
         batches = batchify(x_data, y_data, shuffle=False, batch_size=32)
-        guesses = []
-        for x_batch, y_batch, length_batch in batches:
-            out = self.model(x_batch.cuda(), length_batch.cuda())
-            probs = F.softmax(out).data.cpu().numpy()
-            preds = np.argsort(-probs, axis=1)
-            n_examples = probs.shape[0]
-            for i in range(n_examples):
-                example_guesses = []
-                for p in preds[i][:max_n_guesses]:
-                    example_guesses.append((self.i_to_class[p], probs[i][p]))
-                guesses.append(example_guesses)
-
-        return guesses
+        batch_indices = []
+        batch_scores = []
+        with torch.no_grad():
+            for x_batch, y_batch, length_batch in batches:
+                out = self.model(x_batch.cuda(), length_batch.cuda())
+                indices, scores = top_k_logits(out, max_n_guesses)
+                batch_indices.append(indices)
+                batch_scores.append(scores)
+
+        if len(batch_indices) == 0:
+            return GuessArrays(
+                self.i_to_class,
+                np.zeros((0, 0), dtype=np.int32),
+                np.zeros((0, 0), dtype=np.float32),
+            )
+        return GuessArrays(
+            self.i_to_class, np.concatenate(batch_indices), np.concatenate(batch_scores)
+        )
 
     @classmethod
     def targets(cls) -> List[str]:
@@ -0,0 +1,172 @@
+from typing import List, Tuple, Optional, Dict
+import re
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+
+from qanta import qlogging
+from qanta.config import conf
+
+
+log = qlogging.get(__name__)
+
+whitespace_pattern = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize the text of a guess request so that requests differing only in unicode composition
+    or whitespace share a cache entry
+    """
+    return whitespace_pattern.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+def complete_words(text: str) -> str:
+    """
+    Drop a trailing partial word, for example "name this aut" becomes "name this". Text that ends
+    in whitespace or punctuation is already complete.
+    """
+    if len(text) == 0 or not text[-1].isalnum():
+        return text.rstrip()
+    boundary = len(text)
+    while boundary > 0 and text[boundary - 1].isalnum():
+        boundary -= 1
+    if boundary == 0:
+        return text
+    return text[:boundary].rstrip()
+
+
+class GuessCache:
+    def __init__(
+        self,
+        guesser,
+        name: Optional[str] = None,
+        max_size=10000,
+        ttl: Optional[float] = None,
+        prefix_lookup=False,
+    ):
+        """
+        Bounded LRU cache in front of AbstractGuesser.guess for serving. Entries are keyed by the
+        guesser name, its config_num, max_n_guesses, and the normalized text, so one cache can be
+        shared by several guessers. Thread safe, calls to the guesser are made outside of the lock.
+
+        :param guesser: guesser to answer cache misses
+        :param name: name of the guesser in keys, by default its display name
+        :param max_size: maximum number of entries, the least recently used entry is evicted first
+        :param ttl: if not None, entries expire after this many seconds
+        :param prefix_lookup: if True, a trailing partial word is ignored so that the prefixes sent
+            while a word is being read share the entry of the last complete word. Guesses are then
+            computed on the complete words only.
+        """
+        self.guesser = guesser
+        if name is None:
+            name = guesser.display_name()
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.prefix_lookup = prefix_lookup
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.prefix_hits = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def key_text(self, text: str) -> str:
+        text = normalize_text(text)
+        if self.prefix_lookup:
+            return complete_words(text)
+        else:
+            return text
+
+    def _key(self, text: str, max_n_guesses: Optional[int]):
+        return self.name, self.guesser.config_num, max_n_guesses, text
+
+    def _get(self, key, now: float):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        inserted, guesses = entry
+        if self.ttl is not None and now - inserted > self.ttl:
+            del self._entries[key]
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return guesses
+
+    def _put(self, key, guesses, now: float):
+        self._entries[key] = (now, guesses)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def guess(
+        self, questions: List[str], max_n_guesses: Optional[int]
+    ) -> List[List[Tuple[str, float]]]:
+        """
+        Same as AbstractGuesser.guess, texts that are not cached are guessed on in one call
+        """
+        key_texts = [self.key_text(q) for q in questions]
+        results = [None] * len(questions)
+        missing = OrderedDict()
+        now = time.monotonic()
+        with self._lock:
+            for i, (question, text) in enumerate(zip(questions, key_texts)):
+                guesses = self._get(self._key(text, max_n_guesses), now)
+                if guesses is None:
+                    missing.setdefault(text, []).append(i)
+                    self.misses += 1
+                else:
+                    results[i] = guesses
+                    self.hits += 1
+                    if text != normalize_text(question):
+                        self.prefix_hits += 1
+
+        if len(missing) > 0:
+            missing_texts = list(missing)
+            missing_guesses = self.guesser.guess(missing_texts, max_n_guesses)
+            now = time.monotonic()
+            with self._lock:
+                for text, guesses in zip(missing_texts, missing_guesses):
+                    self._put(self._key(text, max_n_guesses), guesses, now)
+                    for i in missing[text]:
+                        results[i] = guesses
+
+        # Callers may modify the lists they get, the cached lists are not shared with them
+        return [list(guesses) for guesses in results]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            n_requests = self.hits + self.misses
+            return {
+                "name": self.name,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "prefix_hits": self.prefix_hits,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": self.hits / n_requests if n_requests > 0 else 0.0,
+            }
+
+
+def create_guess_cache(guesser, name: Optional[str] = None) -> GuessCache:
+    """
+    GuessCache configured by guess_cache in the qanta config
+    """
+    cache_conf = conf["guess_cache"]
+    return GuessCache(
+        guesser,
+        name=name,
+        max_size=cache_conf["max_size"],
+        ttl=cache_conf["ttl"],
+        prefix_lookup=cache_conf["prefix_lookup"],
+    )
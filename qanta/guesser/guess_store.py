@@ -0,0 +1,212 @@
+from typing import List, Optional, Iterable, Tuple, Dict
+import os
+import json
+import shutil
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from qanta import qlogging
+
+
+log = qlogging.get(__name__)
+
+
+GUESS_COLUMNS = [
+    "qanta_id",
+    "proto_id",
+    "char_index",
+    "guess",
+    "score",
+    "fold",
+    "guesser",
+]
+
+# Columns that repeat few distinct values across rows and are stored dictionary encoded
+DICTIONARY_COLUMNS = ["guess", "fold", "guesser"]
+
+# Fixed so that files written separately, for example one per fold, can be concatenated
+GUESS_SCHEMA = pa.schema(
+    [
+        ("qanta_id", pa.int64()),
+        ("proto_id", pa.string()),
+        ("char_index", pa.int64()),
+        ("guess", pa.dictionary(pa.int32(), pa.string())),
+        ("score", pa.float64()),
+        ("fold", pa.dictionary(pa.int32(), pa.string())),
+        ("guesser", pa.dictionary(pa.int32(), pa.string())),
+    ]
+)
+
+# Number of distinct qanta_ids stored in each parquet row group. Row group statistics let reads
+# filtered by qanta_id skip every row group whose range does not overlap the filter.
+QUESTIONS_PER_ROW_GROUP = 1000
+
+
+def to_guess_table(guess_df: pd.DataFrame) -> pa.Table:
+    guess_df = guess_df[GUESS_COLUMNS].sort_values(
+        ["qanta_id", "char_index"], kind="mergesort"
+    )
+    guess_df = guess_df.astype({c: "category" for c in DICTIONARY_COLUMNS})
+    guess_df["proto_id"] = [
+        None if pd.isnull(p) else str(p) for p in guess_df["proto_id"]
+    ]
+    return pa.Table.from_pandas(guess_df, schema=GUESS_SCHEMA, preserve_index=False)
+
+
+def row_group_boundaries(qanta_ids: np.ndarray) -> List[Tuple[int, int]]:
+    """
+    Split rows sorted by qanta_id into ranges that each contain QUESTIONS_PER_ROW_GROUP qanta_ids
+    """
+    if len(qanta_ids) == 0:
+        return []
+    question_starts = np.flatnonzero(np.r_[True, qanta_ids[1:] != qanta_ids[:-1]])
+    group_starts = question_starts[::QUESTIONS_PER_ROW_GROUP]
+    group_ends = np.r_[group_starts[1:], len(qanta_ids)]
+    return list(zip(group_starts.tolist(), group_ends.tolist()))
+
+
+def write_guesses(guess_df: pd.DataFrame, path: str) -> None:
+    """
+    Write a guess dataframe as parquet sorted by (qanta_id, char_index) with one row group per
+    QUESTIONS_PER_ROW_GROUP questions and dictionary encoded guess/fold/guesser columns
+    """
+    table = to_guess_table(guess_df)
+    qanta_ids = table.column("qanta_id").to_numpy()
+    with pq.ParquetWriter(
+        path, GUESS_SCHEMA, use_dictionary=DICTIONARY_COLUMNS
+    ) as writer:
+        for start, end in row_group_boundaries(qanta_ids):
+            writer.write_table(table.slice(start, end - start))
+        if table.num_rows == 0:
+            writer.write_table(table)
+
+
+def guess_filters(
+    folds: Optional[Iterable[str]] = None,
+    qanta_ids: Optional[Iterable[int]] = None,
+    min_char_index: Optional[int] = None,
+    max_char_index: Optional[int] = None,
+):
+    filters = []
+    if folds is not None:
+        filters.append(("fold", "in", list(folds)))
+    if qanta_ids is not None:
+        filters.append(("qanta_id", "in", [int(q) for q in qanta_ids]))
+    if min_char_index is not None:
+        filters.append(("char_index", ">=", min_char_index))
+    if max_char_index is not None:
+        filters.append(("char_index", "<=", max_char_index))
+    if len(filters) == 0:
+        return None
+    else:
+        return filters
+
+
+def read_guesses(
+    paths: List[str],
+    *,
+    folds: Optional[Iterable[str]] = None,
+    qanta_ids: Optional[Iterable[int]] = None,
+    min_char_index: Optional[int] = None,
+    max_char_index: Optional[int] = None,
+    columns: Optional[List[str]] = None,
+    categorical: bool = False,
+) -> pd.DataFrame:
+    """
+    Read guesses written by write_guesses. Files are memory mapped, filters are pushed down to
+    skip row groups that cannot match, and all files are combined as arrow tables so there is a
+    single conversion to pandas.
+
+    :param paths: parquet guess files
+    :param folds: if given, only keep guesses in these folds
+    :param qanta_ids: if given, only keep guesses for these questions
+    :param min_char_index: if given, only keep guesses at or after this character index
+    :param max_char_index: if given, only keep guesses at or before this character index
+    :param columns: if given, only read these columns
+    :param categorical: if true guess, fold, and guesser are categorical columns, which saves
+        memory, otherwise they are string columns like in guess dataframes before they are written
+    :return: guesses across all the paths
+    """
+    filters = guess_filters(
+        folds=folds,
+        qanta_ids=qanta_ids,
+        min_char_index=min_char_index,
+        max_char_index=max_char_index,
+    )
+    tables = [
+        pq.read_table(p, columns=columns, filters=filters, memory_map=True)
+        for p in paths
+    ]
+    table = pa.concat_tables(tables)
+    if not categorical:
+        for i, field in enumerate(table.schema):
+            if pa.types.is_dictionary(field.type):
+                table = table.set_column(
+                    i, field.name, table.column(i).cast(field.type.value_type)
+                )
+    return table.to_pandas()
+
+
+class ChunkedGuessWriter:
+    def __init__(self, path: str, params: Dict):
+        """
+        Writes a guess file one chunk of questions at a time so that callers never hold more than
+        a chunk of guesses in memory. Each chunk is written to its own part file next to path and
+        recorded in a checkpoint, if the process is killed a new writer with the same params
+        resumes after the last completed chunk. ChunkedGuessWriter.finish merges the parts into
+        path one row group at a time.
+
+        :param path: final parquet guess file
+        :param params: parameters that determine the guesses, for example the guesser and chunk
+            size. Existing parts are only reused if these match, they must be json serializable
+        """
+        self.path = path
+        self.params = json.loads(json.dumps(params))
+        self.parts_dir = path + ".parts"
+        self.checkpoint_path = os.path.join(self.parts_dir, "checkpoint.json")
+        self.n_completed = self._read_checkpoint()
+
+    def _read_checkpoint(self) -> int:
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as f:
+                checkpoint = json.load(f)
+            if checkpoint["params"] == self.params:
+                return checkpoint["n_completed"]
+            log.info(
+                f"Parameters in {self.checkpoint_path} do not match, discarding completed chunks"
+            )
+        if os.path.exists(self.parts_dir):
+            shutil.rmtree(self.parts_dir)
+        os.makedirs(self.parts_dir)
+        return 0
+
+    def _write_checkpoint(self):
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"params": self.params, "n_completed": self.n_completed}, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def part_path(self, part: int) -> str:
+        return os.path.join(self.parts_dir, f"part-{part:05d}.parquet")
+
+    def write_chunk(self, guess_df: pd.DataFrame) -> None:
+        part_path = self.part_path(self.n_completed)
+        write_guesses(guess_df, part_path + ".tmp")
+        os.replace(part_path + ".tmp", part_path)
+        self.n_completed += 1
+        self._write_checkpoint()
+
+    def finish(self) -> None:
+        tmp_path = self.path + ".tmp"
+        with pq.ParquetWriter(
+            tmp_path, GUESS_SCHEMA, use_dictionary=DICTIONARY_COLUMNS
+        ) as writer:
+            for part in range(self.n_completed):
+                part_file = pq.ParquetFile(self.part_path(part), memory_map=True)
+                for row_group in range(part_file.num_row_groups):
+                    writer.write_table(part_file.read_row_group(row_group))
+        os.replace(tmp_path, self.path)
+        shutil.rmtree(self.parts_dir)
@@ -5,6 +5,7 @@ import os
 import pickle
 
 from qanta.util.io import safe_open
+from qanta.util.word_vectors import WordVectors
 from qanta.config import conf
 from qanta import qlogging
 
@@ -20,62 +21,50 @@ def create_embeddings(vocab: Set[str], expand_glove=True, mask_zero=False):
     :param mask_zero: if True, then 0 is reserved as a sequence length mask (distinct from UNK)
     :return: 
     """
+    word_vectors = WordVectors(conf["word_embeddings"])
+    # Words are numbered in the order of the embeddings file
+    rows = np.sort(word_vectors.rows(vocab))
+    rows = rows[rows >= 0]
     embeddings = []
     embedding_lookup = {}
-    with open(conf["word_embeddings"]) as f:
-        i = 0
-        line_number = 0
-        n_bad_embeddings = 0
-        if mask_zero:
-            emb = np.zeros((conf["embedding_dimension"]))
-            embeddings.append(emb)
-            embedding_lookup["MASK"] = i
+    i = 0
+    if mask_zero:
+        embeddings.append(np.zeros((1, conf["embedding_dimension"])))
+        embedding_lookup["MASK"] = i
+        i += 1
+    embeddings.append(np.asarray(word_vectors.vectors[rows], dtype=np.float64))
+    for row in rows:
+        embedding_lookup[word_vectors.words[row]] = i
+        i += 1
+    n_embeddings = i
+    log.info("Loaded {} embeddings".format(n_embeddings))
+    mean_embedding = np.vstack(embeddings).mean(axis=0)
+    if expand_glove:
+        embed_dim = word_vectors.dim
+        words_not_in_glove = vocab - set(embedding_lookup.keys())
+        for w in words_not_in_glove:
+            emb = np.random.rand(embed_dim) * 0.08 * 2 - 0.08
+            embeddings.append(emb[np.newaxis, :])
+            embedding_lookup[w] = i
             i += 1
-        for l in f:
-            splits = l.split()
-            word = splits[0]
-            if word in vocab:
-                try:
-                    emb = [float(n) for n in splits[1:]]
-                except ValueError:
-                    n_bad_embeddings += 1
-                    continue
-                embeddings.append(emb)
-                embedding_lookup[word] = i
-                i += 1
-            line_number += 1
-        n_embeddings = i
-        log.info("Loaded {} embeddings".format(n_embeddings))
+
         log.info(
-            "Encountered {} bad embeddings that were skipped".format(n_bad_embeddings)
-        )
-        mean_embedding = np.array(embeddings).mean(axis=0)
-        if expand_glove:
-            embed_dim = len(embeddings[0])
-            words_not_in_glove = vocab - set(embedding_lookup.keys())
-            for w in words_not_in_glove:
-                emb = np.random.rand(embed_dim) * 0.08 * 2 - 0.08
-                embeddings.append(emb)
-                embedding_lookup[w] = i
-                i += 1
-
-            log.info(
-                "Initialized an additional {} embeddings not in dataset".format(
-                    i - n_embeddings
-                )
+            "Initialized an additional {} embeddings not in dataset".format(
+                i - n_embeddings
             )
-
-        log.info("Total number of embeddings: {}".format(i))
-
-        embeddings = np.array(embeddings)
-        embed_with_unk = np.vstack(
-            [embeddings, mean_embedding, mean_embedding, mean_embedding, mean_embedding]
         )
-        embedding_lookup["UNK"] = i
-        embedding_lookup["EOS"] = i + 1
-        embedding_lookup["STARTMENTION"] = i + 2
-        embedding_lookup["ENDMENTION"] = i + 3
-        return embed_with_unk, embedding_lookup
+
+    log.info("Total number of embeddings: {}".format(i))
+
+    embeddings = np.vstack(embeddings)
+    embed_with_unk = np.vstack(
+        [embeddings, mean_embedding, mean_embedding, mean_embedding, mean_embedding]
+    )
+    embedding_lookup["UNK"] = i
+    embedding_lookup["EOS"] = i + 1
+    embedding_lookup["STARTMENTION"] = i + 2
+    embedding_lookup["ENDMENTION"] = i + 3
+    return embed_with_unk, embedding_lookup
 
 
 def convert_text_to_embeddings_indices(
@@ -11,7 +11,6 @@ import numpy as np
 import torch
 import torch.nn as nn
 from torch.autograd import Variable
-from torch.nn import functional as F
 from torch.optim import Adam, lr_scheduler
 
 from torchtext.data.field import Field
@@ -20,10 +19,18 @@ from torchtext.data.iterator import Iterator
 from qanta import qlogging
 from qanta.util.io import shell, get_tmp_filename
 from qanta.torch.dataset import QuizBowl, create_qb_tokenizer
+from qanta.torch.tokenization import QbTokenizer
 from qanta.config import conf
-from qanta.guesser.abstract import AbstractGuesser
+from qanta.guesser.abstract import AbstractGuesser, GuessArrays, arrays_to_guesses
+from qanta.guesser.guess_cache import create_guess_cache
 from qanta.datasets.abstract import QuestionText
 from qanta.torch import (
+    token_budget_batches,
+    unbatch,
+    top_k_logits,
+    inference_device,
+    torchtext_device,
+    prepare_inference_model,
     BaseLogger,
     TerminateOnNaN,
     EarlyStopping,
@@ -207,8 +214,14 @@ class RnnModel(nn.Module):
 
 
 class RnnGuesser(AbstractGuesser):
+    releases_gil = True
+
     def __init__(self, config_num):
         super(RnnGuesser, self).__init__(config_num)
+        self.device = "auto"
+        self.n_inference_threads = None
+        self.quantize = False
+        self.max_batch_tokens = 8192
         if self.config_num is not None:
             guesser_conf = conf["guessers"]["qanta.guesser.rnn.RnnGuesser"][
                 self.config_num
@@ -225,6 +238,11 @@ class RnnGuesser(AbstractGuesser):
 
             self.random_seed = guesser_conf["random_seed"]
 
+            self.device = guesser_conf["device"]
+            self.n_inference_threads = guesser_conf["n_inference_threads"]
+            self.quantize = guesser_conf["quantize"]
+            self.max_batch_tokens = guesser_conf["max_batch_tokens"]
+
         self.page_field: Optional[Field] = None
         self.qanta_id_field: Optional[Field] = None
         self.text_field: Optional[Field] = None
@@ -259,8 +277,8 @@ class RnnGuesser(AbstractGuesser):
             sort_within_batch=True,
         )
         log.info(f"Training Data={len(training_data[0])}")
-        log.info(f"N Train={len(train_iter.dataset.examples)}")
-        log.info(f"N Test={len(val_iter.dataset.examples)}")
+        log.info(f"N Train={len(train_iter.dataset)}")
+        log.info(f"N Test={len(val_iter.dataset)}")
         fields: Dict[str, Field] = train_iter.dataset.fields
         self.page_field = fields["page"]
         self.n_classes = len(self.ans_to_i)
@@ -365,21 +383,69 @@ class RnnGuesser(AbstractGuesser):
     def guess(self, questions: List[QuestionText], max_n_guesses: Optional[int]):
         if len(questions) == 0:
             return []
-        batch_size = 128
-        if len(questions) < batch_size:
-            return self._guess_batch(questions, max_n_guesses)
-        else:
-            all_guesses = []
-            for i in range(0, len(questions), batch_size):
-                batch_questions = questions[i : i + batch_size]
-                guesses = self._guess_batch(batch_questions, max_n_guesses)
-                all_guesses.extend(guesses)
-            return all_guesses
-
-    def _guess_batch(self, questions: List[QuestionText], max_n_guesses: Optional[int]):
+        return arrays_to_guesses(self.guess_arrays(questions, max_n_guesses))
+
+    def guess_arrays(
+        self, questions: List[QuestionText], max_n_guesses: Optional[int]
+    ) -> GuessArrays:
         if len(questions) == 0:
-            return []
-        examples = [self.text_field.preprocess(q) for q in questions]
+            return GuessArrays(
+                self.i_to_ans,
+                np.zeros((0, 0), dtype=np.int32),
+                np.zeros((0, 0), dtype=np.float32),
+            )
+        return self._guess_examples(
+            [self.text_field.preprocess(q) for q in questions], max_n_guesses
+        )
+
+    def guess_runs_arrays(
+        self,
+        questions: List[QuestionText],
+        char_indices: List[List[int]],
+        max_n_guesses: Optional[int],
+        qanta_ids: Optional[List[int]] = None,
+    ) -> GuessArrays:
+        """
+        Tokenize each question once, read from the token cache when qanta_ids are given, and
+        take the tokens of each run as a slice of the question's tokens
+        """
+        tokenizer = self.text_field.tokenize
+        if not isinstance(tokenizer, QbTokenizer):
+            return super().guess_runs_arrays(
+                questions, char_indices, max_n_guesses, qanta_ids=qanta_ids
+            )
+        if sum(len(indices) for indices in char_indices) == 0:
+            return self.guess_arrays([], max_n_guesses)
+        run_tokens = tokenizer.run_tokens(questions, char_indices, qanta_ids=qanta_ids)
+        return self._guess_examples(
+            [self.text_field.preprocess(tokens) for tokens in run_tokens],
+            max_n_guesses,
+        )
+
+    def _guess_examples(self, examples, max_n_guesses: Optional[int]) -> GuessArrays:
+        batches = token_budget_batches(
+            [len(e) for e in examples], self.max_batch_tokens
+        )
+        batch_indices = []
+        batch_scores = []
+        for batch in batches:
+            indices, scores = self._guess_batch(
+                [examples[i] for i in batch], max_n_guesses
+            )
+            batch_indices.append(indices)
+            batch_scores.append(scores)
+        return GuessArrays(
+            self.i_to_ans,
+            unbatch(batches, batch_indices),
+            unbatch(batches, batch_scores),
+        )
+
+    def _guess_batch(self, examples, max_n_guesses: Optional[int]):
+        """
+        :param examples: preprocessed questions
+        :return: [n_questions, max_n_guesses] int32 answer indices and float32 probabilities,
+            sorted from most to least probable
+        """
         padded_examples, lengths = self.text_field.pad(examples)
         padded_examples = np.array(padded_examples, dtype=np.object)
         lengths = np.array(lengths)
@@ -387,25 +453,20 @@ class RnnGuesser(AbstractGuesser):
         rev_order = np.argsort(order)
         ordered_examples = padded_examples[order]
         ordered_lengths = lengths[order]
+        device = inference_device(self.device)
         text, lengths = self.text_field.numericalize(
-            (ordered_examples, ordered_lengths), device=None, train=False
+            (ordered_examples, ordered_lengths),
+            device=torchtext_device(device),
+            train=False,
         )
         lengths = list(lengths.cpu().numpy())
 
-        qanta_ids = self.qanta_id_field.process([0 for _ in questions]).cuda()
-        guesses = []
-        hidden_init = self.model.init_hidden(len(questions))
-        out, _ = self.model(text, lengths, hidden_init, qanta_ids)
-        ordered_probs = F.softmax(out).data.cpu().numpy()
-        probs = ordered_probs[rev_order]
-
-        n_examples = probs.shape[0]
-        preds = np.argsort(-probs, axis=1)
-        for i in range(n_examples):
-            guesses.append([])
-            for p in preds[i][:max_n_guesses]:
-                guesses[-1].append((self.i_to_ans[p], probs[i][p]))
-        return guesses
+        qanta_ids = self.qanta_id_field.process([0 for _ in examples]).to(device)
+        with torch.no_grad():
+            hidden_init = self.model.init_hidden(len(examples))
+            out, _ = self.model(text, lengths, hidden_init, qanta_ids)
+            indices, scores = top_k_logits(out, max_n_guesses)
+        return indices[rev_order], scores[rev_order]
 
     def save(self, directory: str):
         shutil.copyfile(self.model_file, os.path.join(directory, "rnn.pt"))
@@ -462,14 +523,14 @@ class RnnGuesser(AbstractGuesser):
             n_hidden_units=guesser.n_hidden_units,
         )
         guesser.model.load_state_dict(
-            torch.load(
-                os.path.join(directory, "rnn.pt"),
-                map_location=lambda storage, loc: storage,
-            )
+            torch.load(os.path.join(directory, "rnn.pt"), map_location="cpu")
+        )
+        guesser.model = prepare_inference_model(
+            guesser.model,
+            inference_device(guesser.device),
+            n_threads=guesser.n_inference_threads,
+            quantize=guesser.quantize,
         )
-        guesser.model.eval()
-        if CUDA:
-            guesser.model = guesser.model.cuda()
         return guesser
 
     @classmethod
@@ -480,11 +541,12 @@ class RnnGuesser(AbstractGuesser):
         from flask import Flask, jsonify, request
 
         app = Flask(__name__)
+        cache = create_guess_cache(self)
 
         @app.route("/api/answer_question", methods=["POST"])
         def answer_question_base():
             text = request.form["text"]
-            guess, score = self.guess([text], 1)[0][0]
+            guess, score = cache.guess([text], 1)[0][0]
             return jsonify({"guess": guess, "score": float(score)})
 
         @app.route("/api/interface_get_highlights", methods=["POST"])
@@ -520,7 +582,7 @@ class RnnGuesser(AbstractGuesser):
             indicator = -1
 
             guess = str(guessForEvidence)
-            guesses = self.guess([request.form["text"]], 500)[0]
+            guesses = cache.guess([request.form["text"]], 500)[0]
             for index, (g, s) in enumerate(guesses):
                 print(g.lower().replace("_", " ")[0:25])
                 print(guessForEvidence)
@@ -600,7 +662,7 @@ class RnnGuesser(AbstractGuesser):
             text = request.form["text"]
             answer = request.form["answer"]
             answer = answer.replace(" ", "_").lower()
-            guesses = self.guess([text], 20)[0]
+            guesses = cache.guess([text], 20)[0]
             score_fn = []
             sum_normalize = 0.0
             for (g, s) in guesses:
@@ -636,4 +698,8 @@ class RnnGuesser(AbstractGuesser):
             guess = [g.replace("_", " ") for g in guess]
             return jsonify({"guess": guess, "score": score, "num": num})
 
+        @app.route("/api/guess_cache", methods=["GET"])
+        def guess_cache_metrics():
+            return jsonify(cache.metrics())
+
         app.run(host=host, port=port, debug=debug)
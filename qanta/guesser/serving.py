@@ -0,0 +1,344 @@
+from typing import List, Tuple, Optional, Callable, Dict
+import time
+import asyncio
+import threading
+from concurrent.futures import (
+    Future,
+    ThreadPoolExecutor,
+    ProcessPoolExecutor,
+    TimeoutError,
+)
+
+from qanta import qlogging
+from qanta.config import conf
+
+
+log = qlogging.get(__name__)
+
+
+GuessFunction = Callable[[List[str], Optional[int]], List[List[Tuple[str, float]]]]
+
+
+class MicroBatcher:
+    def __init__(
+        self,
+        guess: GuessFunction,
+        name="guesser",
+        max_latency=0.01,
+        max_batch_size=64,
+        timeout=30.0,
+    ):
+        """
+        Collects guess requests made concurrently, for example by the threads of a web server, and
+        answers them with one batched call to guess. An asyncio event loop running in a background
+        thread takes the first queued request, waits at most max_latency seconds or until
+        max_batch_size requests are queued, then calls guess on the batch in a worker thread.
+        Requests queued while a batch is being guessed on are part of the next batch, so batches
+        grow with load. Guess is never called concurrently, guessers need not be thread safe.
+
+        :param guess: function with the signature of AbstractGuesser.guess
+        :param name: name used in logs and metrics
+        :param max_latency: seconds to wait for more requests after the first of a batch
+        :param max_batch_size: maximum number of texts per call to guess
+        :param timeout: default seconds guess_one waits for the answer to a request
+        """
+        self.guess = guess
+        self.name = name
+        self.max_latency = max_latency
+        self.max_batch_size = max_batch_size
+        self.timeout = timeout
+        self.n_batches = 0
+        self.n_requests = 0
+        self.max_observed_batch_size = 0
+        self.max_queue_depth = 0
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._loop = asyncio.new_event_loop()
+        self._queue = None
+        self._task = None
+        started = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run_loop, args=(started,), name=f"{name}-batcher", daemon=True
+        )
+        self._thread.start()
+        started.wait()
+
+    def _run_loop(self, started: threading.Event):
+        asyncio.set_event_loop(self._loop)
+        self._queue = asyncio.Queue()
+        self._task = self._loop.create_task(self._batch_requests())
+        self._loop.call_soon(started.set)
+        self._loop.run_forever()
+
+    async def _next_batch(self) -> List[Tuple[str, Optional[int], Future]]:
+        batch = [await self._queue.get()]
+        deadline = self._loop.time() + self.max_latency
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _batch_requests(self):
+        while True:
+            batch = await self._next_batch()
+            queue_depth = self._queue.qsize()
+            self.n_batches += 1
+            self.n_requests += len(batch)
+            self.max_observed_batch_size = max(self.max_observed_batch_size, len(batch))
+            self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+            log.debug(
+                f"{self.name}: guessing on batch of {len(batch)}, {queue_depth} requests queued"
+            )
+            await self._loop.run_in_executor(self._executor, self._guess_batch, batch)
+
+    def _guess_batch(self, batch: List[Tuple[str, Optional[int], Future]]):
+        # Requests in a batch may ask for different numbers of guesses
+        by_n_guesses = {}
+        for text, max_n_guesses, future in batch:
+            by_n_guesses.setdefault(max_n_guesses, []).append((text, future))
+        for max_n_guesses, requests in by_n_guesses.items():
+            try:
+                guesses = self.guess([text for text, _ in requests], max_n_guesses)
+                if len(guesses) != len(requests):
+                    raise ValueError(
+                        f"{self.name}: guess returned {len(guesses)} results for "
+                        f"{len(requests)} texts"
+                    )
+            except Exception as e:
+                for _, future in requests:
+                    future.set_exception(e)
+            else:
+                for (_, future), text_guesses in zip(requests, guesses):
+                    future.set_result(text_guesses)
+
+    def submit(self, text: str, max_n_guesses: Optional[int]) -> Future:
+        """
+        Queue a request, safe to call from any thread
+        """
+        future = Future()
+        self._loop.call_soon_threadsafe(
+            self._queue.put_nowait, (text, max_n_guesses, future)
+        )
+        return future
+
+    def guess_one(
+        self, text: str, max_n_guesses: Optional[int], timeout: Optional[float] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        Guesses on a single text, raises concurrent.futures.TimeoutError if they are not ready
+        within timeout seconds, by default the timeout of the batcher
+        """
+        if timeout is None:
+            timeout = self.timeout
+        return self.submit(text, max_n_guesses).result(timeout=timeout)
+
+    def metrics(self) -> Dict:
+        return {
+            "name": self.name,
+            "n_batches": self.n_batches,
+            "n_requests": self.n_requests,
+            "mean_batch_size": self.n_requests / self.n_batches
+            if self.n_batches > 0
+            else 0.0,
+            "max_batch_size": self.max_observed_batch_size,
+            "queue_depth": self._queue.qsize(),
+            "max_queue_depth": self.max_queue_depth,
+        }
+
+    async def _shutdown(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._loop.stop()
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop)
+        self._thread.join()
+        self._loop.close()
+        self._executor.shutdown()
+
+
+def create_micro_batcher(guess: GuessFunction, name: str) -> MicroBatcher:
+    """
+    MicroBatcher configured by guess_batching in the qanta config
+    """
+    batching_conf = conf["guess_batching"]
+    return MicroBatcher(
+        guess,
+        name=name,
+        max_latency=batching_conf["max_latency_ms"] / 1000,
+        max_batch_size=batching_conf["max_batch_size"],
+        timeout=batching_conf["timeout"],
+    )
+
+
+# Guesser loaded by the initializer of a ProcessGuesser worker
+_worker_guesser = None
+
+
+def _load_worker_guesser(guesser_class, directory: str):
+    global _worker_guesser
+    _worker_guesser = guesser_class.load(directory)
+
+
+def _worker_guess(questions: List[str], max_n_guesses: Optional[int]):
+    return _worker_guesser.guess(questions, max_n_guesses)
+
+
+def _worker_attribute(name: str):
+    return getattr(_worker_guesser, name)
+
+
+class ProcessGuesser:
+    def __init__(self, guesser_class, directory: str):
+        """
+        Guesser loaded in a worker process of its own, for guessers whose guess holds the GIL so
+        that serving several of them from threads would run them one at a time. Only guess and the
+        attributes used by GuessCache are available.
+
+        :param guesser_class: AbstractGuesser subclass
+        :param directory: directory to load the guesser from
+        """
+        self._executor = ProcessPoolExecutor(
+            max_workers=1,
+            initializer=_load_worker_guesser,
+            initargs=(guesser_class, directory),
+        )
+        # Also waits for the guesser to be loaded so that loading errors are raised here
+        self.config_num = self._executor.submit(
+            _worker_attribute, "config_num"
+        ).result()
+        self._display_name = self._executor.submit(
+            _worker_attribute, "display_name"
+        ).result()()
+
+    def display_name(self) -> str:
+        return self._display_name
+
+    def guess(
+        self, questions: List[str], max_n_guesses: Optional[int]
+    ) -> List[List[Tuple[str, float]]]:
+        return self._executor.submit(_worker_guess, questions, max_n_guesses).result()
+
+    def close(self):
+        self._executor.shutdown()
+
+
+def load_serving_guesser(guesser_class, directory: str):
+    """
+    Load guessers that release the GIL in this process and others in a ProcessGuesser
+    """
+    if guesser_class.releases_gil:
+        return guesser_class.load(directory)
+    else:
+        return ProcessGuesser(guesser_class, directory)
+
+
+class FanOut:
+    def __init__(
+        self,
+        guess_fns: Dict[str, Callable[[str, Optional[int]], List[Tuple[str, float]]]],
+        max_concurrent=4,
+    ):
+        """
+        Guess on a text with every guesser concurrently. Each guesser has its own threads so that
+        a slow guesser does not delay the others. Calls cannot be interrupted, a call that times
+        out still runs to completion and holds its thread. While all max_concurrent threads of a
+        guesser are busy further requests skip it and report it as busy, instead of queueing
+        behind calls that already timed out.
+
+        :param guess_fns: for each guesser name, a function taking a text and max_n_guesses
+        :param max_concurrent: maximum number of calls in progress for each guesser
+        """
+        self.guess_fns = guess_fns
+        self.max_concurrent = max_concurrent
+        self._executors = {
+            name: ThreadPoolExecutor(
+                max_workers=max_concurrent, thread_name_prefix=f"{name}-fanout"
+            )
+            for name in guess_fns
+        }
+        self._n_running = {name: 0 for name in guess_fns}
+        self._lock = threading.Lock()
+
+    def _submit(self, name: str, text: str, max_n_guesses: Optional[int]):
+        with self._lock:
+            if self._n_running[name] >= self.max_concurrent:
+                return None
+            self._n_running[name] += 1
+        future = self._executors[name].submit(self.guess_fns[name], text, max_n_guesses)
+        future.add_done_callback(lambda _: self._finish(name))
+        return future
+
+    def _finish(self, name: str):
+        with self._lock:
+            self._n_running[name] -= 1
+
+    def guess(
+        self, text: str, max_n_guesses: Optional[int], timeout: Optional[float]
+    ) -> Tuple[Dict[str, List[Tuple[str, float]]], Dict[str, str]]:
+        """
+        :param timeout: seconds from the start of the fan out after which guessers that have not
+            answered are reported as errors
+        :return: guesses of each guesser that answered in time, and errors of the others
+        """
+        futures = {
+            name: self._submit(name, text, max_n_guesses) for name in self.guess_fns
+        }
+        deadline = None if timeout is None else time.monotonic() + timeout
+        guesses = {}
+        errors = {}
+        for name, future in futures.items():
+            if future is None:
+                errors[
+                    name
+                ] = f"Busy with {self.max_concurrent} calls that have not finished"
+                continue
+            remaining = (
+                None if deadline is None else max(0, deadline - time.monotonic())
+            )
+            try:
+                guesses[name] = future.result(timeout=remaining)
+            except TimeoutError:
+                errors[name] = f"Timed out after {timeout} seconds"
+            except Exception as e:
+                log.exception(f"Guesser {name} failed")
+                errors[name] = repr(e)
+        return guesses, errors
+
+    def close(self):
+        for executor in self._executors.values():
+            executor.shutdown(wait=False)
+
+
+# Rank constant of reciprocal rank fusion, dampens the weight of the top ranks
+RRF_K = 60
+
+
+def merge_guesses(
+    guesses: Dict[str, List[Tuple[str, float]]], max_n_guesses: Optional[int] = None
+) -> List[Dict]:
+    """
+    Merge the n-best lists of several guessers with reciprocal rank fusion. Scores of different
+    guessers are not comparable, so a page is scored by the sum over guessers of
+    1 / (RRF_K + rank), and each guesser's own score is kept alongside.
+
+    :return: pages sorted from best to worst with their fused score and the score of each guesser
+    """
+    merged = {}
+    for name, guesser_guesses in guesses.items():
+        for rank, (page, score) in enumerate(guesser_guesses, start=1):
+            if page not in merged:
+                merged[page] = {"guess": page, "score": 0.0, "guessers": {}}
+            merged[page]["score"] += 1 / (RRF_K + rank)
+            merged[page]["guessers"][name] = float(score)
+    ranked = sorted(merged.values(), key=lambda m: m["score"], reverse=True)
+    if max_n_guesses is not None:
+        ranked = ranked[:max_n_guesses]
+    return ranked
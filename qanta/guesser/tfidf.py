@@ -1,6 +1,7 @@
 from typing import List, Optional, Dict, Tuple
 import os
-from collections import defaultdict
+import re
+from collections import defaultdict, Counter
 import pickle
 
 from sklearn.feature_extraction.text import TfidfVectorizer
@@ -8,14 +9,49 @@ import numpy as np
 
 from qanta.guesser.abstract import AbstractGuesser
 from qanta.datasets.abstract import QuestionText
+from qanta.util.topk import top_k
+
+
+DEFAULT_TOKEN_PATTERN = r"(?u)\b\w\w+\b"
+
+# Upper bound on the number of dense query x answer scores materialized at once
+MAX_BLOCK_SCORES = 2 ** 24
 
 
 class TfidfGuesser(AbstractGuesser):
+    # Tokenization and the sparse scoring loop run in python
+    releases_gil = False
+
     def __init__(self, config_num: Optional[int]):
         super().__init__(config_num)
         self.tfidf_vectorizer = None
         self.tfidf_matrix = None
         self.i_to_ans = None
+        self._term_matrix = None
+
+    @property
+    def term_matrix(self):
+        """
+        Inverted view of tfidf_matrix with one row per vocabulary term listing the answers that
+        contain it, used to update answer scores one term at a time
+        """
+        if self._term_matrix is None:
+            self._term_matrix = self.tfidf_matrix.T.tocsr()
+        return self._term_matrix
+
+    def _supports_incremental(self) -> bool:
+        vectorizer = self.tfidf_vectorizer
+        return (
+            vectorizer.analyzer == "word"
+            and vectorizer.preprocessor is None
+            and vectorizer.tokenizer is None
+            and vectorizer.strip_accents is None
+            and vectorizer.stop_words is None
+            and vectorizer.token_pattern == DEFAULT_TOKEN_PATTERN
+            and vectorizer.use_idf
+            and vectorizer.norm == "l2"
+            and not vectorizer.sublinear_tf
+        )
 
     def train(self, training_data) -> None:
         questions = training_data[0]
@@ -36,19 +72,142 @@ class TfidfGuesser(AbstractGuesser):
             ngram_range=(1, 3), min_df=2, max_df=0.9
         ).fit(x_array)
         self.tfidf_matrix = self.tfidf_vectorizer.transform(x_array)
+        self._term_matrix = None
 
     def guess(
         self, questions: List[QuestionText], max_n_guesses: Optional[int]
     ) -> List[List[Tuple[str, float]]]:
-        representations = self.tfidf_vectorizer.transform(questions)
-        guess_matrix = self.tfidf_matrix.dot(representations.T).T
-        guess_scores = guess_matrix.max(axis=1).toarray().reshape(-1)
-        guess_indices = np.array(guess_matrix.argmax(axis=1)).reshape(-1)
+        """
+        Scores questions against the inverted index one block at a time so that only
+        MAX_BLOCK_SCORES dense scores exist at any point, regardless of the number of questions
+        """
+        n_answers = self.tfidf_matrix.shape[0]
+        block_size = max(1, MAX_BLOCK_SCORES // n_answers)
+        guesses = []
+        for start in range(0, len(questions), block_size):
+            representations = self.tfidf_vectorizer.transform(
+                questions[start : start + block_size]
+            )
+            block_scores = representations.dot(self.term_matrix).toarray()
+            block_indices, block_top_scores = top_k(block_scores, max_n_guesses)
+            for indices, top_scores in zip(block_indices, block_top_scores):
+                guesses.append(
+                    [
+                        (self.i_to_ans[idx], score)
+                        for idx, score in zip(indices, top_scores)
+                    ]
+                )
+
+        return guesses
+
+    def guess_runs(
+        self,
+        questions: List[QuestionText],
+        char_indices: List[List[int]],
+        max_n_guesses: Optional[int],
+    ) -> List[List[List[Tuple[str, float]]]]:
+        """
+        Tokenizes each question once and walks its runs in order, adding the n-grams completed by
+        each run to a running term count and the corresponding columns of tfidf_matrix to running
+        answer scores. A token cut in half by a run boundary is scored for that run only, which
+        reproduces exactly what TfidfVectorizer.transform would do on the prefix.
+        """
+        if not self._supports_incremental():
+            return super().guess_runs(questions, char_indices, max_n_guesses)
+
+        guesses = []
+        for text, indices in zip(questions, char_indices):
+            if self.tfidf_vectorizer.lowercase:
+                normalized_text = text.lower()
+            else:
+                normalized_text = text
+            if len(normalized_text) != len(text):
+                # Lowercasing changed character offsets so runs cannot be aligned to tokens
+                guesses.extend(super().guess_runs([text], [indices], max_n_guesses))
+            else:
+                guesses.append(
+                    self._guess_runs_incremental(
+                        normalized_text, indices, max_n_guesses
+                    )
+                )
+        return guesses
+
+    def _guess_runs_incremental(
+        self, text: str, char_indices: List[int], max_n_guesses: Optional[int]
+    ) -> List[List[Tuple[str, float]]]:
+        vocabulary = self.tfidf_vectorizer.vocabulary_
+        idf = self.tfidf_vectorizer.idf_
+        min_n, max_n = self.tfidf_vectorizer.ngram_range
+        token_pattern = re.compile(self.tfidf_vectorizer.token_pattern)
+        term_matrix = self.term_matrix
+
+        def ngram_features(tokens, end):
+            features = []
+            for n in range(min_n, max_n + 1):
+                if end - n >= 0:
+                    feature = vocabulary.get(" ".join(tokens[end - n : end]))
+                    if feature is not None:
+                        features.append(feature)
+            return features
+
+        def add_features(scores, counts, deltas):
+            sq_norm_change = 0.0
+            for feature, delta in deltas.items():
+                count = counts.get(feature, 0)
+                weight = idf[feature]
+                sq_norm_change += ((count + delta) ** 2 - count ** 2) * weight ** 2
+                start, end = (
+                    term_matrix.indptr[feature],
+                    term_matrix.indptr[feature + 1],
+                )
+                scores[term_matrix.indices[start:end]] += (
+                    term_matrix.data[start:end] * delta * weight
+                )
+            return sq_norm_change
+
+        matches = list(token_pattern.finditer(text))
+        tokens = [m.group() for m in matches]
+        scores = np.zeros(self.tfidf_matrix.shape[0])
+        counts = {}
+        sq_norm = 0.0
+        n_complete = 0
+        last_end = 0
         guesses = []
-        for i in range(len(questions)):
-            idx = guess_indices[i]
-            score = guess_scores[i]
-            guesses.append([(self.i_to_ans[idx], score)])
+        for char_ix in char_indices:
+            deltas = Counter()
+            while n_complete < len(matches) and matches[n_complete].end() <= char_ix:
+                n_complete += 1
+                deltas.update(ngram_features(tokens, n_complete))
+                last_end = matches[n_complete - 1].end()
+            sq_norm += add_features(scores, counts, deltas)
+            for feature, delta in deltas.items():
+                counts[feature] = counts.get(feature, 0) + delta
+
+            partial = [
+                m.group() for m in token_pattern.finditer(text[last_end:char_ix])
+            ]
+            if len(partial) == 0:
+                run_scores = scores
+                run_sq_norm = sq_norm
+            else:
+                run_tokens = tokens[:n_complete] + partial
+                partial_deltas = Counter()
+                for end in range(n_complete + 1, len(run_tokens) + 1):
+                    partial_deltas.update(ngram_features(run_tokens, end))
+                run_scores = scores.copy()
+                run_sq_norm = sq_norm + add_features(run_scores, counts, partial_deltas)
+
+            if run_sq_norm > 0:
+                run_scores = run_scores / np.sqrt(run_sq_norm)
+            else:
+                run_scores = np.zeros_like(run_scores)
+            indices, top_scores = top_k(run_scores.reshape(1, -1), max_n_guesses)
+            guesses.append(
+                [
+                    (self.i_to_ans[idx], score)
+                    for idx, score in zip(indices[0], top_scores[0])
+                ]
+            )
 
         return guesses
 
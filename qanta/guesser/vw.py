@@ -1,7 +1,12 @@
 from typing import List, Tuple, Optional
 from pprint import pformat
 import tempfile
+import subprocess
+import threading
+import atexit
+import socket
 import pickle
+import time
 import os
 import random
 import re
@@ -19,13 +24,122 @@ def format_question(text):
     return re.sub(r"[^a-z0-9 ]+", "", text.lower())
 
 
+class VWDaemon:
+    # Seconds to wait for vw to load the model and listen on its port
+    STARTUP_TIMEOUT = 300
+    # Examples sent before reading their predictions, small enough that the examples fit in the
+    # socket buffers so that vw never blocks writing predictions that are not being read
+    CHUNK_SIZE = 64
+
+    def __init__(self, model_file: str, probabilities: bool):
+        """
+        Long lived vw process serving predictions of a model over a local socket, so that the
+        model is loaded once rather than on every call to guess. The process is started on the
+        first prediction and stopped by close or when the python process exits.
+
+        :param model_file: model trained by VWGuesser.train
+        :param probabilities: if True, vw predicts the probability of every class, only one
+            against all models support this
+        """
+        self.model_file = model_file
+        self.probabilities = probabilities
+        self._process = None
+        self._socket = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        port_file = get_tmp_filename()
+        args = [
+            "vw",
+            "-t",
+            "-i",
+            self.model_file,
+            "--daemon",
+            "--foreground",
+            "--num_children",
+            "1",
+            "--port",
+            "0",
+            "--port_file",
+            port_file,
+            "--quiet",
+        ]
+        if self.probabilities:
+            args.append("--probabilities")
+        log.info(f"Starting vw daemon:\n{' '.join(args)}")
+        self._process = subprocess.Popen(args)
+        atexit.register(self.close)
+        try:
+            deadline = time.monotonic() + self.STARTUP_TIMEOUT
+            port = None
+            while port is None:
+                if self._process.poll() is not None:
+                    raise RuntimeError(
+                        f"vw daemon exited with code {self._process.returncode}"
+                    )
+                if time.monotonic() > deadline:
+                    raise RuntimeError(
+                        f"vw daemon did not start within {self.STARTUP_TIMEOUT} seconds"
+                    )
+                if os.path.exists(port_file):
+                    with open(port_file) as f:
+                        contents = f.read().strip()
+                    if contents != "":
+                        port = int(contents)
+                        continue
+                time.sleep(0.1)
+            self._socket = socket.create_connection(("localhost", port))
+            self._file = self._socket.makefile("r", encoding="utf-8")
+        except Exception:
+            self.close()
+            raise
+        finally:
+            if os.path.exists(port_file):
+                os.remove(port_file)
+
+    def predict(self, examples: List[str]) -> List[str]:
+        """
+        :param examples: examples in vw input format without trailing newlines
+        :return: the prediction line of each example
+        """
+        with self._lock:
+            if self._process is None:
+                self._start()
+            predictions = []
+            for i in range(0, len(examples), self.CHUNK_SIZE):
+                chunk = examples[i : i + self.CHUNK_SIZE]
+                self._socket.sendall("".join(f"{e}\n" for e in chunk).encode("utf-8"))
+                for _ in chunk:
+                    line = self._file.readline()
+                    if line == "":
+                        raise RuntimeError("vw daemon closed the connection")
+                    predictions.append(line.strip())
+            return predictions
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+        if self._process is not None:
+            self._process.terminate()
+            self._process.wait()
+            self._process = None
+
+
 class VWGuesser(AbstractGuesser):
+    releases_gil = True
+
     def __init__(self, config_num):
         super().__init__(config_num)
         self.label_to_i = None
         self.i_to_label = None
         self.max_label = None
         self.model_file = None
+        self.daemon = None
         if self.config_num is not None:
             guesser_conf = conf["guessers"]["qanta.guesser.vw.VWGuesser"][
                 self.config_num
@@ -117,21 +231,36 @@ class VWGuesser(AbstractGuesser):
     def guess(
         self, questions: List[QuestionText], max_n_guesses: Optional[int]
     ) -> List[List[Tuple[Page, float]]]:
-        temp_dir = get_tmp_dir()
-        with tempfile.NamedTemporaryFile("w", delete=False, dir=temp_dir) as f:
-            file_name = f.name
-            for q in questions:
-                features = format_question(q)
-                f.write(f"1 |words {features}\n")
-        shell(f"vw -t -i {self.model_file} -p {file_name}_preds -d {file_name}")
+        if self.daemon is None:
+            # Only one against all models predict the probability of each class, online trees
+            # predict a single label
+            self.daemon = VWDaemon(
+                self.model_file, probabilities=self.multiclass_one_against_all
+            )
+        lines = self.daemon.predict([f"|words {format_question(q)}" for q in questions])
         predictions = []
-        with open(f"{file_name}_preds") as f:
-            for line in f:
-                label = int(line)
-                predictions.append([(self.i_to_label[label], 0)])
-        shell(f"rm -f {file_name}.preds {file_name}")
+        for line in lines:
+            if self.daemon.probabilities:
+                scores = []
+                for label_prob in line.split():
+                    label, prob = label_prob.split(":")
+                    scores.append((self.i_to_label[int(label)], float(prob)))
+                scores.sort(key=lambda x: x[1], reverse=True)
+                if max_n_guesses is not None:
+                    scores = scores[:max_n_guesses]
+                predictions.append(scores)
+            else:
+                predictions.append([(self.i_to_label[int(float(line))], 0)])
         return predictions
 
+    def close(self) -> None:
+        """
+        Stop the vw daemon serving guesses, it is started again by the next call to guess
+        """
+        if self.daemon is not None:
+            self.daemon.close()
+            self.daemon = None
+
     def train(self, training_data: TrainingData) -> None:
         log.info(f"Config:\n{pformat(self.parameters())}")
         questions = training_data[0]
@@ -139,6 +139,19 @@ class PageAssigner:
                         else:
                             return Err("No match found")
 
+    def annotations(self, *, answer=None, qdb_id=None, proto_id=None) -> Dict:
+        """
+        Annotations that maybe_assign could use for a question, so that changes to the annotated
+        mappings can be detected per question
+        """
+        normalized_answer = None if answer is None else normalize_answer(answer)
+        return {
+            "quizdb_direct": self.quizdb_direct.get(qdb_id),
+            "protobowl_direct": self.protobowl_direct.get(proto_id),
+            "ambiguous": self.ambiguous.get(normalized_answer),
+            "unambiguous": self.unambiguous.get(normalized_answer),
+        }
+
     def maybe_assign(
         self, *, answer=None, question_text=None, qdb_id=None, proto_id=None
     ) -> Tuple[Optional[str], Optional[str]]:
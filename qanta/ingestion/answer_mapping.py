@@ -4,6 +4,7 @@ import csv
 import json
 import re
 import pickle
+import multiprocessing
 from collections import defaultdict, Counter, OrderedDict
 from unidecode import unidecode
 import tqdm
@@ -79,6 +80,28 @@ def make_source_list(
     ]
 
 
+# Match index entry: rank of the source in the source list, matched page, and source name
+IndexEntry = Tuple[int, str, str]
+
+
+def make_match_index(
+    source_list: List[Tuple[str, Dict[str, str], bool]]
+) -> Tuple[Dict[str, IndexEntry], Dict[str, IndexEntry]]:
+    """
+    Merge the sources of make_source_list into one index of the exact sources and one of the
+    lowercase sources. A key maps to its entry in the first source that contains it, so one lookup
+    replaces trying each source in turn.
+    """
+    exact_index = {}
+    lower_index = {}
+    for rank, (source_name, source, lower) in enumerate(source_list):
+        index = lower_index if lower else exact_index
+        for key, page in source.items():
+            if key not in index:
+                index[key] = rank, page, source_name
+    return exact_index, lower_index
+
+
 DISAMBIG_SYNONYMS = {
     "mythology": {"myth", "deity", "god", "goddess"},
     "mathematics": {"math"},
@@ -110,17 +133,137 @@ def make_disamb_list(wiki_titles: Set[str]) -> AmbigMap:
     return disamb_candidates
 
 
+class AnswerMatcher:
+    def __init__(
+        self,
+        expansion_rules: List[Tuple[str, int, ExpansionRule]],
+        match_rules: List[Tuple[str, int, MatchRule]],
+        wiki_titles: Set[str],
+        wiki_redirects_source: Dict[str, str],
+    ):
+        """
+        Matches answers to wikipedia titles with the expansion and match rules. Titles and redirects
+        are merged in one index by make_match_index, and the output of match rules and the matches
+        of their outputs are cached per string since expansions of different answers often
+        coincide.
+        """
+        self.expansion_rules = sorted(expansion_rules, key=lambda x: x[1], reverse=True)
+        self.match_rules = sorted(match_rules, key=lambda x: x[1], reverse=True)
+        self.exact_index, self.lower_index = make_match_index(
+            make_source_list(wiki_titles, wiki_redirects_source)
+        )
+        self.disamb_candidates = make_disamb_list(wiki_titles)
+        self._rule_cache = {}  # type: Dict[Tuple[int, str], str]
+        self._match_cache = (
+            {}
+        )  # type: Dict[str, Tuple[Optional[str], Optional[str], Optional[AmbigOptions]]]
+
+    def expand(self, raw_ans: str) -> Dict[str, Tuple[int, str]]:
+        """
+        :return: expansions of the answer with the priority and name of the highest priority
+            expansion rule producing them
+        """
+        expansions = {}
+        for name, priority, rule_func in self.expansion_rules:
+            for exp_ans in rule_func(raw_ans):
+                exp_ans = exp_ans.strip()
+                if exp_ans in expansions:
+                    curr_priority, _ = expansions[exp_ans]
+                    if priority > curr_priority:
+                        expansions[exp_ans] = priority, name
+                else:
+                    expansions[exp_ans] = priority, name
+        return expansions
+
+    def _apply_match_rule(
+        self, rule_index: int, rule_func: MatchRule, text: str
+    ) -> str:
+        key = rule_index, text
+        rule_ans = self._rule_cache.get(key)
+        if rule_ans is None:
+            rule_ans = whitespace_re.sub(" ", rule_func(text)).strip()
+            self._rule_cache[key] = rule_ans
+        return rule_ans
+
+    def _lookup(self, index: Dict[str, IndexEntry], text: str) -> Optional[IndexEntry]:
+        # Same as try_match: the text is preferred over its underscored form in the same source
+        entry = index.get(text)
+        und_entry = index.get(text.replace(" ", "_"))
+        if entry is None or (und_entry is not None and und_entry[0] < entry[0]):
+            return und_entry
+        return entry
+
+    def find_match(
+        self, rule_ans: str
+    ) -> Tuple[Optional[str], Optional[str], Optional[AmbigOptions]]:
+        """
+        Same as find_match over the source list and find_amb_match over the disambiguation list
+        """
+        if rule_ans in self._match_cache:
+            return self._match_cache[rule_ans]
+        entry = self._lookup(self.exact_index, rule_ans)
+        if not rule_ans.isupper():
+            lower_entry = self._lookup(self.lower_index, rule_ans.lower())
+            if entry is None or (lower_entry is not None and lower_entry[0] < entry[0]):
+                entry = lower_entry
+        amb_match, _ = find_amb_match(rule_ans, self.disamb_candidates)
+        if entry is None:
+            result = None, None, amb_match
+        else:
+            _, match, source = entry
+            result = match, source, amb_match
+        self._match_cache[rule_ans] = result
+        return result
+
+    def match(
+        self, original_ans: str
+    ) -> Tuple[Optional[str], Optional[Tuple[str, str, str]], List[Tuple[str, str]]]:
+        """
+        :return: the matched page or None, the names of the match rule, expansion rule and source
+            that matched it, and the disambiguation options of the answer
+        """
+        ans_expansions = sorted(
+            self.expand(original_ans).items(), key=lambda x: x[1], reverse=True
+        )
+        answer_match = None
+        answer_report = None
+        amb_options = []
+        for rule_index, (match_name, _, rule_func) in enumerate(self.match_rules):
+            for raw_ans, (_, expansion_name) in ans_expansions:
+                rule_ans = self._apply_match_rule(rule_index, rule_func, raw_ans)
+                match, source, amb_match = self.find_match(rule_ans)
+                # The first match is of the highest priority, later ones do not overwrite it
+                if answer_match is None and match is not None:
+                    answer_match = match
+                    answer_report = match_name, expansion_name, source
+                if amb_match is not None:
+                    amb_options.extend(amb_match)
+        return answer_match, answer_report, amb_options
+
+
+# Matcher used by the worker processes of mapping_rules_to_answer_map, inherited when forking
+_shard_matcher = None  # type: Optional[AnswerMatcher]
+
+
+def _match_shard(answers: List[str]):
+    return [_shard_matcher.match(ans) for ans in answers]
+
+
 def mapping_rules_to_answer_map(
     expansion_rules: List[Tuple[str, int, ExpansionRule]],
     match_rules: List[Tuple[str, int, MatchRule]],
     wiki_titles: Set[str],
     wiki_redirects_source,
     unmapped_answers: Set[str],
+    n_procs: Optional[int] = None,
+    shard_size=1000,
 ):
+    global _shard_matcher
     log.info("Creating wikipedia title variants for matching")
 
-    source_list = make_source_list(wiki_titles, wiki_redirects_source)
-    disamb_candidates = make_disamb_list(wiki_titles)
+    matcher = AnswerMatcher(
+        expansion_rules, match_rules, wiki_titles, wiki_redirects_source
+    )
     answer_map = {}
     amb_answer_map = defaultdict(list)
 
@@ -129,53 +272,37 @@ def mapping_rules_to_answer_map(
 
     n_unmapped = len(unmapped_answers)
     log.info(f"{n_unmapped} Unmapped Answers Exist\nStarting Answer Mapping\n")
-    expansion_answer_map = defaultdict(
-        dict
-    )  # type: Dict[str, Dict[str, Tuple[int, str]]]
-    for name, priority, rule_func in sorted(
-        expansion_rules, key=lambda x: x[1], reverse=True
-    ):
-        log.info(f"Applying expansion rule: {name}")
-        for raw_ans in unmapped_answers:
-            for exp_ans in rule_func(raw_ans):
-                exp_ans = exp_ans.strip()
-                if exp_ans in expansion_answer_map[raw_ans]:
-                    curr_priority, _ = expansion_answer_map[raw_ans][exp_ans]
-                    if priority > curr_priority:
-                        expansion_answer_map[raw_ans][exp_ans] = priority, name
-                else:
-                    expansion_answer_map[raw_ans][exp_ans] = priority, name
+    answers = list(unmapped_answers)
+    shards = [answers[i : i + shard_size] for i in range(0, len(answers), shard_size)]
+    if n_procs is None:
+        n_procs = multiprocessing.cpu_count()
+    n_procs = min(n_procs, len(shards))
+    if n_procs > 1:
+        # Workers are forked so that they share the index instead of each unpickling a copy
+        _shard_matcher = matcher
+        try:
+            with multiprocessing.get_context("fork").Pool(n_procs) as pool:
+                shard_results = list(
+                    tqdm.tqdm(pool.imap(_match_shard, shards), total=len(shards))
+                )
+        finally:
+            _shard_matcher = None
+    else:
+        shard_results = [
+            [matcher.match(ans) for ans in shard] for shard in tqdm.tqdm(shards)
+        ]
 
-    sorted_match_rules = sorted(match_rules, key=lambda x: x[1], reverse=True)
     report = {"expansion": {}, "match": {}, "source": {}}
-    for original_ans, ans_expansions in tqdm.tqdm(expansion_answer_map.items()):
-        # We don't need the expansion priority anymore, its already been sorted
-        for match_name, _, rule_func in sorted_match_rules:
-            # We don't need the match priority anymore, its already been sorted
-            for raw_ans, (_, expansion_name) in sorted(
-                ans_expansions.items(), key=lambda x: x[1], reverse=True
-            ):
-                rule_ans = re.sub(r"\s+", " ", rule_func(raw_ans)).strip()
-                lower_ans = rule_ans.lower()
-                is_upper = rule_ans.isupper()
-
-                # If we already have an answer, be definition it must be of higher priority so we do not allow
-                # overwriting it.
-                rule_ans = re.sub(r"\s+", " ", rule_func(raw_ans)).strip()
-                if original_ans not in answer_map:
-                    match, source = find_match(
-                        rule_ans, lower_ans, is_upper, source_list
-                    )
-
-                    if match is not None:
-                        answer_map[original_ans] = match
-                        report["expansion"][original_ans] = match_name
-                        report["match"][original_ans] = expansion_name
-                        report["source"][original_ans] = source
-
-                amb_match, ambig_source = find_amb_match(rule_ans, disamb_candidates)
-                if amb_match is not None:
-                    amb_answer_map[original_ans].extend(amb_match)
+    for shard, results in zip(shards, shard_results):
+        for original_ans, (match, answer_report, amb_options) in zip(shard, results):
+            if match is not None:
+                match_name, expansion_name, source = answer_report
+                answer_map[original_ans] = match
+                report["expansion"][original_ans] = match_name
+                report["match"][original_ans] = expansion_name
+                report["source"][original_ans] = source
+            if len(amb_options) > 0:
+                amb_answer_map[original_ans].extend(amb_options)
 
     # Ambig options should be unique, but respect insertion order. They must also be json serializable
     for k in amb_answer_map:
@@ -238,9 +365,29 @@ def find_amb_match(
         return None, None
 
 
+whitespace_re = re.compile(r"\s+")
+or_re = re.compile("[^a-zA-Z]+or[^a-zA-Z]+")
+prompt_parens_re = re.compile(
+    r"(.+)\(.*(?:accept|prompt|pronounce).*\)", flags=re.IGNORECASE
+)
+prompt_brackets_re = re.compile(
+    r"(.+)\[.*(?:accept|prompt|pronounce).*\]", flags=re.IGNORECASE
+)
+or_parens_re = re.compile(r"(.+)\(.*(?:or).*\)", flags=re.IGNORECASE)
+or_brackets_re = re.compile(r"(.+)\[.*(?:or).*\]", flags=re.IGNORECASE)
+the_re = re.compile("the ", flags=re.IGNORECASE)
+answers_re = re.compile(r"answers:", flags=re.IGNORECASE)
+answer_re = re.compile(r"answer:", flags=re.IGNORECASE)
+optional_text_re = re.compile(r"\(.+?\)")
+sir_re = re.compile(r"sir", flags=re.IGNORECASE)
+braces_re = re.compile(r"[{}]")
+quotes_re = re.compile(r'["“”]')
+parens_re = re.compile(r"[\(\)]")
+
+
 # Expansion rule functions
 def or_rule(ans):
-    splits = re.split("[^a-zA-Z]+or[^a-zA-Z]+", ans)
+    splits = or_re.split(ans)
     if len(splits) > 1:
         formatted_splits = [s.strip() for s in splits]
         return formatted_splits
@@ -255,25 +402,21 @@ def exact_rule(ans):
 def prompt_rule(ans):
     l_ans = ans.lower()
     if "accept" in l_ans or "prompt" in l_ans or "pronounce" in l_ans:
-        m = re.match(
-            r"(.+)\(.*(?:accept|prompt|pronounce).*\)", ans, flags=re.IGNORECASE
-        )
+        m = prompt_parens_re.match(ans)
         if m is not None:
             return (m.group(1).strip(),)
 
-        m = re.match(
-            r"(.+)\[.*(?:accept|prompt|pronounce).*\]", ans, flags=re.IGNORECASE
-        )
+        m = prompt_brackets_re.match(ans)
         if m is not None:
             return (m.group(1).strip(),)
 
         return ()
     elif "or" in l_ans:
-        m = re.match(r"(.+)\(.*(?:or).*\)", ans, flags=re.IGNORECASE)
+        m = or_parens_re.match(ans)
         if m is not None:
             return (m.group(1).strip(),)
 
-        m = re.match(r"(.+)\[.*(?:or).*\]", ans, flags=re.IGNORECASE)
+        m = or_brackets_re.match(ans)
         if m is not None:
             return (m.group(1).strip(),)
 
@@ -285,7 +428,7 @@ def prompt_rule(ans):
 def the_rule(ans):
     l_ans = ans.lower()
     if "the " in l_ans:
-        return (re.sub("the ", "", ans, flags=re.IGNORECASE),)
+        return (the_re.sub("", ans),)
     else:
         return ("the " + ans, "The " + ans)
 
@@ -308,15 +451,15 @@ def apostraphe_rule(ans):
 def answer_rule(ans):
     l_ans = ans.lower()
     if "answers:" in l_ans:
-        return (re.sub(r"answers:", "", ans, flags=re.IGNORECASE),)
+        return (answers_re.sub("", ans),)
     elif "answer:" in l_ans:
-        return (re.sub(r"answer:", "", ans, flags=re.IGNORECASE),)
+        return (answer_re.sub("", ans),)
     else:
         return ()
 
 
 def optional_text_rule(ans):
-    candidate = re.sub(r"\(.+?\)", "", ans)
+    candidate = optional_text_re.sub("", ans)
     if candidate != ans:
         return (candidate,)
     else:
@@ -332,7 +475,7 @@ def parens_rule(ans):
 
 def sir_rule(ans):
     if "sir" in ans.lower():
-        return (re.sub(r"sir", "", ans, flags=re.IGNORECASE),)
+        return (sir_re.sub("", ans),)
     else:
         return ()
 
@@ -359,15 +502,15 @@ def unicode_rule(ans):
 
 # Match Rule Functions
 def remove_braces(text):
-    return re.sub(r"[{}]", "", text)
+    return braces_re.sub("", text)
 
 
 def remove_quotes(text):
-    return re.sub(r'["“”]', "", text)
+    return quotes_re.sub("", text)
 
 
 def remove_parens(text):
-    return re.sub(r"[\(\)]", "", text)
+    return parens_re.sub("", text)
 
 
 def compose(*funcs):
@@ -416,10 +559,8 @@ def create_answer_map(unmapped_qanta_questions):
     match_rules = create_match_rules()
 
     log.info("Loading questions")
+    # Questions may be streamed, they are only iterated over once
     raw_unmapped_answers = {q["answer"] for q in unmapped_qanta_questions}
-    unmapped_lookup = defaultdict(list)
-    for q in unmapped_qanta_questions:
-        unmapped_lookup[q["answer"]].append(q)
 
     log.info("Loading wikipedia titles")
     wiki_titles = read_wiki_titles()
@@ -447,128 +588,131 @@ def write_answer_map(
         json.dump({"unbound_answers": list(sorted(unbound_answers))}, f)
 
 
-def unmapped_to_mapped_questions(
-    unmapped_qanta_questions,
+def map_question_(
+    q,
     answer_map,
     ambig_answer_map,
-    unmappable,
+    proto_unmappable: Set[int],
+    qdb_unmappable: Set[int],
     page_assigner: PageAssigner,
-):
-    proto_unmappable = set(unmappable["proto"])
-    qdb_unmappable = set(unmappable["quizdb"])
-    train_unmatched_questions = []
-    test_unmatched_questions = []
-    match_report = {}
-    for q in unmapped_qanta_questions:
-        answer = q["answer"]
-        qanta_id = int(q["qanta_id"])
-        proto_id = q["proto_id"]
-        qdb_id = q["qdb_id"]
-        fold = q["fold"]
-
-        if proto_id in proto_unmappable or qdb_id in qdb_unmappable:
-            match_report[qanta_id] = {
-                "result": "none",
-                "annotated_error": None,
-                "automatic_error": "Unmappable answer",
-                "annotated_page": None,
-                "automatic_page": None,
-            }
-            if fold == GUESSER_TRAIN_FOLD or fold == BUZZER_TRAIN_FOLD:
-                train_unmatched_questions.append(q)
-            else:
-                test_unmatched_questions.append(q)
-            continue
-
-        annotated_page, annotated_error = page_assigner.maybe_assign(
-            answer=answer, question_text=q["text"], qdb_id=qdb_id, proto_id=proto_id
-        )
-        automatic_page = answer_map[answer] if answer in answer_map else None
-        ambig_automatic_error = None
+) -> Dict:
+    """
+    Assign the page of a question from the annotated and automatic mappings
+
+    :return: the match report of the question
+    """
+    answer = q["answer"]
+    proto_id = q["proto_id"]
+    qdb_id = q["qdb_id"]
+
+    if proto_id in proto_unmappable or qdb_id in qdb_unmappable:
+        return {
+            "result": "none",
+            "annotated_error": None,
+            "automatic_error": "Unmappable answer",
+            "annotated_page": None,
+            "automatic_page": None,
+        }
+
+    annotated_page, annotated_error = page_assigner.maybe_assign(
+        answer=answer, question_text=q["text"], qdb_id=qdb_id, proto_id=proto_id
+    )
+    automatic_page = answer_map[answer] if answer in answer_map else None
+    ambig_automatic_error = None
+    ambig_automatic_page = None
+    if answer in ambig_answer_map:
+        words = set(q["text"].lower().split())
+        options = ambig_answer_map[answer]
         ambig_automatic_page = None
-        if answer in ambig_answer_map:
-            words = set(q["text"].lower().split())
-            options = ambig_answer_map[answer]
-            ambig_automatic_page = None
-            for page, keyword in options:
-                if keyword in words:
-                    if ambig_automatic_page is None and ambig_automatic_error is None:
-                        ambig_automatic_page = page
+        for page, keyword in options:
+            if keyword in words:
+                if ambig_automatic_page is None and ambig_automatic_error is None:
+                    ambig_automatic_page = page
+                else:
+                    if ambig_automatic_error is None:
+                        ambig_automatic_page = None
+                        ambig_automatic_error = "Ambig Matches: " + page
                     else:
-                        if ambig_automatic_error is None:
-                            ambig_automatic_page = None
-                            ambig_automatic_error = "Ambig Matches: " + page
-                        else:
-                            ambig_automatic_page = None
-                            ambig_automatic_error += " " + page
-
-        automatic_error = None
-        if automatic_page is not None and ambig_automatic_page is not None:
-            if automatic_page != ambig_automatic_page:
-                # Use automatic_page, but emit a warning
-                automatic_error = (
-                    f"Ambiguity Warning: {automatic_page} {ambig_automatic_page}"
-                )
-        elif automatic_page is None and ambig_automatic_page is not None:
-            # This is the safe case where we attempt to match when there isn't a match already
-            automatic_page = ambig_automatic_page
-        elif automatic_page is not None and ambig_automatic_page is None:
-            # Do nothing here since by default automatic_page is used
-            pass
-        else:
-            # if both are None, then there is no automatic match
-            automatic_error = "No match"
-
-        if (annotated_page is None) and (automatic_page is None):
-            match_report[qanta_id] = {
-                "result": "none",
+                        ambig_automatic_page = None
+                        ambig_automatic_error += " " + page
+
+    automatic_error = None
+    if automatic_page is not None and ambig_automatic_page is not None:
+        if automatic_page != ambig_automatic_page:
+            # Use automatic_page, but emit a warning
+            automatic_error = (
+                f"Ambiguity Warning: {automatic_page} {ambig_automatic_page}"
+            )
+    elif automatic_page is None and ambig_automatic_page is not None:
+        # This is the safe case where we attempt to match when there isn't a match already
+        automatic_page = ambig_automatic_page
+    elif automatic_page is not None and ambig_automatic_page is None:
+        # Do nothing here since by default automatic_page is used
+        pass
+    else:
+        # if both are None, then there is no automatic match
+        automatic_error = "No match"
+
+    if (annotated_page is None) and (automatic_page is None):
+        return {
+            "result": "none",
+            "annotated_error": annotated_error,
+            "automatic_error": automatic_error,
+            "annotated_page": annotated_page,
+            "automatic_page": automatic_page,
+        }
+    elif (annotated_page is not None) and (automatic_page is None):
+        q["page"] = annotated_page
+        return {
+            "result": "annotated",
+            "annotated_error": annotated_error,
+            "automatic_error": automatic_error,
+            "annotated_page": annotated_page,
+            "automatic_page": automatic_page,
+        }
+    elif (annotated_page is None) and (automatic_page is not None):
+        q["page"] = automatic_page
+        return {
+            "result": "automatic",
+            "annotated_error": annotated_error,
+            "automatic_error": automatic_error,
+            "annotated_page": annotated_page,
+            "automatic_page": automatic_page,
+        }
+    else:
+        if annotated_page == automatic_page:
+            q["page"] = automatic_page
+            return {
+                "result": "annotated+automatic",
                 "annotated_error": annotated_error,
                 "automatic_error": automatic_error,
                 "annotated_page": annotated_page,
                 "automatic_page": automatic_page,
             }
-            if fold == GUESSER_TRAIN_FOLD or fold == BUZZER_TRAIN_FOLD:
-                train_unmatched_questions.append(q)
-            else:
-                test_unmatched_questions.append(q)
-        elif (annotated_page is not None) and (automatic_page is None):
+        else:
             q["page"] = annotated_page
-            match_report[qanta_id] = {
-                "result": "annotated",
-                "annotated_error": annotated_error,
-                "automatic_error": automatic_error,
-                "annotated_page": annotated_page,
-                "automatic_page": automatic_page,
-            }
-        elif (annotated_page is None) and (automatic_page is not None):
-            q["page"] = automatic_page
-            match_report[qanta_id] = {
-                "result": "automatic",
+            return {
+                "result": "disagree",
                 "annotated_error": annotated_error,
                 "automatic_error": automatic_error,
                 "annotated_page": annotated_page,
                 "automatic_page": automatic_page,
             }
-        else:
-            if annotated_page == automatic_page:
-                q["page"] = automatic_page
-                match_report[qanta_id] = {
-                    "result": "annotated+automatic",
-                    "annotated_error": annotated_error,
-                    "automatic_error": automatic_error,
-                    "annotated_page": annotated_page,
-                    "automatic_page": automatic_page,
-                }
-            else:
-                q["page"] = annotated_page
-                match_report[qanta_id] = {
-                    "result": "disagree",
-                    "annotated_error": annotated_error,
-                    "automatic_error": automatic_error,
-                    "annotated_page": annotated_page,
-                    "automatic_page": automatic_page,
-                }
 
+
+def create_mapping_report(questions, match_report):
+    """
+    Mapping report of questions given the match report of each question by qanta_id
+    """
+    train_unmatched_questions = []
+    test_unmatched_questions = []
+    for q in questions:
+        if match_report[int(q["qanta_id"])]["result"] == "none":
+            fold = q["fold"]
+            if fold == GUESSER_TRAIN_FOLD or fold == BUZZER_TRAIN_FOLD:
+                train_unmatched_questions.append(q)
+            else:
+                test_unmatched_questions.append(q)
     return {
         "train_unmatched": train_unmatched_questions,
         "test_unmatched": test_unmatched_questions,
@@ -576,6 +720,28 @@ def unmapped_to_mapped_questions(
     }
 
 
+def unmapped_to_mapped_questions(
+    unmapped_qanta_questions,
+    answer_map,
+    ambig_answer_map,
+    unmappable,
+    page_assigner: PageAssigner,
+):
+    proto_unmappable = set(unmappable["proto"])
+    qdb_unmappable = set(unmappable["quizdb"])
+    match_report = {}
+    for q in unmapped_qanta_questions:
+        match_report[int(q["qanta_id"])] = map_question_(
+            q,
+            answer_map,
+            ambig_answer_map,
+            proto_unmappable,
+            qdb_unmappable,
+            page_assigner,
+        )
+    return create_mapping_report(unmapped_qanta_questions, match_report)
+
+
 def read_wiki_redirects(
     wiki_titles, redirect_csv_path=ALL_WIKI_REDIRECTS
 ) -> Dict[str, str]:
@@ -6,6 +6,7 @@ import json
 import click
 import yaml
 from qanta.util.io import safe_open
+from qanta.util.dataset_io import dataset_path, iter_questions
 from qanta.ingestion.answer_mapping import (
     create_answer_map,
     write_answer_map,
@@ -29,8 +30,9 @@ def ingestion_cli(start_idx):
     the code map answer for both at the same time, then only use the mappings from the new questions.
     There are some edge cases, but this should in general work (hopefully).
     """
-    with open(QANTA_PREPROCESSED_DATASET_PATH) as f:
-        unmapped_questions = json.load(f)["questions"]
+    unmapped_questions = list(
+        iter_questions(dataset_path(QANTA_PREPROCESSED_DATASET_PATH))
+    )
 
     with open("data/external/high_school_project/quizdb-20190313164802.json") as f:
         raw_questions = json.load(f)["data"]["tossups"]
@@ -8,7 +8,7 @@ from qanta.util.constants import (
     GUESSER_TRAIN_FOLD,
     BUZZER_TRAIN_FOLD,
 )
-from qanta.datasets.quiz_bowl import QantaDatabase, Question
+from qanta.datasets.quiz_bowl import Question, qanta_database
 
 
 UNMAPPED_COLUMNS = [
@@ -72,7 +72,7 @@ def create_answer_mapping_csvs(output_dir="data/external/answer_mapping"):
     with open(QANTA_MAP_REPORT_PATH) as f:
         report = json.load(f)
         match_report = report["match_report"]
-    db = QantaDatabase()
+    db = qanta_database()
     qb_lookup: Dict[int, Question] = {q.qanta_id: q for q in db.all_questions}
     train_rows = unmapped_rows(match_report, report["train_unmatched"])
     test_rows = unmapped_rows(match_report, report["test_unmatched"])
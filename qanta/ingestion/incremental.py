@@ -0,0 +1,188 @@
+from typing import List, Dict, Callable, Any, Iterable, Iterator, Optional
+import os
+import json
+import sqlite3
+import hashlib
+from contextlib import closing
+
+from qanta import qlogging
+
+
+log = qlogging.get(__name__)
+
+
+def content_digest(*parts) -> str:
+    """
+    Digest of json serializable parts, used to detect whether the inputs of a stage changed
+    """
+    content = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
+
+
+# Fields that identify a question rather than describe it. They are assigned by position across
+# all questions, so adding or removing one question changes them for many others
+IDENTITY_FIELDS = ("qanta_id", "fold")
+
+
+def question_digest(q: Dict, *parts, exclude=IDENTITY_FIELDS) -> str:
+    """
+    content_digest of a question without the fields in exclude, along with other parts
+    """
+    return content_digest({k: v for k, v in q.items() if k not in exclude}, *parts)
+
+
+def restore_fields(source: Dict, target: Dict, fields=IDENTITY_FIELDS) -> Dict:
+    """
+    Copy fields from the question source to the question target, which was read from a StageCache
+    and may have been computed from a question with other values of fields
+    """
+    for field in fields:
+        if field in source:
+            target[field] = source[field]
+        else:
+            target.pop(field, None)
+    return target
+
+
+class StageCache:
+    # Number of digests looked up per query, below the sqlite limit on query parameters
+    QUERY_SIZE = 500
+
+    def __init__(self, path: str, stage: str, stage_key: str):
+        """
+        SQLite store of the output of an ingestion stage keyed by the digest of the inputs it was
+        computed from. Running the stage again only processes the questions whose inputs are not
+        stored yet, the outputs of the others are read back. Since outputs are not keyed by
+        qanta_id, digests should exclude fields the stage does not use such as the qanta_id and
+        fold, see question_digest, and the caller restores them in the outputs.
+
+        :param path: sqlite file, created if it does not exist
+        :param stage: name of the stage, several stages share one file
+        :param stage_key: identifies the code and the inputs shared by all questions, for example
+            a version number and the files the stage reads. Changing it reprocesses every question
+        """
+        self.path = path
+        self.stage = stage
+        self.stage_key = stage_key
+        directory = os.path.dirname(path)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as conn:
+            # Outputs used to be keyed by qanta_id, they cannot be reused by digest
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(outputs)")}
+            if "qanta_id" in columns:
+                conn.execute("DROP TABLE outputs")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS outputs (
+                  stage TEXT NOT NULL, digest TEXT NOT NULL, output TEXT NOT NULL,
+                  PRIMARY KEY (stage, digest)
+                )
+            """
+            )
+            conn.commit()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    def _read(self, conn, digests: List[str]) -> Dict[str, str]:
+        cached = {}
+        distinct_digests = sorted(set(digests))
+        for i in range(0, len(distinct_digests), self.QUERY_SIZE):
+            query_digests = distinct_digests[i : i + self.QUERY_SIZE]
+            rows = conn.execute(
+                f"""
+                SELECT digest, output FROM outputs
+                WHERE stage = ? AND digest IN ({', '.join('?' for _ in query_digests)})
+                """,
+                [self.stage] + query_digests,
+            )
+            for digest, output in rows:
+                cached[digest] = output
+        return cached
+
+    @staticmethod
+    def _mark_seen(conn, digests: List[str]):
+        conn.executemany(
+            "INSERT OR IGNORE INTO seen VALUES (?)", [(d,) for d in digests]
+        )
+
+    def _run_chunk(self, conn, questions, digests, process, restore) -> List[Any]:
+        digests = [content_digest(self.stage_key, d) for d in digests]
+        self._mark_seen(conn, digests)
+        cached = self._read(conn, digests)
+        # Questions with the same inputs are processed once
+        missing = {}
+        for i, digest in enumerate(digests):
+            if digest not in cached and digest not in missing:
+                missing[digest] = i
+        log.info(
+            f"Stage {self.stage}: processing {len(missing)} changed questions, "
+            f"{len(questions) - len(missing)} are unchanged"
+        )
+
+        if len(missing) > 0:
+            missing_outputs = process([questions[i] for i in missing.values()])
+            rows = []
+            for digest, output in zip(missing, missing_outputs):
+                serialized = json.dumps(output)
+                cached[digest] = serialized
+                rows.append((self.stage, digest, serialized))
+            conn.executemany("INSERT OR REPLACE INTO outputs VALUES (?, ?, ?)", rows)
+            conn.commit()
+
+        # Round trip every output through json so that cached and new outputs are alike, and
+        # questions sharing an output do not share objects
+        outputs = [json.loads(cached[digest]) for digest in digests]
+        if restore is not None:
+            outputs = [restore(q, o) for q, o in zip(questions, outputs)]
+        return outputs
+
+    def run(
+        self,
+        questions: Iterable[Dict],
+        digest: Callable[[Dict], str],
+        process: Callable[[List[Dict]], List[Any]],
+        chunk_size=10000,
+        restore: Optional[Callable[[Dict, Any], Any]] = None,
+    ) -> Iterator[Any]:
+        """
+        Output of each question in the order of questions. Questions are read and processed in
+        chunks so that they may be streamed, only the questions of one chunk are held in memory.
+
+        :param questions: input questions of the stage
+        :param digest: content_digest of the inputs of a question
+        :param process: computes the json serializable output of each question it is given
+        :param chunk_size: number of questions per chunk
+        :param restore: if not None, called with each question and its output and returns the
+            output with the fields of the question that digest excludes, see restore_fields
+
+        Once every output has been read, the stored outputs whose inputs were not in questions are
+        deleted so that the cache does not grow with removed or edited questions.
+        """
+        with closing(self._connect()) as conn:
+            conn.execute("CREATE TEMP TABLE seen (digest TEXT PRIMARY KEY)")
+            chunk = []
+            for q in questions:
+                chunk.append(q)
+                if len(chunk) == chunk_size:
+                    yield from self._run_chunk(
+                        conn, chunk, [digest(q) for q in chunk], process, restore
+                    )
+                    chunk = []
+            if len(chunk) > 0:
+                yield from self._run_chunk(
+                    conn, chunk, [digest(q) for q in chunk], process, restore
+                )
+            deleted = conn.execute(
+                """
+                DELETE FROM outputs
+                WHERE stage = ? AND digest NOT IN (SELECT digest FROM seen)
+                """,
+                [self.stage],
+            ).rowcount
+            conn.commit()
+            if deleted > 0:
+                log.info(
+                    f"Stage {self.stage}: deleted {deleted} outputs of removed questions"
+                )
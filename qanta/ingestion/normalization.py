@@ -312,11 +312,13 @@ BUZZTEST_YEARS = {2016}
 DEV_YEARS = {2015}
 
 
-def assign_folds_(
+def assign_folds(
     qanta_questions, question_player_counts, random_seed=0, guessbuzz_frac=0.8
 ):
     """
-    Note that q['proto_id'] in question_player_counts being True implies the dataset source is protobowl.
+    Assign the fold of each question and yield it, questions are consumed one at a time so they
+    may be streamed. Note that q['proto_id'] in question_player_counts being True implies the
+    dataset source is protobowl.
     """
     random.seed(random_seed)
     for q in qanta_questions:
@@ -347,3 +349,16 @@ def assign_folds_(
                     q["fold"] = GUESSER_TRAIN_FOLD
         if "fold" not in q:
             raise ValueError("Cannot leave a question without an assigned fold")
+        yield q
+
+
+def assign_folds_(
+    qanta_questions, question_player_counts, random_seed=0, guessbuzz_frac=0.8
+):
+    for _ in assign_folds(
+        qanta_questions,
+        question_player_counts,
+        random_seed=random_seed,
+        guessbuzz_frac=guessbuzz_frac,
+    ):
+        pass
@@ -1,16 +1,24 @@
 import json
+import os
 from os import path
 from luigi import LocalTarget, Task, WrapperTask, Parameter
 import yaml
 
 from sklearn.model_selection import train_test_split
 from qanta.util.io import shell, get_tmp_filename, safe_path, safe_open
+from qanta.util.dataset_io import (
+    dataset_path,
+    iter_questions,
+    write_dataset,
+    DatasetWriter,
+)
 from qanta.util.constants import (
     DATASET_PREFIX,
     DS_VERSION,
     QANTA_MAP_REPORT_PATH,
     QANTA_MAPPED_DATASET_PATH,
     QANTA_SQL_DATASET_PATH,
+    QANTA_STAGE_CACHE,
     QANTA_TRAIN_DATASET_PATH,
     QANTA_DEV_DATASET_PATH,
     QANTA_TEST_DATASET_PATH,
@@ -19,25 +27,33 @@ from qanta.util.constants import (
     QANTA_TORCH_DEV_LOCAL_PATH,
     GUESSER_TRAIN_FOLD,
     GUESSER_DEV_FOLD,
+    WIKI_TITLES_PICKLE,
 )
 from qanta.pipeline.preprocess import WikipediaTitles, WikipediaRawRedirects
 from qanta.ingestion.normalization import (
     Protobowl,
     QuizdbOrg,
     merge_datasets,
-    assign_folds_,
+    assign_folds,
 )
 from qanta.ingestion.answer_mapping import (
     create_answer_map,
     write_answer_map,
-    unmapped_to_mapped_questions,
+    map_question_,
+    create_mapping_report,
 )
 from qanta.ingestion.annotated_mapping import PageAssigner
 from qanta.ingestion.preprocess import (
-    format_qanta_json,
     add_sentences_,
     add_answer_prompts_,
     questions_to_sqlite,
+    segmenter_key,
+)
+from qanta.ingestion.incremental import (
+    StageCache,
+    content_digest,
+    question_digest,
+    restore_fields,
 )
 from qanta.ingestion.protobowl import compute_question_player_counts
 
@@ -55,6 +71,11 @@ QANTA_FOLDED_DATASET_PATH = path.join(DATASET_PREFIX, f"qanta.folded.{DS_VERSION
 
 ANSWER_MAP_PATH = "data/external/answer_mapping/answer_map.json"
 UNBOUND_ANSWER_PATH = "data/external/answer_mapping/unbound_answers.json"
+UNMAPPABLE_PATH = "data/internal/page_assignment/unmappable.yaml"
+
+# Bump when a stage changes in a way that invalidates its cached outputs
+PROCESSED_STAGE_VERSION = 1
+MAPPED_STAGE_VERSION = 1
 
 
 QDB_DATE = "04182018"
@@ -146,27 +167,46 @@ class CreateUnmappedQantaDataset(Task):
             QDB_TOSSUPS_PATH,
         )
         qanta_questions = merge_datasets(protobowl_questions, quizdb_questions)
-        with open(safe_path(QANTA_UNMAPPED_DATASET_PATH), "w") as f:
-            json.dump(format_qanta_json(qanta_questions, DS_VERSION), f)
+        write_dataset(
+            dataset_path(QANTA_UNMAPPED_DATASET_PATH), qanta_questions, DS_VERSION
+        )
 
     def output(self):
-        return LocalTarget(QANTA_UNMAPPED_DATASET_PATH)
+        return LocalTarget(dataset_path(QANTA_UNMAPPED_DATASET_PATH))
 
 
 class CreateProcessedQantaDataset(Task):
     def requires(self):
         yield CreateUnmappedQantaDataset()
 
+    @staticmethod
+    def process(questions):
+        add_sentences_(questions)
+        add_answer_prompts_(questions)
+        return questions
+
     def run(self):
-        with open(QANTA_UNMAPPED_DATASET_PATH) as f:
-            qanta_questions = json.load(f)["questions"]
-        add_sentences_(qanta_questions)
-        add_answer_prompts_(qanta_questions)
-        with open(QANTA_PREPROCESSED_DATASET_PATH, "w") as f:
-            json.dump(format_qanta_json(qanta_questions, DS_VERSION), f)
+        # Only questions that were added or edited since the last run are processed, regardless
+        # of shifts in their qanta_id. Chunks are large since each chunk with changed questions
+        # starts a pool of segmentation processes
+        stage_cache = StageCache(
+            QANTA_STAGE_CACHE,
+            "processed",
+            content_digest(PROCESSED_STAGE_VERSION, segmenter_key()),
+        )
+        qanta_questions = stage_cache.run(
+            iter_questions(dataset_path(QANTA_UNMAPPED_DATASET_PATH)),
+            question_digest,
+            self.process,
+            chunk_size=50000,
+            restore=restore_fields,
+        )
+        write_dataset(
+            dataset_path(QANTA_PREPROCESSED_DATASET_PATH), qanta_questions, DS_VERSION
+        )
 
     def output(self):
-        return LocalTarget(QANTA_PREPROCESSED_DATASET_PATH)
+        return LocalTarget(dataset_path(QANTA_PREPROCESSED_DATASET_PATH))
 
 
 class CreateAnswerMap(Task):
@@ -176,11 +216,8 @@ class CreateAnswerMap(Task):
         yield WikipediaTitles()
 
     def run(self):
-        with open(QANTA_PREPROCESSED_DATASET_PATH) as f:
-            unmapped_qanta_questions = json.load(f)["questions"]
-
         answer_map, amb_answer_map, unbound_answers, report = create_answer_map(
-            unmapped_qanta_questions
+            iter_questions(dataset_path(QANTA_PREPROCESSED_DATASET_PATH))
         )
         with safe_open("data/external/answer_mapping/automatic_report.json", "w") as f:
             json.dump(report, f)
@@ -219,18 +256,18 @@ class CreateFoldedQantaDataset(Task):
         yield CreateProtobowlQuestionPlayerCounts()
 
     def run(self):
-        with open(QANTA_PREPROCESSED_DATASET_PATH) as f:
-            qanta_questions = json.load(f)["questions"]
-
         with open(PROTOBOWL_QUESTION_PLAYER_COUNTS) as f:
             question_player_counts = json.load(f)
-        assign_folds_(qanta_questions, question_player_counts)
-
-        with open(QANTA_FOLDED_DATASET_PATH, "w") as f:
-            json.dump(format_qanta_json(qanta_questions, DS_VERSION), f)
+        qanta_questions = assign_folds(
+            iter_questions(dataset_path(QANTA_PREPROCESSED_DATASET_PATH)),
+            question_player_counts,
+        )
+        write_dataset(
+            dataset_path(QANTA_FOLDED_DATASET_PATH), qanta_questions, DS_VERSION
+        )
 
     def output(self):
-        return LocalTarget(QANTA_FOLDED_DATASET_PATH)
+        return LocalTarget(dataset_path(QANTA_FOLDED_DATASET_PATH))
 
 
 class CreateMappedQantaDataset(Task):
@@ -244,26 +281,80 @@ class CreateMappedQantaDataset(Task):
             content = json.load(f)
             answer_map = content["answer_map"]
             ambig_answer_map = content["ambig_answer_map"]
-        with open(QANTA_FOLDED_DATASET_PATH) as f:
-            qanta_questions = json.load(f)["questions"]
 
-        with open("data/internal/page_assignment/unmappable.yaml") as f:
+        with open(UNMAPPABLE_PATH) as f:
             unmappable = yaml.load(f)
+        proto_unmappable = set(unmappable["proto"])
+        qdb_unmappable = set(unmappable["quizdb"])
 
         page_assigner = PageAssigner()
-        mapping_report = unmapped_to_mapped_questions(
-            qanta_questions, answer_map, ambig_answer_map, unmappable, page_assigner
+
+        def map_questions(questions):
+            outputs = []
+            for q in questions:
+                report = map_question_(
+                    q,
+                    answer_map,
+                    ambig_answer_map,
+                    proto_unmappable,
+                    qdb_unmappable,
+                    page_assigner,
+                )
+                outputs.append({"question": q, "report": report})
+            return outputs
+
+        # A question is mapped again only if it changed apart from its qanta_id and fold, or the
+        # mappings that apply to it changed. Pages are checked against the wikipedia titles, so
+        # all questions are mapped again if they do
+        titles_stat = os.stat(WIKI_TITLES_PICKLE)
+        stage_cache = StageCache(
+            QANTA_STAGE_CACHE,
+            "mapped",
+            content_digest(
+                MAPPED_STAGE_VERSION, titles_stat.st_size, titles_stat.st_mtime_ns
+            ),
         )
 
-        with open(QANTA_MAPPED_DATASET_PATH, "w") as f:
-            json.dump(format_qanta_json(qanta_questions, DS_VERSION), f)
+        def digest(q):
+            return question_digest(
+                q,
+                answer_map.get(q["answer"]),
+                ambig_answer_map.get(q["answer"]),
+                q["proto_id"] in proto_unmappable,
+                q["qdb_id"] in qdb_unmappable,
+                page_assigner.annotations(
+                    answer=q["answer"], qdb_id=q["qdb_id"], proto_id=q["proto_id"]
+                ),
+            )
+
+        def restore(q, output):
+            return {
+                "question": restore_fields(q, output["question"]),
+                "report": output["report"],
+            }
+
+        mapped_path = dataset_path(QANTA_MAPPED_DATASET_PATH)
+        outputs = stage_cache.run(
+            iter_questions(dataset_path(QANTA_FOLDED_DATASET_PATH)),
+            digest,
+            map_questions,
+            restore=restore,
+        )
+        match_report = {}
+        with DatasetWriter(mapped_path, DS_VERSION) as writer:
+            for o in outputs:
+                writer.write(o["question"])
+                match_report[int(o["question"]["qanta_id"])] = o["report"]
+        mapping_report = create_mapping_report(
+            iter_questions(mapped_path), match_report
+        )
 
         with open(QANTA_MAP_REPORT_PATH, "w") as f:
             json.dump(mapping_report, f)
 
     def output(self):
         return (
-            LocalTarget(QANTA_MAPPED_DATASET_PATH),
+            LocalTarget(dataset_path(QANTA_MAPPED_DATASET_PATH)),
             LocalTarget(QANTA_MAP_REPORT_PATH),
         )
 
@@ -273,11 +364,10 @@ class GenerateSqliteDB(Task):
         yield CreateMappedQantaDataset()
 
     def run(self):
-        with open(QANTA_MAPPED_DATASET_PATH) as f:
-            qanta_questions = json.load(f)["questions"]
-
         tmp_db = get_tmp_filename()
-        questions_to_sqlite(qanta_questions, tmp_db)
+        questions_to_sqlite(
+            iter_questions(dataset_path(QANTA_MAPPED_DATASET_PATH)), tmp_db
+        )
         shell(f"mv {tmp_db} {QANTA_SQL_DATASET_PATH}")
 
     def output(self):
@@ -290,26 +380,28 @@ class FilterAndPartitionQantaDataset(Task):
         yield CreateProtobowlQuestionPlayerCounts()
 
     def run(self):
-        with open(QANTA_MAPPED_DATASET_PATH) as f:
-            questions = [q for q in json.load(f)["questions"] if q["page"] is not None]
-        train_questions = [q for q in questions if "train" in q["fold"]]
-        dev_questions = [q for q in questions if "dev" in q["fold"]]
-        test_questions = [q for q in questions if "test" in q["fold"]]
-
-        with open(QANTA_TRAIN_DATASET_PATH, "w") as f:
-            json.dump(format_qanta_json(train_questions, DS_VERSION), f)
-
-        with open(QANTA_DEV_DATASET_PATH, "w") as f:
-            json.dump(format_qanta_json(dev_questions, DS_VERSION), f)
-
-        with open(QANTA_TEST_DATASET_PATH, "w") as f:
-            json.dump(format_qanta_json(test_questions, DS_VERSION), f)
+        with DatasetWriter(
+            dataset_path(QANTA_TRAIN_DATASET_PATH), DS_VERSION
+        ) as train_writer, DatasetWriter(
+            dataset_path(QANTA_DEV_DATASET_PATH), DS_VERSION
+        ) as dev_writer, DatasetWriter(
+            dataset_path(QANTA_TEST_DATASET_PATH), DS_VERSION
+        ) as test_writer:
+            for q in iter_questions(dataset_path(QANTA_MAPPED_DATASET_PATH)):
+                if q["page"] is None:
+                    continue
+                if "train" in q["fold"]:
+                    train_writer.write(q)
+                if "dev" in q["fold"]:
+                    dev_writer.write(q)
+                if "test" in q["fold"]:
+                    test_writer.write(q)
 
     def output(self):
         return [
-            LocalTarget(QANTA_TRAIN_DATASET_PATH),
-            LocalTarget(QANTA_DEV_DATASET_PATH),
-            LocalTarget(QANTA_TEST_DATASET_PATH),
+            LocalTarget(dataset_path(QANTA_TRAIN_DATASET_PATH)),
+            LocalTarget(dataset_path(QANTA_DEV_DATASET_PATH)),
+            LocalTarget(dataset_path(QANTA_TEST_DATASET_PATH)),
         ]
 
 
@@ -318,28 +410,26 @@ class TorchTextDataset(Task):
         yield FilterAndPartitionQantaDataset()
 
     def run(self):
-        with open(QANTA_TRAIN_DATASET_PATH) as f:
-            all_guess_train = [
-                q for q in json.load(f)["questions"] if q["fold"] == GUESSER_TRAIN_FOLD
-            ]
+        all_guess_train = [
+            q
+            for q in iter_questions(dataset_path(QANTA_TRAIN_DATASET_PATH))
+            if q["fold"] == GUESSER_TRAIN_FOLD
+        ]
 
         guess_train, guess_val = train_test_split(
             all_guess_train, random_state=42, train_size=0.9
         )
 
-        with open(QANTA_DEV_DATASET_PATH) as f:
-            guess_dev = [
-                q for q in json.load(f)["questions"] if q["fold"] == GUESSER_DEV_FOLD
-            ]
-
-        with open(QANTA_TORCH_TRAIN_LOCAL_PATH, "w") as f:
-            json.dump(format_qanta_json(guess_train, DS_VERSION), f)
-
-        with open(QANTA_TORCH_VAL_LOCAL_PATH, "w") as f:
-            json.dump(format_qanta_json(guess_val, DS_VERSION), f)
+        guess_dev = [
+            q
+            for q in iter_questions(dataset_path(QANTA_DEV_DATASET_PATH))
+            if q["fold"] == GUESSER_DEV_FOLD
+        ]
 
-        with open(QANTA_TORCH_DEV_LOCAL_PATH, "w") as f:
-            json.dump(format_qanta_json(guess_dev, DS_VERSION), f)
+        # The torchtext datasets are distributed as json, their format does not follow the config
+        write_dataset(QANTA_TORCH_TRAIN_LOCAL_PATH, guess_train, DS_VERSION)
+        write_dataset(QANTA_TORCH_VAL_LOCAL_PATH, guess_val, DS_VERSION)
+        write_dataset(QANTA_TORCH_DEV_LOCAL_PATH, guess_dev, DS_VERSION)
 
     def output(self):
         return [
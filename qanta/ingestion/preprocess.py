@@ -1,85 +1,245 @@
+from typing import List, Tuple, Optional, Dict
+import os
+import json
 import sqlite3
+import hashlib
+import multiprocessing
+from contextlib import closing
 import spacy
 import unidecode
 import ftfy
 import re
 from qanta import qlogging
-from qanta.spark import create_spark_context
+from qanta.util.constants import QANTA_SENTENCE_CACHE
+from qanta.util.dataset_io import dataset_header
 
 
 log = qlogging.get(__name__)
 
-# Each spark worker needs to load its own copy of the NLP model
-# separately since its not serializable and thus not broadcastable
-nlp_ref = []
+SPACY_MODEL = "en_core_web_lg"
+# Sentence boundaries come from the dependency parser. In spacy 2 it has its own tok2vec layers,
+# which use the static vectors, and does not read tags, so the tagger and entity recognizer are
+# not needed
+DISABLED_PIPES = ["tagger", "ner"]
+# Bump when segmentation changes in a way that invalidates cached sentences
+SEGMENTER_VERSION = 1
+# Questions per task sent to a worker and per batch of nlp.pipe
+CHUNK_SIZE = 1000
+PIPE_BATCH_SIZE = 64
+
 AVG_WORD_LENGTH = 5
 MIN_WORDS = 12
 MIN_CHAR_LENGTH = AVG_WORD_LENGTH * MIN_WORDS
 
+# Each worker process loads its own copy of the NLP model
+nlp_ref = []
 
-def nlp(text):
+
+def load_sentence_model():
     if len(nlp_ref) == 0:
-        nlp_ref.append(spacy.load("en_core_web_lg"))
+        nlp_ref.append(spacy.load(SPACY_MODEL, disable=DISABLED_PIPES))
+    return nlp_ref[0]
+
+
+def segmenter_key() -> str:
+    """
+    Identifies the segmentation of a question, changes when spacy or its model are upgraded
+    """
+    return json.dumps(
+        {
+            "version": SEGMENTER_VERSION,
+            "model": SPACY_MODEL,
+            "model_version": spacy.util.get_package_version(SPACY_MODEL),
+            "spacy": spacy.__version__,
+        },
+        sort_keys=True,
+    )
+
+
+def _segmenter_text(text: str) -> str:
+    decoded_text = unidecode.unidecode(text)
+    if len(decoded_text) != len(text):
+        log.warning("Text must have the same length, falling back to normal text")
+        return text
+    else:
+        return decoded_text
 
-    if len(nlp_ref) == 1:
-        decoded_text = unidecode.unidecode(text)
-        if len(decoded_text) != len(text):
-            log.warning("Text must have the same length, falling back to normal text")
-            doc = nlp_ref[0](text)
+
+def merge_short_sentences(sentences: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """
+    Merge the sentences that end before MIN_CHAR_LENGTH into the first sentence
+    """
+    if len(sentences) == 0:
+        raise ValueError("Zero length question with respect to sentences not allowed")
+
+    first_end_pos = None
+    for start, end in sentences:
+        if end < MIN_CHAR_LENGTH:
+            continue
+        else:
+            first_end_pos = end
+            break
+
+    if first_end_pos is None:
+        first_end_pos = sentences[-1][1]
+
+    final_tokenizations = [(0, first_end_pos)]
+    for start, end in sentences:
+        if end <= first_end_pos:
+            continue
         else:
-            doc = nlp_ref[0](decoded_text)
-        tokenizations = [(s.start_char, s.end_char) for s in doc.sents]
-        first_end_pos = None
-        if len(tokenizations) == 0:
-            raise ValueError(
-                "Zero length question with respect to sentences not allowed"
+            final_tokenizations.append((start, end))
+
+    return final_tokenizations
+
+
+def segment(texts: List[str]) -> List[List[Tuple[int, int]]]:
+    """
+    Sentence character spans of each text, texts are parsed in batches with nlp.pipe
+    """
+    model = load_sentence_model()
+    docs = model.pipe((_segmenter_text(t) for t in texts), batch_size=PIPE_BATCH_SIZE)
+    return [
+        merge_short_sentences([(s.start_char, s.end_char) for s in doc.sents])
+        for doc in docs
+    ]
+
+
+def nlp(text):
+    return segment([text])[0]
+
+
+def text_digest(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class SentenceCache:
+    # Number of digests looked up per query, below the sqlite limit on query parameters
+    QUERY_SIZE = 500
+
+    def __init__(self, path: str):
+        """
+        SQLite cache of the sentence spans of question texts keyed by a digest of the text and the
+        segmenter key, so rebuilding the dataset only segments new or edited questions
+
+        :param path: sqlite file, created if it does not exist
+        """
+        self.path = path
+        self.key = segmenter_key()
+        directory = os.path.dirname(path)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS sentences (
+                  segmenter TEXT NOT NULL, digest TEXT NOT NULL, tokenizations TEXT NOT NULL,
+                  PRIMARY KEY (segmenter, digest)
+                )
+            """
             )
+            conn.commit()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=60)
 
-        for start, end in tokenizations:
-            if end < MIN_CHAR_LENGTH:
-                continue
-            else:
-                first_end_pos = end
-                break
+    def get(self, digests: List[str]) -> Dict[str, List[Tuple[int, int]]]:
+        cached = {}
+        distinct_digests = sorted(set(digests))
+        with closing(self._connect()) as conn:
+            for i in range(0, len(distinct_digests), self.QUERY_SIZE):
+                query_digests = distinct_digests[i : i + self.QUERY_SIZE]
+                rows = conn.execute(
+                    f"""
+                    SELECT digest, tokenizations FROM sentences
+                    WHERE segmenter = ? AND digest IN ({', '.join('?' for _ in query_digests)})
+                    """,
+                    [self.key] + query_digests,
+                )
+                for digest, tokenizations in rows:
+                    cached[digest] = [tuple(t) for t in json.loads(tokenizations)]
+        return cached
 
-        if first_end_pos is None:
-            first_end_pos = tokenizations[-1][1]
+    def put(self, tokenizations: Dict[str, List[Tuple[int, int]]]) -> None:
+        with closing(self._connect()) as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO sentences VALUES (?, ?, ?)",
+                (
+                    (self.key, digest, json.dumps(t))
+                    for digest, t in tokenizations.items()
+                ),
+            )
+            conn.commit()
 
-        final_tokenizations = [(0, first_end_pos)]
-        for start, end in tokenizations:
-            if end <= first_end_pos:
-                continue
-            else:
-                final_tokenizations.append((start, end))
 
-        return final_tokenizations
-    else:
-        raise ValueError("There should be exactly one nlp model per spark worker")
+def segment_texts(
+    texts: List[str], parallel=True, n_procs: Optional[int] = None
+) -> List[List[Tuple[int, int]]]:
+    """
+    Sentence spans of each text. In parallel, chunks of texts are segmented by a pool of
+    processes that each load the spacy model once.
+    """
+    if not parallel or len(texts) <= CHUNK_SIZE:
+        return segment(texts)
+    if n_procs is None:
+        n_procs = multiprocessing.cpu_count()
+    chunks = [texts[i : i + CHUNK_SIZE] for i in range(0, len(texts), CHUNK_SIZE)]
+    n_procs = min(n_procs, len(chunks))
+    log.info(f"Segmenting {len(texts)} questions with {n_procs} processes")
+    with multiprocessing.Pool(n_procs, initializer=load_sentence_model) as pool:
+        return [t for chunk in pool.imap(segment, chunks) for t in chunk]
 
 
 def format_qanta_json(questions, version):
-    return {
-        "questions": questions,
-        "version": version,
-        "maintainer_name": "Pedro Rodriguez",
-        "maintainer_contact": "entilzha@umiacs.umd.edu",
-        "maintainer_website": "https://www.entilzha.io",
-        "project_website": "http://qanta.org/",
-    }
+    return {"questions": questions, **dataset_header(version)}
 
 
-def add_sentences_(questions, parallel=True):
+def add_sentences_(
+    questions,
+    parallel=True,
+    n_procs: Optional[int] = None,
+    cache_path: Optional[str] = QANTA_SENTENCE_CACHE,
+):
+    """
+    Add the sentence tokenizations and first sentence of each question. Questions whose text was
+    already segmented are read from the SentenceCache at cache_path unless it is None.
+    """
     text_questions = [ftfy.fix_text(q["text"]) for q in questions]
-    if parallel:
-        sc = create_spark_context()
-        sentence_tokenizations = sc.parallelize(text_questions, 4000).map(nlp).collect()
+    digests = [text_digest(t) for t in text_questions]
+    if cache_path is None:
+        cache = None
+        cached = {}
     else:
-        sentence_tokenizations = [nlp(q) for q in text_questions]
-    for q, text, tokenization in zip(questions, text_questions, sentence_tokenizations):
+        cache = SentenceCache(cache_path)
+        cached = cache.get(digests)
+
+    missing = {}
+    for digest, text in zip(digests, text_questions):
+        if digest not in cached and digest not in missing:
+            missing[digest] = text
+    log.info(
+        f"Segmenting {len(missing)} questions, {len(questions) - len(missing)} are cached"
+    )
+    if len(missing) > 0:
+        segmented = dict(
+            zip(
+                missing,
+                segment_texts(
+                    list(missing.values()), parallel=parallel, n_procs=n_procs
+                ),
+            )
+        )
+        if cache is not None:
+            cache.put(segmented)
+        cached.update(segmented)
+
+    for q, text, digest in zip(questions, text_questions, digests):
+        tokenization = cached[digest]
         q["tokenizations"] = tokenization
         # Get the 0th sentence, end character tokenization (tuple position 1)
         q["first_sentence"] = text[: tokenization[0][1]]
 
+
 def extract_prompt(ans):
     l_ans = ans.lower()
     if "accept" in l_ans or "prompt" in l_ans or "pronounce" in l_ans:
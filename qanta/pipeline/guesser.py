@@ -103,6 +103,9 @@ class GenerateGuesses(Task):
     dependency_class = luigi.Parameter()  # type: str
     config_num = luigi.IntParameter()  # type: int
     n_guesses = luigi.IntParameter(default=conf["n_guesses"])  # type: int
+    chunk_size = luigi.IntParameter(
+        default=conf["guess_chunk_size"], significant=False
+    )  # type: int
     fold = luigi.Parameter()  # type: str
 
     def requires(self):
@@ -119,10 +122,6 @@ class GenerateGuesses(Task):
         guesser_directory = AbstractGuesser.output_path(
             self.guesser_module, self.guesser_class, self.config_num, ""
         )
-        guesser_instance = guesser_class.load(
-            guesser_directory
-        )  # type: AbstractGuesser
-
         if self.fold in {c.GUESSER_TRAIN_FOLD, c.GUESSER_DEV_FOLD}:
             char_skip = conf["guesser_char_skip"]
         elif self.fold == c.EXPO_FOLD:
@@ -130,58 +129,49 @@ class GenerateGuesses(Task):
         else:
             char_skip = conf["buzzer_char_skip"]
 
-        log.info(
-            f"Generating and saving guesses for {self.fold} fold with char_skip={char_skip}..."
-        )
-        start_time = time.time()
-        guess_df = guesser_instance.generate_guesses(
-            self.n_guesses, [self.fold], char_skip=char_skip
-        )
-        end_time = time.time()
-        elapsed = end_time - start_time
-        log.info(f"Guessing on {self.fold} fold took {elapsed}s, saving guesses...")
-        guesser_class.save_guesses(guess_df, guesser_directory, [self.fold], "char")
-        log.info("Done saving guesses")
+        output_types = []
+        for output_type in ["char", "full", "first"]:
+            output_path = AbstractGuesser.guess_path(
+                guesser_directory, self.fold, output_type
+            )
+            if os.path.exists(output_path):
+                log.info(f"Guesses in {output_path} exist, skipping")
+            else:
+                output_types.append(output_type)
+        if len(output_types) == 0:
+            log.info(f"All guesses for {self.fold} fold exist")
+            return
 
-        log.info(
-            f"Generating and saving guesses for {self.fold} fold with full question..."
-        )
-        start_time = time.time()
-        guess_df = guesser_instance.generate_guesses(
-            self.n_guesses, [self.fold], full_question=True
-        )
-        end_time = time.time()
-        elapsed = end_time - start_time
-        log.info(f"Guessing on {self.fold} fold took {elapsed}s, saving guesses...")
-        guesser_class.save_guesses(guess_df, guesser_directory, [self.fold], "full")
-        log.info("Done saving guesses")
+        guesser_instance = guesser_class.load(
+            guesser_directory
+        )  # type: AbstractGuesser
 
         log.info(
-            f"Generating and saving guesses for {self.fold} fold with first sentence"
+            f"Generating and saving {output_types} guesses for {self.fold} fold with char_skip={char_skip}..."
         )
         start_time = time.time()
-        guess_df = guesser_instance.generate_guesses(
-            self.n_guesses, [self.fold], first_sentence=True
+        guesser_instance.generate_guesses_chunked(
+            self.n_guesses,
+            self.fold,
+            guesser_directory,
+            output_types,
+            char_skip=char_skip,
+            chunk_size=self.chunk_size,
         )
         end_time = time.time()
         elapsed = end_time - start_time
-        log.info(f"Guessing on {self.fold} fold took {elapsed}s, saving guesses...")
-        guesser_class.save_guesses(guess_df, guesser_directory, [self.fold], "first")
+        log.info(f"Guessing on {self.fold} fold took {elapsed}s")
         log.info("Done saving guesses")
 
     def output(self):
-        files = [
-            f"guesses_char_{self.fold}.pickle",
-            f"guesses_full_{self.fold}.pickle",
-            f"guesses_first_{self.fold}.pickle",
-        ]
+        guesser_directory = AbstractGuesser.output_path(
+            self.guesser_module, self.guesser_class, self.config_num, ""
+        )
         return [
             LocalTarget(
-                AbstractGuesser.output_path(
-                    self.guesser_module, self.guesser_class, self.config_num, f
-                )
+                AbstractGuesser.guess_path(guesser_directory, self.fold, output_type)
             )
-            for f in files
+            for output_type in ["char", "full", "first"]
         ]
 
 
@@ -289,26 +279,15 @@ class GuesserPerformance(Task):
             self.config_num,
             f"guesser_params.pickle",
         )
-        guesses_files = []
         if os.path.exists(c.QANTA_EXPO_DATASET_PATH):
             folds = [c.GUESSER_DEV_FOLD, c.GUESSER_TEST_FOLD, c.EXPO_FOLD]
         else:
             folds = [c.GUESSER_DEV_FOLD, c.GUESSER_TEST_FOLD]
 
-        for f in folds:
-            guesses_files.extend(
-                [
-                    f"guesses_char_{f}.pickle",
-                    f"guesses_full_{f}.pickle",
-                    f"guesses_first_{f}.pickle",
-                ]
-            )
-
         guesses_paths = [
-            AbstractGuesser.output_path(
-                self.guesser_module, self.guesser_class, self.config_num, f
-            )
-            for f in guesses_files
+            AbstractGuesser.guess_path(guesser_directory, f, output_type)
+            for f in folds
+            for output_type in ["char", "full", "first"]
         ]
 
         log.info(f'Running: "cp {param_path} {reporting_directory}"')
@@ -1,10 +1,11 @@
 import abc
 from collections import defaultdict
-from typing import List, Tuple, Optional
+from typing import List, Tuple, Optional, Sequence
 from urllib import request
 
 import numpy as np
 import torch
+import torch.nn as nn
 from torch.autograd import Variable
 
 from qanta import qlogging
@@ -58,6 +59,116 @@ def create_save_model(model):
     return save_model
 
 
+def token_budget_batches(lengths: Sequence[int], max_tokens: int) -> List[np.ndarray]:
+    """
+    Group inputs of similar length into batches sized by a token budget rather than a count.
+    Inputs are sorted from longest to shortest and each batch holds as many inputs as fit in
+    max_tokens once padded to the length of its first, longest, input. An input longer than
+    max_tokens is put in a batch by itself.
+
+    :param lengths: number of tokens in each input
+    :param max_tokens: maximum of batch size times padded length
+    :return: indices of the inputs in each batch, ordered from longest to shortest within a batch
+    """
+    lengths = np.asarray(lengths)
+    order = np.argsort(-lengths, kind="stable")
+    batches = []
+    start = 0
+    while start < len(order):
+        batch_size = max(1, max_tokens // max(lengths[order[start]], 1))
+        batches.append(order[start : start + batch_size])
+        start += batch_size
+    return batches
+
+
+def unbatch(batches: List[np.ndarray], outputs: List[np.ndarray]) -> np.ndarray:
+    """
+    Concatenate the outputs of batches created by token_budget_batches and put their rows back in
+    the original input order
+    """
+    order = np.concatenate(batches)
+    batch_outputs = np.concatenate(outputs)
+    restored = np.empty_like(batch_outputs)
+    restored[order] = batch_outputs
+    return restored
+
+
+def top_k_logits(
+    logits: torch.Tensor, k: Optional[int], probabilities=True
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Select the k highest scoring classes of each row with torch.topk on the device the logits are
+    on, so only [n_rows, k] values are sorted and copied to the cpu instead of every class.
+
+    :param logits: [n_rows, n_classes] unnormalized scores
+    :param k: number of classes to return per row, if None then all of them
+    :param probabilities: if True return softmax probabilities, which are only computed for the
+        selected classes from the logsumexp of each row. If False return the logits, which rank
+        classes identically
+    :return: [n_rows, k] int32 class indices and float32 scores sorted from highest to lowest
+    """
+    n_classes = logits.shape[1]
+    if k is None or k > n_classes:
+        k = n_classes
+    scores, indices = torch.topk(logits, k, dim=1)
+    if probabilities:
+        scores = torch.exp(scores - torch.logsumexp(logits, dim=1, keepdim=True))
+    return (
+        indices.cpu().numpy().astype(np.int32),
+        scores.cpu().numpy().astype(np.float32),
+    )
+
+
+def inference_device(device: str) -> torch.device:
+    """
+    :param device: auto, cpu, or cuda. auto uses cuda if it is available and the cpu otherwise
+    """
+    if device == "auto":
+        if torch.cuda.is_available():
+            return torch.device("cuda")
+        else:
+            return torch.device("cpu")
+    else:
+        return torch.device(device)
+
+
+def torchtext_device(device: torch.device):
+    """
+    Convert a device to the convention of Field.process and Field.numericalize: -1 for the cpu,
+    otherwise the index of the gpu with None meaning the current one
+    """
+    if device.type == "cpu":
+        return -1
+    else:
+        return device.index
+
+
+def prepare_inference_model(
+    model: nn.Module, device: torch.device, n_threads=None, quantize=False
+) -> nn.Module:
+    """
+    Put a trained model in inference mode on device.
+
+    :param model: model with trained weights loaded
+    :param device: device to run inference on
+    :param n_threads: if not None, number of threads torch uses for intra-op parallelism
+    :param quantize: replace Linear layers with dynamically quantized int8 versions, which roughly
+        halves the cost of the large classifier layer. Only supported on the cpu
+    :return: model to use for inference, possibly a new quantized module
+    """
+    model = model.to(device)
+    model.eval()
+    if n_threads is not None:
+        torch.set_num_threads(n_threads)
+    if quantize:
+        if device.type != "cpu":
+            raise ValueError("Dynamic quantization is only supported for cpu inference")
+        model = torch.quantization.quantize_dynamic(
+            model, {nn.Linear}, dtype=torch.qint8
+        )
+    return model
+
+
 class Callback(abc.ABC):
     @abc.abstractmethod
     def on_epoch_end(self, logs) -> Tuple[bool, Optional[str]]:
@@ -1,5 +1,5 @@
+from typing import Dict
 import os
-import re
 import json
 import torch
 
@@ -11,72 +11,42 @@ from torchtext.data import Field, RawField, BucketIterator
 from torchtext.vocab import Vocab, pretrained_aliases, Vectors
 from torchtext.utils import download_from_url
 
+from qanta import qlogging
 from qanta.wikipedia.cached_wikipedia import extract_wiki_sentences
+from qanta.util.dataset_io import iter_questions
+from qanta.util.constants import QB_TOKEN_CACHE, QB_TENSOR_CACHE, GLOVE_WE
+from qanta.util.word_vectors import WordVectors
+from qanta.torch.tokenization import (
+    QbTokenizer,
+    TokenCache,
+    create_qb_tokenizer,
+    TOKENIZER_VERSION,
+)
+from qanta.torch.tensor_dataset import (
+    TensorIterator,
+    tensor_cache_key,
+    save_tensor_splits,
+    load_tensor_splits,
+)
+
+log = qlogging.get(__name__)
+
+# Pretrained vector aliases that are read from a local copy when it exists
+LOCAL_VECTORS = {"glove.6B.300d": GLOVE_WE}
 
 DS_VERSION = "2018.04.18"
-
-
-ftp_patterns = {
-    "\n",
-    ", for 10 points,",
-    ", for ten points,",
-    "--for 10 points--",
-    "for 10 points, ",
-    "for 10 points--",
-    "for ten points, ",
-    "for 10 points ",
-    "for ten points ",
-    ", ftp," "ftp,",
-    "ftp",
+# Default file of each split of QuizBowl.splits
+SPLIT_FILES = {
+    "train": f"qanta.torchtext.train.{DS_VERSION}.json",
+    "validation": f"qanta.torchtext.val.{DS_VERSION}.json",
+    "test": f"qanta.torchtext.dev.{DS_VERSION}.json",
 }
 
-regex_pattern = "|".join([re.escape(p) for p in ftp_patterns])
-regex_pattern += r"|\[.*?\]|\(.*?\)"
-
 
 def str_split(text):
     return text.split()
 
 
-def create_qb_tokenizer(
-    unigrams=True,
-    bigrams=False,
-    trigrams=False,
-    zero_length_token="zerolengthunk",
-    strip_qb_patterns=True,
-):
-    def tokenizer(text):
-        if strip_qb_patterns:
-            text = (
-                re.sub(
-                    "\s+", " ", re.sub(regex_pattern, " ", text, flags=re.IGNORECASE)
-                )
-                .strip()
-                .capitalize()
-            )
-        import nltk
-
-        tokens = nltk.word_tokenize(text)
-        if len(tokens) == 0:
-            return [zero_length_token]
-        else:
-            ngrams = []
-            if unigrams:
-                ngrams.extend(tokens)
-            if bigrams:
-                ngrams.extend([f"{w0}++{w1}" for w0, w1 in nltk.bigrams(tokens)])
-            if trigrams:
-                ngrams.extend(
-                    [f"{w0}++{w1}++{w2}" for w0, w1, w2 in nltk.trigrams(tokens)]
-                )
-
-            if len(ngrams) == 0:
-                ngrams.append(zero_length_token)
-            return ngrams
-
-    return tokenizer
-
-
 class LongField(RawField):
     def __init__(self):
         super().__init__()
@@ -90,10 +60,18 @@ class LongField(RawField):
 
 class QBVocab(Vocab):
     def load_vectors(self, vectors):
+        """
+        Same as Vocab.load_vectors, but vectors are gathered for the whole vocabulary at once.
+        Aliases with a local copy in LOCAL_VECTORS and paths to existing files are loaded as
+        memory mapped WordVectors instead of through torchtext.
+        """
         if not isinstance(vectors, list):
             vectors = [vectors]
         for idx, vector in enumerate(vectors):
             if isinstance(vector, str):
+                if os.path.exists(LOCAL_VECTORS.get(vector, vector)):
+                    vectors[idx] = WordVectors(LOCAL_VECTORS.get(vector, vector))
+                    continue
                 # Convert the string pretrained vector identifier
                 # to a Vectors object
                 if vector not in pretrained_aliases:
@@ -102,22 +80,33 @@ class QBVocab(Vocab):
                         "vectors are {}".format(vector, list(pretrained_aliases.keys()))
                     )
                 vectors[idx] = pretrained_aliases[vector]()
-            elif not isinstance(vector, Vectors):
+            elif not isinstance(vector, (Vectors, WordVectors)):
                 raise ValueError(
-                    "Got input vectors of type {}, expected str or "
-                    "Vectors object".format(type(vector))
+                    "Got input vectors of type {}, expected str, "
+                    "Vectors, or WordVectors object".format(type(vector))
                 )
 
         tot_dim = sum(v.dim for v in vectors)
         self.vectors = torch.rand(len(self), tot_dim) * 0.08 * 2 - 0.08
-        for i, token in enumerate(self.itos):
-            start_dim = 0
-            for v in vectors:
-                end_dim = start_dim + v.dim
-                self.vectors[i][start_dim:end_dim] = v[token.strip()]
-                start_dim = end_dim
+        tokens = [token.strip() for token in self.itos]
+        start_dim = 0
+        for v in vectors:
+            end_dim = start_dim + v.dim
+            if isinstance(v, WordVectors):
+                gathered, _ = v.gather(tokens)
+                self.vectors[:, start_dim:end_dim] = torch.from_numpy(gathered)
+            else:
+                rows = torch.LongTensor([v.stoi.get(token, -1) for token in tokens])
+                found = rows >= 0
+                self.vectors[found, start_dim:end_dim] = v.vectors[rows[found]]
+                n_missing = int((~found).sum())
+                if n_missing > 0:
+                    self.vectors[~found, start_dim:end_dim] = v.unk_init(
+                        torch.Tensor(n_missing, v.dim)
+                    )
+            start_dim = end_dim
 
-            assert start_dim == tot_dim
+        assert start_dim == tot_dim
 
 
 class QBTextField(Field):
@@ -129,6 +118,21 @@ S3_URL_PATTERN = os.path.join(HTTP_PREFIX, "qanta.torchtext.{fold}.2018.04.18.js
 s3_wiki = "https://s3-us-west-2.amazonaws.com/pinafore-us-west-2/datasets/wikipedia/wiki_lookup.json"
 
 
+def wiki_lookup_path(directory: str) -> str:
+    """
+    Path of the wikipedia lookup stored next to the datasets in directory, downloaded if missing
+    """
+    output_file = os.path.join(directory, os.path.basename(s3_wiki))
+    if not os.path.exists(output_file):
+        download_from_url(s3_wiki, output_file)
+    return output_file
+
+
+def source_stat(path: str) -> Dict:
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
 class QuizBowl(Dataset):
     name = "quizbowl"
     dirname = ""
@@ -161,17 +165,18 @@ class QuizBowl(Dataset):
         use_wiki=False,
         n_wiki_sentences=3,
         replace_title_mentions="",
+        token_cache_path=QB_TOKEN_CACHE,
         **kwargs,
     ):
+        """
+        :param token_cache_path: TokenCache used for the question text of fields tokenized by a
+            QbTokenizer, so that each question is tokenized by nltk once across datasets. If None,
+            text is tokenized from scratch.
+        """
         from unidecode import unidecode
 
         if use_wiki and "train" in path:
-            base_path = os.path.dirname(path)
-            filename = os.path.basename(s3_wiki)
-            output_file = os.path.join(base_path, filename)
-            if not os.path.exists(output_file):
-                download_from_url(s3_wiki, output_file)
-            with open(output_file) as f:
+            with open(wiki_lookup_path(os.path.dirname(path))) as f:
                 self.wiki_lookup = json.load(f)
         else:
             self.wiki_lookup = {}
@@ -188,51 +193,37 @@ class QuizBowl(Dataset):
         if trigram_field is not None:
             text_dependent_fields.append(("trigram", trigram_field))
 
-        example_fields = {
-            "qanta_id": [("qanta_id", qanta_id_field)],
-            "sent": [("sent", sent_field)],
-            "page": [("page", page_field)],
-            "text": text_dependent_fields,
-        }
-
-        examples = []
+        records = []
         answer_set = set()
-        with open(path) as f:
-            for ex in json.load(f)["questions"]:
-                if example_mode == "sentence":
-                    sentences = [
-                        ex["text"][start:end] for start, end in ex["tokenizations"]
-                    ]
-                    for i, s in enumerate(sentences):
-                        examples.append(
-                            Example.fromdict(
-                                {
-                                    "qanta_id": ex["qanta_id"],
-                                    "sent": i,
-                                    "text": unidecode(s),
-                                    "page": ex["page"],
-                                },
-                                example_fields,
-                            )
-                        )
-                        answer_set.add(ex["page"])
-                elif example_mode == "question":
-                    examples.append(
-                        Example.fromdict(
-                            {
-                                "qanta_id": ex["qanta_id"],
-                                "sent": -1,
-                                "text": unidecode(ex["text"]),
-                                "page": ex["page"],
-                            },
-                            example_fields,
-                        )
+        for ex in iter_questions(path):
+            if example_mode == "sentence":
+                sentences = [
+                    ex["text"][start:end] for start, end in ex["tokenizations"]
+                ]
+                for i, s in enumerate(sentences):
+                    records.append(
+                        {
+                            "qanta_id": ex["qanta_id"],
+                            "sent": i,
+                            "text": unidecode(s),
+                            "page": ex["page"],
+                        }
                     )
                     answer_set.add(ex["page"])
-                else:
-                    raise ValueError(
-                        f"Valid modes are 'sentence' and 'question', but '{example_mode}' was given"
-                    )
+            elif example_mode == "question":
+                records.append(
+                    {
+                        "qanta_id": ex["qanta_id"],
+                        "sent": -1,
+                        "text": unidecode(ex["text"]),
+                        "page": ex["page"],
+                    }
+                )
+                answer_set.add(ex["page"])
+            else:
+                raise ValueError(
+                    f"Valid modes are 'sentence' and 'question', but '{example_mode}' was given"
+                )
 
         if use_wiki and n_wiki_sentences > 0 and "train" in path:
             print("Loading wikipedia")
@@ -254,12 +245,14 @@ class QuizBowl(Dataset):
 
             for page, sentences in pseq(pages).map(extract).list():
                 for i, s in enumerate(sentences):
-                    examples.append(
-                        Example.fromdict(
-                            {"qanta_id": -1, "sent": i, "text": s, "page": page},
-                            example_fields,
-                        )
-                    )
+                    records.append({"qanta_id": -1, "sent": i, "text": s, "page": page})
+
+        examples = self._create_examples(
+            records,
+            [("qanta_id", qanta_id_field), ("sent", sent_field), ("page", page_field)],
+            text_dependent_fields,
+            token_cache_path,
+        )
 
         dataset_fields = {
             "qanta_id": qanta_id_field,
@@ -277,6 +270,58 @@ class QuizBowl(Dataset):
 
         super(QuizBowl, self).__init__(examples, dataset_fields, **kwargs)
 
+    @staticmethod
+    def _create_examples(records, fields, text_fields, token_cache_path):
+        """
+        Same as calling Example.fromdict on each record, except that the text of text fields
+        tokenized by a QbTokenizer is tokenized once and shared by all of them
+        """
+        # Tokenizers that only differ in their n-grams produce the same unigram tokens
+        unigram_tokens = {}
+        for _, field in text_fields:
+            tokenizer = field.tokenize
+            if (
+                isinstance(tokenizer, QbTokenizer)
+                and tokenizer.cache_key not in unigram_tokens
+            ):
+                unigram_tokens[tokenizer.cache_key] = QuizBowl._unigram_tokens(
+                    tokenizer, records, token_cache_path
+                )
+
+        examples = []
+        for i, record in enumerate(records):
+            example = Example()
+            for name, field in fields:
+                setattr(example, name, field.preprocess(record[name]))
+            for name, field in text_fields:
+                tokenizer = field.tokenize
+                if isinstance(tokenizer, QbTokenizer):
+                    text = tokenizer.ngrams(unigram_tokens[tokenizer.cache_key][i])
+                else:
+                    text = record["text"]
+                setattr(example, name, field.preprocess(text))
+            examples.append(example)
+        return examples
+
+    @staticmethod
+    def _unigram_tokens(tokenizer: QbTokenizer, records, token_cache_path):
+        if token_cache_path is None:
+            return [tokenizer.tokenize(r["text"]) for r in records]
+
+        # Only question text is cached, wikipedia sentences have no qanta_id
+        questions = [r for r in records if r["qanta_id"] >= 0]
+        question_spans = iter(
+            TokenCache(token_cache_path, tokenizer).spans(
+                [r["qanta_id"] for r in questions], [r["text"] for r in questions]
+            )
+        )
+        return [
+            next(question_spans).tokens
+            if r["qanta_id"] >= 0
+            else tokenizer.tokenize(r["text"])
+            for r in records
+        ]
+
     @classmethod
     def splits(
         cls,
@@ -285,9 +330,9 @@ class QuizBowl(Dataset):
         n_wiki_sentences=5,
         replace_title_mentions="",
         root=".data",
-        train=f"qanta.torchtext.train.{DS_VERSION}.json",
-        validation=f"qanta.torchtext.val.{DS_VERSION}.json",
-        test=f"qanta.torchtext.dev.{DS_VERSION}.json",
+        train=SPLIT_FILES["train"],
+        validation=SPLIT_FILES["validation"],
+        test=SPLIT_FILES["test"],
         **kwargs,
     ):
         remaining_kwargs = kwargs.copy()
@@ -339,8 +384,100 @@ class QuizBowl(Dataset):
         bigram_max_vocab_size=None,
         trigram_max_vocab_size=None,
         sort_within_batch=None,
+        tensor_cache_dir=QB_TENSOR_CACHE,
         **kwargs,
     ):
+        """
+        Iterators over the train, val, and dev datasets. If tensor_cache_dir is not None the
+        numericalized datasets, vocabularies, and embedding matrices are cached there, keyed by
+        every parameter that affects them, and the iterators are TensorIterators over the cache.
+        Models only differing in their hyper parameters then share the preprocessing.
+        """
+        split_params = dict(
+            lower=lower,
+            example_mode=example_mode,
+            use_wiki=use_wiki,
+            n_wiki_sentences=n_wiki_sentences,
+            replace_title_mentions=replace_title_mentions,
+            root=root,
+            vectors=vectors,
+            unigrams=unigrams,
+            bigrams=bigrams,
+            trigrams=trigrams,
+            combined_ngrams=combined_ngrams,
+            combined_max_vocab_size=combined_max_vocab_size,
+            unigram_max_vocab_size=unigram_max_vocab_size,
+            bigram_max_vocab_size=bigram_max_vocab_size,
+            trigram_max_vocab_size=trigram_max_vocab_size,
+            **kwargs,
+        )
+        if tensor_cache_dir is None:
+            return BucketIterator.splits(
+                cls.vocab_splits(**split_params),
+                batch_size=batch_size,
+                device=device,
+                repeat=False,
+                sort_within_batch=sort_within_batch,
+            )
+
+        # Regenerated datasets with the same DS_VERSION are detected by the size and mtime of the
+        # source files
+        source_dir = cls.download(root)
+        source_paths = [
+            os.path.join(source_dir, kwargs.get(split, filename))
+            for split, filename in SPLIT_FILES.items()
+        ]
+        if use_wiki:
+            source_paths.append(wiki_lookup_path(source_dir))
+        cache_path = os.path.join(
+            tensor_cache_dir,
+            tensor_cache_key(
+                {
+                    "dataset_version": DS_VERSION,
+                    "tokenizer_version": TOKENIZER_VERSION,
+                    "sources": {
+                        os.path.basename(path): source_stat(path)
+                        for path in source_paths
+                    },
+                    **split_params,
+                }
+            ),
+        )
+        if os.path.exists(cache_path):
+            log.info(f"Loading numericalized dataset from {cache_path}")
+        else:
+            os.makedirs(tensor_cache_dir, exist_ok=True)
+            save_tensor_splits(cache_path, cls.vocab_splits(**split_params))
+        return TensorIterator.splits(
+            load_tensor_splits(cache_path),
+            batch_size=batch_size,
+            device=device,
+            sort_within_batch=sort_within_batch,
+        )
+
+    @classmethod
+    def vocab_splits(
+        cls,
+        lower=True,
+        example_mode="sentence",
+        use_wiki=False,
+        n_wiki_sentences=5,
+        replace_title_mentions="",
+        root=".data",
+        vectors="glove.6B.300d",
+        unigrams=True,
+        bigrams=False,
+        trigrams=False,
+        combined_ngrams=True,
+        combined_max_vocab_size=None,
+        unigram_max_vocab_size=None,
+        bigram_max_vocab_size=None,
+        trigram_max_vocab_size=None,
+        **kwargs,
+    ):
+        """
+        Train, val, and dev datasets with the vocabularies of their fields built on train
+        """
         QANTA_ID = LongField()
         SENT = LongField()
         PAGE = Field(sequential=False, tokenize=str_split)
@@ -429,10 +566,4 @@ class QuizBowl(Dataset):
                 TRIGRAM_TEXT.build_vocab(train, max_size=trigram_max_vocab_size)
             PAGE.build_vocab(train)
 
-        return BucketIterator.splits(
-            (train, val, dev),
-            batch_size=batch_size,
-            device=device,
-            repeat=False,
-            sort_within_batch=sort_within_batch,
-        )
+        return train, val, dev
@@ -0,0 +1,288 @@
+from typing import List, Dict, Tuple, Optional
+import os
+import json
+import shutil
+import hashlib
+
+import cloudpickle
+import numpy as np
+import torch
+
+from qanta import qlogging
+
+
+log = qlogging.get(__name__)
+
+# Bump when the layout of cached splits changes so that existing caches are not reused
+CACHE_FORMAT = 1
+
+SPLITS = ["train", "val", "dev"]
+# Text fields in the order QuizBowl.sort_key considers them
+TEXT_FIELDS = ["text", "unigram", "bigram", "trigram"]
+LONG_FIELDS = ["qanta_id", "sent", "page"]
+
+# Number of batches per pool of examples of similar lengths when shuffling, same as BucketIterator
+POOL_BATCHES = 100
+
+
+def tensor_cache_key(params: Dict) -> str:
+    """
+    :param params: everything that determines the examples and vocabularies, json serializable
+    """
+    key = json.dumps({"format": CACHE_FORMAT, **params}, sort_keys=True)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def _array_path(directory: str, split: str, name: str) -> str:
+    return os.path.join(directory, f"{split}.{name}.npy")
+
+
+def save_tensor_splits(path: str, datasets) -> None:
+    """
+    Numericalize torchtext datasets built by QuizBowl.splits whose vocabularies are built and save
+    them to path. Each text field is stored as the concatenated token ids of all examples with
+    offsets delimiting examples, the embedding matrices of the vocabularies are stored next to the
+    pickled fields.
+
+    :param path: directory to create
+    :param datasets: train, val, and dev datasets sharing the same fields
+    """
+    log.info(f"Saving numericalized dataset to {path}")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    fields = datasets[0].fields
+    text_fields = [name for name in TEXT_FIELDS if name in fields]
+    page_stoi = fields["page"].vocab.stoi
+    for split, dataset in zip(SPLITS, datasets):
+        examples = dataset.examples
+        np.save(
+            _array_path(tmp_path, split, "qanta_id"),
+            np.array([e.qanta_id for e in examples], dtype=np.int64),
+        )
+        np.save(
+            _array_path(tmp_path, split, "sent"),
+            np.array([e.sent for e in examples], dtype=np.int64),
+        )
+        np.save(
+            _array_path(tmp_path, split, "page"),
+            np.array([page_stoi[e.page] for e in examples], dtype=np.int64),
+        )
+        for name in text_fields:
+            stoi = fields[name].vocab.stoi
+            offsets = np.zeros(len(examples) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(getattr(e, name)) for e in examples])
+            ids = np.fromiter(
+                (stoi[token] for e in examples for token in getattr(e, name)),
+                dtype=np.int32,
+                count=offsets[-1],
+            )
+            np.save(_array_path(tmp_path, split, f"{name}.offsets"), offsets)
+            np.save(_array_path(tmp_path, split, f"{name}.ids"), ids)
+
+    # Embedding matrices are memory mapped when loading rather than pickled with the fields
+    vectors = {name: fields[name].vocab.vectors for name in text_fields}
+    try:
+        for name, field_vectors in vectors.items():
+            if field_vectors is not None:
+                np.save(
+                    os.path.join(tmp_path, f"{name}.vectors.npy"),
+                    field_vectors.numpy(),
+                )
+                fields[name].vocab.vectors = None
+        with open(os.path.join(tmp_path, "fields.pkl"), "wb") as f:
+            cloudpickle.dump({"fields": fields, "text_fields": text_fields}, f)
+    finally:
+        for name, field_vectors in vectors.items():
+            fields[name].vocab.vectors = field_vectors
+
+    os.replace(tmp_path, path)
+
+
+def load_tensor_splits(path: str) -> List["TensorDataset"]:
+    """
+    Load the train, val, and dev datasets saved by save_tensor_splits. Token ids and embedding
+    matrices are memory mapped, the embedding matrices copy on write so that models can modify
+    them in place.
+    """
+    with open(os.path.join(path, "fields.pkl"), "rb") as f:
+        params = cloudpickle.load(f)
+    fields = params["fields"]
+    text_fields = params["text_fields"]
+    for name in text_fields:
+        vectors_path = os.path.join(path, f"{name}.vectors.npy")
+        if os.path.exists(vectors_path):
+            fields[name].vocab.vectors = torch.from_numpy(
+                np.load(vectors_path, mmap_mode="c")
+            )
+
+    datasets = []
+    for split in SPLITS:
+        arrays = {name: np.load(_array_path(path, split, name)) for name in LONG_FIELDS}
+        text_arrays = {
+            name: (
+                np.load(_array_path(path, split, f"{name}.ids"), mmap_mode="r"),
+                np.load(_array_path(path, split, f"{name}.offsets")),
+            )
+            for name in text_fields
+        }
+        datasets.append(TensorDataset(fields, arrays, text_arrays))
+    return datasets
+
+
+def torch_device(device) -> torch.device:
+    """
+    Convert a torchtext device, -1 for the cpu, None for the current gpu, or a gpu index
+    """
+    if isinstance(device, (torch.device, str)):
+        return torch.device(device)
+    elif device == -1:
+        return torch.device("cpu")
+    elif device is None:
+        return torch.device("cuda")
+    else:
+        return torch.device("cuda", device)
+
+
+class TensorBatch:
+    def __init__(self, batch_size: int, tensors: Dict):
+        """
+        Batch with the same attributes as a torchtext batch of QuizBowl examples
+        """
+        self.batch_size = batch_size
+        for name, value in tensors.items():
+            setattr(self, name, value)
+
+
+class TensorDataset:
+    def __init__(
+        self,
+        fields: Dict,
+        arrays: Dict[str, np.ndarray],
+        text_arrays: Dict[str, Tuple[np.ndarray, np.ndarray]],
+    ):
+        """
+        Numericalized QuizBowl dataset, see load_tensor_splits
+
+        :param fields: torchtext fields with built vocabularies
+        :param arrays: qanta_id, sent, and page id of each example
+        :param text_arrays: for each text field the token ids of all examples and the offsets
+            delimiting each example
+        """
+        self.fields = fields
+        self.arrays = arrays
+        self.text_arrays = text_arrays
+        self.text_fields = [name for name in TEXT_FIELDS if name in text_arrays]
+
+    def __len__(self):
+        return len(self.arrays["qanta_id"])
+
+    def lengths(self, name: str) -> np.ndarray:
+        return np.diff(self.text_arrays[name][1])
+
+    @property
+    def sort_lengths(self) -> np.ndarray:
+        return self.lengths(self.text_fields[0])
+
+    def _pad(self, name: str, indices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        ids, offsets = self.text_arrays[name]
+        field = self.fields[name]
+        starts = offsets[indices]
+        lengths = offsets[indices + 1] - starts
+        positions = np.arange(lengths.max(initial=0))
+        mask = positions[None, :] < lengths[:, None]
+        padded = np.full(mask.shape, field.vocab.stoi[field.pad_token], dtype=np.int64)
+        padded[mask] = ids[(starts[:, None] + positions[None, :])[mask]]
+        return padded, lengths
+
+    def batch(self, indices: np.ndarray, device: torch.device) -> TensorBatch:
+        tensors = {
+            name: torch.from_numpy(self.arrays[name][indices]).to(device)
+            for name in LONG_FIELDS
+        }
+        for name in self.text_fields:
+            padded, lengths = self._pad(name, indices)
+            tensors[name] = (
+                torch.from_numpy(padded).to(device),
+                torch.from_numpy(lengths).to(device),
+            )
+        return TensorBatch(len(indices), tensors)
+
+
+class TensorIterator:
+    def __init__(
+        self,
+        dataset: TensorDataset,
+        batch_size: int,
+        device=None,
+        train=True,
+        sort_within_batch: Optional[bool] = None,
+    ):
+        """
+        Replacement for BucketIterator over a TensorDataset. When training, examples are shuffled
+        and batched with examples of similar length from the same pool, otherwise batches are
+        taken in order of length. Within a batch examples are sorted by decreasing length if
+        sort_within_batch, which defaults to True when not training.
+        """
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.device = torch_device(device)
+        self.train = train
+        if sort_within_batch is None:
+            self.sort_within_batch = not train
+        else:
+            self.sort_within_batch = sort_within_batch
+
+    def __len__(self):
+        return (len(self.dataset) + self.batch_size - 1) // self.batch_size
+
+    def _split(self, order: np.ndarray) -> List[np.ndarray]:
+        return [
+            order[start : start + self.batch_size]
+            for start in range(0, len(order), self.batch_size)
+        ]
+
+    def batch_indices(self) -> List[np.ndarray]:
+        lengths = self.dataset.sort_lengths
+        if self.train:
+            order = np.random.permutation(len(self.dataset))
+            pool_size = self.batch_size * POOL_BATCHES
+            batches = []
+            for start in range(0, len(order), pool_size):
+                pool = order[start : start + pool_size]
+                pool_batches = self._split(
+                    pool[np.argsort(lengths[pool], kind="mergesort")]
+                )
+                np.random.shuffle(pool_batches)
+                batches.extend(pool_batches)
+        else:
+            batches = self._split(np.argsort(lengths, kind="mergesort"))
+
+        if self.sort_within_batch:
+            batches = [b[np.argsort(-lengths[b], kind="mergesort")] for b in batches]
+        return batches
+
+    def __iter__(self):
+        for indices in self.batch_indices():
+            yield self.dataset.batch(indices, self.device)
+
+    @classmethod
+    def splits(
+        cls,
+        datasets: List[TensorDataset],
+        batch_size: int,
+        device=None,
+        sort_within_batch: Optional[bool] = None,
+    ):
+        return tuple(
+            cls(
+                d,
+                batch_size,
+                device=device,
+                train=i == 0,
+                sort_within_batch=sort_within_batch,
+            )
+            for i, d in enumerate(datasets)
+        )
@@ -0,0 +1,383 @@
+from typing import List, Optional, NamedTuple, Dict, Tuple
+import os
+import re
+import json
+import sqlite3
+import hashlib
+from contextlib import closing
+
+import numpy as np
+
+from qanta import qlogging
+from qanta.util.constants import QB_TOKEN_CACHE
+
+
+log = qlogging.get(__name__)
+
+# Bump when tokenization changes in a way that invalidates cached tokens
+TOKENIZER_VERSION = 2
+
+
+ftp_patterns = {
+    "\n",
+    ", for 10 points,",
+    ", for ten points,",
+    "--for 10 points--",
+    "for 10 points, ",
+    "for 10 points--",
+    "for ten points, ",
+    "for 10 points ",
+    "for ten points ",
+    ", ftp," "ftp,",
+    "ftp",
+}
+
+regex_pattern = "|".join([re.escape(p) for p in ftp_patterns])
+regex_pattern += r"|\[.*?\]|\(.*?\)"
+
+qb_pattern = re.compile(regex_pattern, flags=re.IGNORECASE)
+whitespace_pattern = re.compile(r"\s+")
+
+# nltk rewrites double quotes as opening and closing quote tokens
+QUOTE_TOKENS = {"``", "''"}
+
+
+# Unigram tokens of a text with the character offsets in that text each token was read from, and
+# the character ranges of the qb patterns stripped from the text before tokenizing. The offsets
+# are None if the tokens could not be aligned with the text
+TokenSpans = NamedTuple(
+    "TokenSpans",
+    [
+        ("tokens", List[str]),
+        ("starts", Optional[np.ndarray]),
+        ("ends", Optional[np.ndarray]),
+        ("stripped_starts", Optional[np.ndarray]),
+        ("stripped_ends", Optional[np.ndarray]),
+    ],
+)
+
+
+def _sub_tracked(
+    text: str, offsets: List[int], ranges: List[Tuple[int, int]]
+) -> Tuple[str, List[int]]:
+    """
+    Replace every (start, end) range of text by a single space, keeping for each character of the
+    result the offset of the original character it came from
+    """
+    pieces = []
+    new_offsets = []
+    position = 0
+    for start, end in ranges:
+        pieces.append(text[position:start])
+        new_offsets.extend(offsets[position:start])
+        pieces.append(" ")
+        new_offsets.append(offsets[start])
+        position = end
+    pieces.append(text[position:])
+    new_offsets.extend(offsets[position:])
+    return "".join(pieces), new_offsets
+
+
+def _align(tokens: List[str], text: str) -> Optional[Tuple[List[int], List[int]]]:
+    starts = []
+    ends = []
+    cursor = 0
+    for token in tokens:
+        start = text.find(token, cursor)
+        end = start + len(token)
+        if token in QUOTE_TOKENS:
+            quote_start = text.find('"', cursor)
+            if quote_start != -1 and (start == -1 or quote_start < start):
+                start = quote_start
+                end = start + 1
+        if start == -1:
+            return None
+        starts.append(start)
+        ends.append(end)
+        cursor = end
+    return starts, ends
+
+
+class QbTokenizer:
+    def __init__(
+        self,
+        unigrams=True,
+        bigrams=False,
+        trigrams=False,
+        zero_length_token="zerolengthunk",
+        strip_qb_patterns=True,
+    ):
+        """
+        Word tokenizer for quiz bowl text: strips "for 10 points" style patterns and bracketed
+        pronunciation guides, tokenizes with nltk, and expands the tokens to the configured n-grams.
+
+        Calling the tokenizer on a text tokenizes it from scratch. QbTokenizer.spans additionally
+        records the character offsets of the unigram tokens so that the tokens of any prefix of
+        the text are a slice of the tokens of the full text, see QbTokenizer.prefix_tokens. A
+        prefix's tokens are the tokens that end at or before the end of the prefix, so a word cut
+        in half by the prefix only appears once it is complete. A prefix that ends inside a
+        stripped pattern, for example an unclosed bracket, is tokenized from scratch since whether
+        the pattern matches depends on the text after the prefix.
+        """
+        self.unigrams = unigrams
+        self.bigrams = bigrams
+        self.trigrams = trigrams
+        self.zero_length_token = zero_length_token
+        self.strip_qb_patterns = strip_qb_patterns
+
+    @property
+    def cache_key(self) -> str:
+        """
+        Identifies the unigram tokenization, n-gram expansion does not affect cached tokens
+        """
+        import nltk
+
+        return json.dumps(
+            {
+                "version": TOKENIZER_VERSION,
+                "nltk": nltk.__version__,
+                "strip_qb_patterns": self.strip_qb_patterns,
+            },
+            sort_keys=True,
+        )
+
+    def _clean(self, text: str) -> str:
+        if self.strip_qb_patterns:
+            text = (
+                whitespace_pattern.sub(" ", qb_pattern.sub(" ", text))
+                .strip()
+                .capitalize()
+            )
+        return text
+
+    def tokenize(self, text: str) -> List[str]:
+        import nltk
+
+        return nltk.word_tokenize(self._clean(text))
+
+    def ngrams(self, tokens: List[str]) -> List[str]:
+        if len(tokens) == 0:
+            return [self.zero_length_token]
+        else:
+            ngrams = []
+            if self.unigrams:
+                ngrams.extend(tokens)
+            if self.bigrams:
+                ngrams.extend([f"{w0}++{w1}" for w0, w1 in zip(tokens, tokens[1:])])
+            if self.trigrams:
+                ngrams.extend(
+                    [
+                        f"{w0}++{w1}++{w2}"
+                        for w0, w1, w2 in zip(tokens, tokens[1:], tokens[2:])
+                    ]
+                )
+
+            if len(ngrams) == 0:
+                ngrams.append(self.zero_length_token)
+            return ngrams
+
+    def __call__(self, text: str) -> List[str]:
+        return self.ngrams(self.tokenize(text))
+
+    def spans(self, text: str) -> TokenSpans:
+        import nltk
+
+        offsets = list(range(len(text)))
+        cleaned = text
+        stripped_ranges = []
+        if self.strip_qb_patterns:
+            stripped_ranges = [m.span() for m in qb_pattern.finditer(cleaned)]
+            cleaned, offsets = _sub_tracked(cleaned, offsets, stripped_ranges)
+            cleaned, offsets = _sub_tracked(
+                cleaned,
+                offsets,
+                [m.span() for m in whitespace_pattern.finditer(cleaned)],
+            )
+            stripped = cleaned.strip()
+            start = len(cleaned) - len(cleaned.lstrip())
+            offsets = offsets[start : start + len(stripped)]
+            cleaned = stripped.capitalize()
+
+        tokens = nltk.word_tokenize(cleaned)
+        # Capitalizing a few unicode characters changes the length of the text, offsets are then
+        # no longer valid
+        alignment = _align(tokens, cleaned) if len(cleaned) == len(offsets) else None
+        if alignment is None:
+            return TokenSpans(tokens, None, None, None, None)
+        starts, ends = alignment
+        offsets = np.array(offsets, dtype=np.int32)
+        stripped_ranges = np.array(stripped_ranges, dtype=np.int32).reshape(-1, 2)
+        return TokenSpans(
+            tokens,
+            offsets[np.array(starts, dtype=np.int32)],
+            offsets[np.array(ends, dtype=np.int32) - 1] + 1,
+            np.ascontiguousarray(stripped_ranges[:, 0]),
+            np.ascontiguousarray(stripped_ranges[:, 1]),
+        )
+
+    def prefix_tokens(self, text: str, spans: TokenSpans, char_index: int) -> List[str]:
+        """
+        Tokens of text[:char_index] where spans are the spans of text. These are the complete
+        tokens of the prefix, sliced from spans, unless the prefix ends inside a stripped pattern
+        or spans are not aligned, in which case the prefix is tokenized from scratch.
+        """
+        if spans.ends is None:
+            return self(text[:char_index])
+        # Stripped ranges do not overlap, so the only one that can contain char_index is the first
+        # one ending after it
+        i = np.searchsorted(spans.stripped_ends, char_index, side="right")
+        if i < len(spans.stripped_starts) and spans.stripped_starts[i] < char_index:
+            return self(text[:char_index])
+        n_tokens = np.searchsorted(spans.ends, char_index, side="right")
+        return self.ngrams(spans.tokens[:n_tokens])
+
+    def run_tokens(
+        self,
+        questions: List[str],
+        char_indices: List[List[int]],
+        qanta_ids: Optional[List[int]] = None,
+        cache_path: Optional[str] = QB_TOKEN_CACHE,
+    ) -> List[List[str]]:
+        """
+        Tokens of every prefix question[:char_ix], flattened across questions. Each question is
+        tokenized once, or read from the token cache if qanta_ids are given, and the prefixes are
+        slices of its tokens.
+
+        :param questions: full text of the questions
+        :param char_indices: for each question, the character indices of its prefixes
+        :param qanta_ids: if given along with cache_path, read and store spans in a TokenCache
+        :param cache_path: path to the TokenCache
+        """
+        if qanta_ids is not None and cache_path is not None:
+            question_spans = TokenCache(cache_path, self).spans(qanta_ids, questions)
+        else:
+            question_spans = [self.spans(q) for q in questions]
+
+        run_tokens = []
+        for text, spans, indices in zip(questions, question_spans, char_indices):
+            run_tokens.extend(
+                self.prefix_tokens(text, spans, char_ix) for char_ix in indices
+            )
+        return run_tokens
+
+
+def create_qb_tokenizer(
+    unigrams=True,
+    bigrams=False,
+    trigrams=False,
+    zero_length_token="zerolengthunk",
+    strip_qb_patterns=True,
+) -> QbTokenizer:
+    return QbTokenizer(
+        unigrams=unigrams,
+        bigrams=bigrams,
+        trigrams=trigrams,
+        zero_length_token=zero_length_token,
+        strip_qb_patterns=strip_qb_patterns,
+    )
+
+
+def text_digest(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class TokenCache:
+    # Number of qanta_ids looked up per query, below the sqlite limit on query parameters
+    QUERY_SIZE = 500
+
+    def __init__(self, path: str, tokenizer: QbTokenizer):
+        """
+        SQLite cache of TokenSpans keyed by qanta_id and the tokenizer's cache key. A digest of the
+        text is stored as part of the key, so several texts of the same question, for example its
+        sentences, are cached separately and an edited question is tokenized again.
+
+        :param path: sqlite file, created if it does not exist
+        :param tokenizer: tokenizer computing the spans of texts that are not cached yet
+        """
+        self.path = path
+        self.tokenizer = tokenizer
+        self.tokenizer_key = tokenizer.cache_key
+        directory = os.path.dirname(path)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS spans (
+                  tokenizer TEXT NOT NULL, qanta_id INT NOT NULL, digest TEXT NOT NULL,
+                  tokens TEXT NOT NULL, starts BLOB, ends BLOB,
+                  stripped_starts BLOB, stripped_ends BLOB,
+                  PRIMARY KEY (tokenizer, qanta_id, digest)
+                )
+            """
+            )
+            # Caches created before stripped ranges were recorded only hold rows of an older
+            # tokenizer version, which are never read
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(spans)")}
+            for column in ("stripped_starts", "stripped_ends"):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE spans ADD COLUMN {column} BLOB")
+            conn.commit()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    def _read(self, conn, qanta_ids: List[int]) -> Dict[Tuple[int, str], TokenSpans]:
+        cached = {}
+        distinct_ids = sorted(set(qanta_ids))
+        for i in range(0, len(distinct_ids), self.QUERY_SIZE):
+            query_ids = distinct_ids[i : i + self.QUERY_SIZE]
+            rows = conn.execute(
+                f"""
+                SELECT qanta_id, digest, tokens, starts, ends, stripped_starts, stripped_ends
+                FROM spans
+                WHERE tokenizer = ? AND qanta_id IN ({', '.join('?' for _ in query_ids)})
+                """,
+                [self.tokenizer_key] + query_ids,
+            )
+            for qanta_id, digest, tokens, *arrays in rows:
+                if arrays[0] is None:
+                    spans = TokenSpans(json.loads(tokens), None, None, None, None)
+                else:
+                    spans = TokenSpans(
+                        json.loads(tokens),
+                        *(np.frombuffer(a, dtype=np.int32) for a in arrays),
+                    )
+                cached[qanta_id, digest] = spans
+        return cached
+
+    def spans(self, qanta_ids: List[int], texts: List[str]) -> List[TokenSpans]:
+        """
+        Spans of each text, tokenizing and caching the texts that are not cached yet
+        """
+        qanta_ids = [int(q) for q in qanta_ids]
+        keys = [(q, text_digest(t)) for q, t in zip(qanta_ids, texts)]
+        with closing(self._connect()) as conn:
+            cached = self._read(conn, qanta_ids)
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in cached and key not in missing:
+                    missing[key] = self.tokenizer.spans(text)
+            if len(missing) > 0:
+                log.info(f"Tokenizing {len(missing)} texts missing from {self.path}")
+                conn.executemany(
+                    "INSERT OR REPLACE INTO spans VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        (
+                            self.tokenizer_key,
+                            qanta_id,
+                            digest,
+                            json.dumps(s.tokens),
+                            None if s.starts is None else s.starts.tobytes(),
+                            None if s.ends is None else s.ends.tobytes(),
+                            None
+                            if s.stripped_starts is None
+                            else s.stripped_starts.tobytes(),
+                            None if s.stripped_ends is None else s.stripped_ends.tobytes(),
+                        )
+                        for (qanta_id, digest), s in missing.items()
+                    ),
+                )
+                conn.commit()
+                cached.update(missing)
+        return [cached[key] for key in keys]
@@ -48,6 +48,9 @@ SENTENCE_STATS = "output/guesser/sentence_stats.pickle"
 
 GLOVE_WE = "data/external/deep/glove.6B.300d.txt"
 
+QB_TOKEN_CACHE = "output/guesser/qb_tokens.sqlite3"
+QB_TENSOR_CACHE = "output/guesser/qb_tensors"
+
 GUESSER_TARGET_PREFIX = "output/guesser"
 GUESSER_REPORTING_PREFIX = "output/reporting/guesser"
 
@@ -66,6 +69,8 @@ QANTA_MAP_REPORT_PATH = "data/external/answer_mapping/match_report.json"
 QANTA_MAPPED_DATASET_PATH = path.join(DATASET_PREFIX, f"qanta.mapped.{DS_VERSION}.json")
 QANTA_EXPO_DATASET_PATH = path.join(DATASET_PREFIX, f"qanta.expo.{DS_VERSION}.json")
 QANTA_SQL_DATASET_PATH = path.join(DATASET_PREFIX, f"qanta.{DS_VERSION}.sqlite3")
+QANTA_SENTENCE_CACHE = path.join(DATASET_PREFIX, "qanta.sentences.sqlite3")
+QANTA_STAGE_CACHE = path.join(DATASET_PREFIX, "qanta.stages.sqlite3")
 QANTA_TRAIN_DATASET_PATH = path.join(DATASET_PREFIX, f"qanta.train.{DS_VERSION}.json")
 QANTA_DEV_DATASET_PATH = path.join(DATASET_PREFIX, f"qanta.dev.{DS_VERSION}.json")
 QANTA_TEST_DATASET_PATH = path.join(DATASET_PREFIX, f"qanta.test.{DS_VERSION}.json")
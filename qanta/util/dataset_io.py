@@ -0,0 +1,166 @@
+from typing import Dict, Iterable, Iterator, Tuple
+import os
+import bz2
+import gzip
+import json
+import lzma
+from contextlib import contextmanager
+
+from qanta.config import conf
+
+
+DATASET_METADATA = {
+    "maintainer_name": "Pedro Rodriguez",
+    "maintainer_contact": "entilzha@umiacs.umd.edu",
+    "maintainer_website": "https://www.entilzha.io",
+    "project_website": "http://qanta.org/",
+}
+
+COMPRESSION_SUFFIXES = {"gzip": ".gz", "bz2": ".bz2", "xz": ".xz"}
+_OPENERS = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+
+
+def dataset_header(version: str) -> Dict:
+    return {"version": version, **DATASET_METADATA}
+
+
+def _compression_suffix(path: str) -> str:
+    _, suffix = os.path.splitext(path)
+    return suffix if suffix in _OPENERS else ""
+
+
+def is_jsonl(path: str) -> bool:
+    """
+    Whether path is a line delimited dataset: .jsonl, optionally followed by a compression suffix
+    """
+    suffix = _compression_suffix(path)
+    return path[: len(path) - len(suffix)].endswith(".jsonl")
+
+
+def _open_text(path: str, mode: str):
+    opener = _OPENERS.get(_compression_suffix(path))
+    if opener is None:
+        return open(path, mode)
+    else:
+        return opener(path, mode + "t", encoding="utf-8")
+
+
+def dataset_path(path: str) -> str:
+    """
+    Path of an intermediate dataset in the format configured by dataset_format, for example
+    qanta.mapped.json becomes qanta.mapped.jsonl.gz when writing gzip compressed jsonl
+    """
+    format_conf = conf["dataset_format"]
+    if format_conf["format"] == "json":
+        return path
+    elif format_conf["format"] == "jsonl":
+        base, _ = os.path.splitext(path)
+        compression = format_conf["compression"]
+        if compression is None:
+            return base + ".jsonl"
+        else:
+            return base + ".jsonl" + COMPRESSION_SUFFIXES[compression]
+    else:
+        raise ValueError(f"Invalid dataset format: {format_conf['format']}")
+
+
+@contextmanager
+def open_dataset(path: str) -> Iterator[Tuple[Dict, Iterator[Dict]]]:
+    """
+    Open a dataset written by DatasetWriter or json.dump(format_qanta_json(...)), usage:
+
+        with open_dataset(path) as (header, questions):
+            for q in questions:
+                ...
+
+    Questions of jsonl datasets are read one line at a time, json datasets are read at once.
+    """
+    with _open_text(path, "r") as f:
+        if is_jsonl(path):
+            header = json.loads(f.readline())
+            questions = (json.loads(line) for line in f if line.strip() != "")
+        else:
+            header = json.load(f)
+            questions = iter(header.pop("questions"))
+        yield header, questions
+
+
+def iter_questions(path: str) -> Iterator[Dict]:
+    with open_dataset(path) as (_, questions):
+        yield from questions
+
+
+def read_dataset(path: str) -> Dict:
+    """
+    Read a dataset in either format into the dictionary json datasets are stored as
+    """
+    with open_dataset(path) as (header, questions):
+        return {"questions": list(questions), **header}
+
+
+class DatasetWriter:
+    def __init__(self, path: str, version: str):
+        """
+        Write a dataset one question at a time. Paths ending in .jsonl, optionally compressed,
+        get a header line with the version and metadata followed by one question per line. Other
+        paths get the same json document as json.dump(format_qanta_json(questions, version)).
+
+        The file is written to a temporary path and moved in place when the writer is closed
+        without error, so an interrupted stage does not leave a partial output behind.
+        """
+        self.path = path
+        self.version = version
+        self.jsonl = is_jsonl(path)
+        self.n_questions = 0
+        directory = os.path.dirname(path)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+        self._tmp_path = f"{path}.{os.getpid()}.tmp{_compression_suffix(path)}"
+        self._file = _open_text(self._tmp_path, "w")
+        if self.jsonl:
+            self._file.write(json.dumps(dataset_header(version)))
+            self._file.write("\n")
+        else:
+            self._file.write('{"questions": [')
+
+    def write(self, question: Dict) -> None:
+        if self.jsonl:
+            self._file.write(json.dumps(question))
+            self._file.write("\n")
+        else:
+            if self.n_questions > 0:
+                self._file.write(", ")
+            self._file.write(json.dumps(question))
+        self.n_questions += 1
+
+    def close(self) -> None:
+        if not self.jsonl:
+            self._file.write("]")
+            for key, value in dataset_header(self.version).items():
+                self._file.write(f", {json.dumps(key)}: {json.dumps(value)}")
+            self._file.write("}")
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self) -> None:
+        self._file.close()
+        os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write_dataset(path: str, questions: Iterable[Dict], version: str) -> int:
+    """
+    :return: number of questions written
+    """
+    with DatasetWriter(path, version) as writer:
+        for q in questions:
+            writer.write(q)
+    return writer.n_questions
@@ -0,0 +1,22 @@
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+def top_k(scores: np.ndarray, k: Optional[int]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find the k highest scoring columns of each row of a dense score matrix without sorting every
+    column. Columns are selected with argpartition and only the selected k are sorted.
+
+    :param scores: [n_rows, n_columns] matrix of scores
+    :param k: number of columns to return per row, if None then all of them
+    :return: [n_rows, k] indices and scores sorted from highest to lowest score
+    """
+    n_columns = scores.shape[1]
+    if k is None or k >= n_columns:
+        indices = np.argsort(-scores, axis=1)
+    else:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1)
+        indices = np.take_along_axis(candidates, order, axis=1)
+    return indices, np.take_along_axis(scores, indices, axis=1)
@@ -0,0 +1,135 @@
+from typing import Tuple, Iterable, Optional
+import os
+import json
+
+import numpy as np
+
+from qanta import qlogging
+
+
+log = qlogging.get(__name__)
+
+# Bump when the layout of converted vectors changes so that existing conversions are redone
+CONVERSION_FORMAT = 2
+
+
+class WordVectors:
+    def __init__(self, text_path: str, binary_path: Optional[str] = None):
+        """
+        Word vectors in the GloVe text format converted once to a float32 matrix that is memory
+        mapped, with the words stored separately as the row index. Loading is then constant time
+        and looking up a vocabulary is one fancy index into the matrix, only the pages of the rows
+        that are used are read.
+
+        The conversion is redone whenever the text file changes, staleness is detected from its
+        size and modification time.
+
+        :param text_path: word vectors with one word followed by its components per line
+        :param binary_path: prefix of the converted files, by default next to the text file
+        """
+        self.text_path = text_path
+        if binary_path is None:
+            binary_path = text_path
+        self.matrix_path = binary_path + ".f32"
+        self.meta_path = binary_path + ".words.json"
+        meta = self._read_meta()
+        if meta is None:
+            self.convert()
+            meta = self._read_meta()
+        self.dim = meta["dim"]
+        self.words = meta["words"]
+        self.stoi = {w: i for i, w in enumerate(self.words)}
+        if len(self.words) == 0:
+            self.vectors = np.zeros((0, self.dim), dtype=np.float32)
+        else:
+            self.vectors = np.memmap(
+                self.matrix_path,
+                dtype=np.float32,
+                mode="r",
+                shape=(len(self.words), self.dim),
+            )
+
+    def _source_stat(self):
+        stat = os.stat(self.text_path)
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    def _read_meta(self):
+        if not os.path.exists(self.meta_path) or not os.path.exists(self.matrix_path):
+            return None
+        with open(self.meta_path) as f:
+            meta = json.load(f)
+        if meta["format"] != CONVERSION_FORMAT or meta["source"] != self._source_stat():
+            return None
+        return meta
+
+    def convert(self) -> None:
+        log.info(f"Converting {self.text_path} to {self.matrix_path}")
+        source_stat = self._source_stat()
+        words = []
+        stoi = {}
+        dim = None
+        n_bad_vectors = 0
+        tmp_path = f"{self.matrix_path}.{os.getpid()}.tmp"
+        with open(self.text_path) as f, open(tmp_path, "wb") as out:
+            for line in f:
+                word, _, components = line.rstrip().partition(" ")
+                try:
+                    vector = np.array(components.split(" "), dtype=np.float32)
+                except ValueError:
+                    n_bad_vectors += 1
+                    continue
+                if dim is None:
+                    dim = len(vector)
+                if len(vector) != dim:
+                    n_bad_vectors += 1
+                    continue
+                # Same as a dictionary built while reading the file, the last vector of a word wins
+                if word in stoi:
+                    out.seek(stoi[word] * vector.nbytes)
+                    out.write(vector.tobytes())
+                    out.seek(0, os.SEEK_END)
+                    continue
+                stoi[word] = len(words)
+                words.append(word)
+                out.write(vector.tobytes())
+        os.replace(tmp_path, self.matrix_path)
+
+        log.info(
+            f"Converted {len(words)} vectors, skipped {n_bad_vectors} lines that could not be parsed"
+        )
+        tmp_path = f"{self.meta_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "format": CONVERSION_FORMAT,
+                    "source": source_stat,
+                    "dim": 0 if dim is None else dim,
+                    "words": words,
+                },
+                f,
+            )
+        os.replace(tmp_path, self.meta_path)
+
+    def __len__(self):
+        return len(self.words)
+
+    def __contains__(self, word: str):
+        return word in self.stoi
+
+    def rows(self, words: Iterable[str]) -> np.ndarray:
+        """
+        :return: row of each word in WordVectors.vectors, -1 for words without a vector
+        """
+        stoi = self.stoi
+        return np.array([stoi.get(w, -1) for w in words], dtype=np.int64)
+
+    def gather(self, words: Iterable[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: [n_words, dim] float32 vectors with zeros for words without a vector, and a
+            boolean mask of the words that have a vector
+        """
+        rows = self.rows(words)
+        found = rows >= 0
+        vectors = np.zeros((len(rows), self.dim), dtype=np.float32)
+        vectors[found] = self.vectors[rows[found]]
+        return vectors, found
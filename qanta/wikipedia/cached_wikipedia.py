@@ -9,7 +9,7 @@ import nltk
 from unidecode import unidecode
 
 from qanta import qlogging
-from qanta.datasets.quiz_bowl import QantaDatabase
+from qanta.datasets.quiz_bowl import qanta_database
 from qanta.util.constants import (
     COUNTRY_LIST_PATH,
     WIKI_DUMP_REDIRECT_PICKLE,
@@ -51,7 +51,7 @@ def create_wikipedia_cache(
     from qanta.spark import create_spark_context
 
     sc = create_spark_context()
-    db = QantaDatabase()
+    db = qanta_database()
     train_questions = db.train_questions
     answers = {q.page for q in train_questions}
     b_answers = sc.broadcast(answers)
@@ -88,7 +88,7 @@ def create_wikipedia_redirect_pickle(redirect_csv, output_pickle):
             k, v = line.split("\t")
             countries[k] = v.strip()
 
-    db = QantaDatabase()
+    db = qanta_database()
     pages = {q.page for q in db.train_questions}
 
     with open(redirect_csv) as redirect_f:
@@ -0,0 +1,132 @@
+from collections import defaultdict, OrderedDict, Counter
+
+from qanta.ingestion.answer_mapping import (
+    create_expansion_rules,
+    create_match_rules,
+    make_source_list,
+    make_disamb_list,
+    find_match,
+    find_amb_match,
+    mapping_rules_to_answer_map,
+    whitespace_re,
+)
+
+
+WIKI_TITLES = {
+    "Albert_Einstein",
+    "The_Great_Gatsby",
+    "Mercury_(planet)",
+    "Mercury_(element)",
+    "Mercury_(mythology)",
+    "Pierre-Auguste_Renoir",
+    "Zoë_Saldana",
+    "NATO",
+    "Isaac_Newton",
+    "Walter_Scott",
+    "Don_Quixote",
+    "Rock_and_roll",
+}
+WIKI_REDIRECTS = {
+    "Einstein": "Albert_Einstein",
+    "Renoir": "Pierre-Auguste_Renoir",
+    "Newton": "Isaac_Newton",
+    "Quixote": "Don_Quixote",
+    "rock & roll": "Rock_and_roll",
+}
+ANSWERS = {
+    "Albert Einstein",
+    "albert einstein",
+    "{Einstein}",
+    '"Renoir"',
+    "Great Gatsby",
+    "The Great Gatsby [accept Gatsby]",
+    "Mercury",
+    "Zoe Saldana",
+    "NATO",
+    "nato",
+    "Sir Walter Scott",
+    "Isaac Newton or Newton",
+    "Answer: Don Quixote",
+    "Don Quixote (prompt on Quixote)",
+    "Rock & Roll",
+    "Newton’s",
+    "(Isaac) Newton",
+    "unmatched answer",
+}
+
+
+def reference_answer_map(expansion_rules, match_rules, wiki_titles, redirects, answers):
+    """
+    Straightforward implementation of the answer mapping that AnswerMatcher replaced: every rule is
+    applied to every expansion and every source is tried in turn
+    """
+    source_list = make_source_list(wiki_titles, redirects)
+    disamb_candidates = make_disamb_list(wiki_titles)
+    expansion_answer_map = defaultdict(dict)
+    for name, priority, rule_func in sorted(
+        expansion_rules, key=lambda x: x[1], reverse=True
+    ):
+        for raw_ans in answers:
+            for exp_ans in rule_func(raw_ans):
+                exp_ans = exp_ans.strip()
+                if exp_ans in expansion_answer_map[raw_ans]:
+                    curr_priority, _ = expansion_answer_map[raw_ans][exp_ans]
+                    if priority > curr_priority:
+                        expansion_answer_map[raw_ans][exp_ans] = priority, name
+                else:
+                    expansion_answer_map[raw_ans][exp_ans] = priority, name
+
+    answer_map = {}
+    amb_answer_map = defaultdict(list)
+    report = {"expansion": {}, "match": {}, "source": {}}
+    for original_ans, ans_expansions in expansion_answer_map.items():
+        for match_name, _, rule_func in sorted(
+            match_rules, key=lambda x: x[1], reverse=True
+        ):
+            for raw_ans, (_, expansion_name) in sorted(
+                ans_expansions.items(), key=lambda x: x[1], reverse=True
+            ):
+                rule_ans = whitespace_re.sub(" ", rule_func(raw_ans)).strip()
+                if original_ans not in answer_map:
+                    match, source = find_match(
+                        rule_ans, rule_ans.lower(), rule_ans.isupper(), source_list
+                    )
+                    if match is not None:
+                        answer_map[original_ans] = match
+                        report["expansion"][original_ans] = match_name
+                        report["match"][original_ans] = expansion_name
+                        report["source"][original_ans] = source
+                amb_match, _ = find_amb_match(rule_ans, disamb_candidates)
+                if amb_match is not None:
+                    amb_answer_map[original_ans].extend(amb_match)
+
+    for k in amb_answer_map:
+        amb_answer_map[k] = list(OrderedDict.fromkeys(amb_answer_map[k]))
+    report["expansion_counts"] = Counter(report["expansion"].values())
+    report["match_counts"] = Counter(report["match"].values())
+    report["source_counts"] = Counter(report["source"].values())
+    return answer_map, amb_answer_map, report
+
+
+def test_answer_matcher_matches_reference():
+    expansion_rules = create_expansion_rules()
+    # The plural rules need the wordnet corpus
+    match_rules = [r for r in create_match_rules() if "plural" not in r[0]]
+    expected = reference_answer_map(
+        expansion_rules, match_rules, WIKI_TITLES, WIKI_REDIRECTS, ANSWERS
+    )
+    assert len(expected[0]) > 0 and len(expected[1]) > 0
+
+    for n_procs in [1, 2]:
+        answer_map, amb_answer_map, _, report = mapping_rules_to_answer_map(
+            expansion_rules,
+            match_rules,
+            WIKI_TITLES,
+            WIKI_REDIRECTS,
+            set(ANSWERS),
+            n_procs=n_procs,
+            shard_size=4,
+        )
+        assert answer_map == expected[0]
+        assert dict(amb_answer_map) == dict(expected[1])
+        assert report == expected[2]
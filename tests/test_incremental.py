@@ -0,0 +1,101 @@
+import sqlite3
+
+from qanta.ingestion.incremental import (
+    StageCache,
+    content_digest,
+    question_digest,
+    restore_fields,
+)
+
+
+def run_stage(cache, questions, processed):
+    def process(chunk):
+        processed.extend(q["qanta_id"] for q in chunk)
+        return [q["text"].upper() for q in chunk]
+
+    return list(
+        cache.run(questions, lambda q: content_digest(q["text"]), process, chunk_size=2)
+    )
+
+
+def test_stage_cache_only_processes_changed_questions(tmp_path):
+    path = str(tmp_path / "stages.sqlite3")
+    questions = [{"qanta_id": i, "text": f"question {i}"} for i in range(5)]
+
+    processed = []
+    outputs = run_stage(StageCache(path, "upper", "v1"), questions, processed)
+    assert outputs == [f"QUESTION {i}" for i in range(5)]
+    assert processed == [0, 1, 2, 3, 4]
+
+    questions[3] = {"qanta_id": 3, "text": "changed"}
+    questions.append({"qanta_id": 5, "text": "new"})
+    processed = []
+    outputs = run_stage(StageCache(path, "upper", "v1"), questions, processed)
+    assert outputs == [
+        "QUESTION 0",
+        "QUESTION 1",
+        "QUESTION 2",
+        "CHANGED",
+        "QUESTION 4",
+        "NEW",
+    ]
+    assert processed == [3, 5]
+
+    processed = []
+    run_stage(StageCache(path, "upper", "v2"), questions, processed)
+    assert processed == [0, 1, 2, 3, 4, 5]
+
+
+def test_stage_cache_deletes_removed_questions(tmp_path):
+    path = str(tmp_path / "stages.sqlite3")
+    questions = [{"qanta_id": i, "text": f"question {i}"} for i in range(5)]
+    run_stage(StageCache(path, "upper", "v1"), questions, [])
+    run_stage(StageCache(path, "other", "v1"), questions, [])
+
+    run_stage(StageCache(path, "upper", "v1"), questions[:2], [])
+    with sqlite3.connect(path) as conn:
+        rows = conn.execute(
+            "SELECT stage, output FROM outputs ORDER BY stage, output"
+        ).fetchall()
+    assert rows == [("other", f'"QUESTION {i}"') for i in range(5)] + [
+        ("upper", '"QUESTION 0"'),
+        ("upper", '"QUESTION 1"'),
+    ]
+
+
+def run_question_stage(cache, questions, processed):
+    def process(chunk):
+        processed.extend(q["text"] for q in chunk)
+        return [dict(q, upper=q["text"].upper()) for q in chunk]
+
+    return list(
+        cache.run(
+            [dict(q) for q in questions],
+            question_digest,
+            process,
+            chunk_size=2,
+            restore=restore_fields,
+        )
+    )
+
+
+def test_stage_cache_ignores_shifted_qanta_ids_and_folds(tmp_path):
+    path = str(tmp_path / "stages.sqlite3")
+    texts = [f"question {i}" for i in range(5)]
+    questions = [
+        {"qanta_id": i, "fold": "guesstrain", "text": t} for i, t in enumerate(texts)
+    ]
+    processed = []
+    run_question_stage(StageCache(path, "upper", "v1"), questions, processed)
+    assert processed == texts
+
+    # A new tournament at the front shifts the qanta_id and fold of every later question
+    texts = ["new question"] + texts
+    folds = ["guesstrain", "buzztrain"]
+    questions = [
+        {"qanta_id": i, "fold": folds[i % 2], "text": t} for i, t in enumerate(texts)
+    ]
+    processed = []
+    outputs = run_question_stage(StageCache(path, "upper", "v1"), questions, processed)
+    assert processed == ["new question"]
+    assert outputs == [dict(q, upper=q["text"].upper()) for q in questions]
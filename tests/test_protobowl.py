@@ -0,0 +1,52 @@
+import json
+
+from qanta.datasets.protobowl import parse_shard
+
+
+def make_record(i: int) -> str:
+    return json.dumps(
+        {
+            "date": "Fri Apr 27 2018 12:34:56 GMT-0400 (EDT)",
+            "object": {
+                "guess": f"guess {i}",
+                "qid": f"q{i % 3}",
+                "time_elapsed": i + 1,
+                "time_remaining": 100,
+                "ruling": [True, False, "prompt"][i % 3],
+                "user": {"id": f"u{i % 2}"},
+                "question_text": f"text {i % 3}",
+            },
+        }
+    )
+
+
+def write_log(path) -> int:
+    lines = []
+    for i in range(6):
+        record = make_record(i)
+        if i % 2 == 1:
+            # Records split across lines are joined until the line ending with "}}"
+            middle = len(record) // 2
+            lines.extend([record[:middle], record[middle:]])
+        else:
+            lines.append(record)
+        if i == 3:
+            lines.append("")
+            lines.append("{not json}}")
+    content = ("\n".join(lines) + "\n").encode("utf-8")
+    path.write_bytes(content)
+    return len(content)
+
+
+def test_parse_shard_split_at_every_offset(tmp_path):
+    path = tmp_path / "protobowl.log"
+    size = write_log(path)
+    serial_columns, serial_questions = parse_shard(str(path), 0, size)
+    assert serial_columns["guess"] == [f"guess {i}" for i in range(6)]
+
+    for split in range(1, size):
+        first_columns, first_questions = parse_shard(str(path), 0, split)
+        second_columns, second_questions = parse_shard(str(path), split, size)
+        for name, values in serial_columns.items():
+            assert first_columns[name] + second_columns[name] == values, split
+        assert {**second_questions, **first_questions} == serial_questions
@@ -0,0 +1,47 @@
+import torch
+from torchtext.data.field import Field
+
+from qanta.guesser.rnn import RnnGuesser, RnnModel
+from qanta.torch import prepare_inference_model
+from qanta.torch.dataset import LongField, QBTextField, str_split
+
+
+def create_guesser():
+    text_field = QBTextField(batch_first=True, tokenize=str_split, include_lengths=True)
+    text_field.build_vocab([["this", "capital", "of", "france", "is", "on", "seine"]])
+    page_field = Field(sequential=False, tokenize=str_split)
+    page_field.build_vocab([["Paris", "London", "Berlin"]])
+
+    guesser = RnnGuesser(None)
+    guesser.device = "cpu"
+    guesser.text_field = text_field
+    guesser.page_field = page_field
+    guesser.qanta_id_field = LongField()
+    guesser.n_classes = len(page_field.vocab)
+    guesser.n_hidden_units = 8
+    guesser.n_hidden_layers = 1
+    torch.manual_seed(0)
+    guesser.model = prepare_inference_model(
+        RnnModel(
+            guesser.n_classes,
+            text_field=text_field,
+            init_embeddings=False,
+            emb_dim=16,
+            n_hidden_units=guesser.n_hidden_units,
+            n_hidden_layers=guesser.n_hidden_layers,
+        ),
+        torch.device("cpu"),
+    )
+    return guesser
+
+
+def test_rnn_guesser_guesses_on_cpu():
+    guesser = create_guesser()
+    questions = ["this capital is on the seine", "capital of france", "seine"]
+    guesses = guesser.guess(questions, 2)
+
+    assert len(guesses) == len(questions)
+    for question_guesses in guesses:
+        assert len(question_guesses) == 2
+        assert all(page in guesser.ans_to_i for page, _ in question_guesses)
+        assert question_guesses[0][1] >= question_guesses[1][1]
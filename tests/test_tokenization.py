@@ -0,0 +1,36 @@
+from qanta.torch.tokenization import QbTokenizer
+
+
+TEXT = (
+    "This city (pronounced [pa-REE]) lies on the Seine. "
+    "For 10 points, name this capital of France [accept Lutetia]"
+)
+
+
+def test_run_tokens_match_tokenizing_each_prefix():
+    tokenizer = QbTokenizer(unigrams=True, bigrams=True)
+    spans = tokenizer.spans(TEXT)
+    assert spans.ends is not None
+
+    # Prefixes that end between words, where both tokenizations keep complete words only, and
+    # every prefix ending inside a stripped pattern
+    indices = {0, len(TEXT)}
+    indices.update(ix for ix in range(1, len(TEXT)) if " " in TEXT[ix - 1 : ix + 1])
+    for start, end in zip(spans.stripped_starts, spans.stripped_ends):
+        indices.update(range(start, end + 1))
+    indices = sorted(indices)
+
+    run_tokens = tokenizer.run_tokens([TEXT], [indices], cache_path=None)
+    assert run_tokens == [tokenizer(TEXT[:ix]) for ix in indices]
+
+
+def test_run_tokens_from_token_cache(tmp_path):
+    tokenizer = QbTokenizer()
+    cache_path = str(tmp_path / "tokens.sqlite3")
+    indices = [[12, 25, 40, 60, len(TEXT)]]
+    expected = [tokenizer(TEXT[:ix]) for ix in indices[0]]
+    for _ in range(2):
+        run_tokens = tokenizer.run_tokens(
+            [TEXT], indices, qanta_ids=[0], cache_path=cache_path
+        )
+        assert run_tokens == expected